@@ -0,0 +1,520 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import netCDF4
+import numpy
+import pystare
+import staremaster.conversions
+import staremaster.create_sidecar_files
+import staremaster.products
+from staremaster.sidecar import Sidecar, available_compressions, read_sids, GEOLOCATIONS, SID_ENCODINGS
+
+
+DEFAULT_CODECS = ['none', 'zlib:1', 'zlib:4', 'zlib:9', 'zstd:1', 'zstd:3', 'zstd:9', 'bzip2:9',
+                  'blosc_lz4:5', 'blosc_lz4hc:5', 'blosc_zstd:5', 'blosc_zlib:5']
+DEFAULT_SID_CODECS = ['zlib:4', 'zstd:3', 'blosc_zstd:5']
+DEFAULT_MERGE_SIZES = [10**6, 10**7, 10**8]
+DEFAULT_STARTUP_PRODUCTS = ['MOD05', 'VNP03IMG', 'SSMIS']
+# Imports the modules given as arguments in this interpreter ('import') or in a spawned pool worker ('spawn') and
+# prints the seconds it took (including the start of the worker)
+STARTUP_SCRIPT = '''
+import importlib, multiprocessing, sys, time
+start = time.perf_counter()
+if sys.argv[1] == 'spawn':
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        pool.apply(exec, ('import ' + ', '.join(sys.argv[2:]),))
+else:
+    for module in sys.argv[2:]:
+        importlib.import_module(module)
+print(time.perf_counter() - start)
+'''
+
+
+def split_varname(varname, prefix):
+    # 'STARE_index_500m' -> '500m'; 'STARE_index' -> None
+    nom_res = varname[len(prefix) + 1:]
+    return nom_res or None
+
+
+def read_variables(grp):
+    variables = {}
+    for varname, variable in grp.variables.items():
+        variable.set_auto_mask(False)
+        if 'sid_encoding' in variable.ncattrs():
+            data = read_sids(variable).data
+            fill_value = getattr(variable, 'sid_fill_value', None)
+        else:
+            data = variable[:]
+            fill_value = getattr(variable, '_FillValue', None)
+        variables[varname] = (data, fill_value)
+    return variables
+
+
+def read_sidecar(file_path):
+    """ Reads all dimensions and variables of a sidecar into memory, keyed by group (None for the root group)"""
+    content = {}
+    with netCDF4.Dataset(file_path, 'r', format='NETCDF4') as rootgrp:
+        groups = [(None, rootgrp)] + list(rootgrp.groups.items())
+        for name, grp in groups:
+            dimensions = {dim_name: dim.size for dim_name, dim in grp.dimensions.items()}
+            content[name] = (dimensions, read_variables(grp))
+    return content
+
+
+def read_references(file_path):
+    """ Reads the source variables of the geolocation of a sidecar written with geolocation='reference',
+    keyed by (group, varname)"""
+    references = {}
+    with netCDF4.Dataset(file_path, 'r', format='NETCDF4') as rootgrp:
+        groups = [(None, rootgrp)] + list(rootgrp.groups.items())
+        for name, grp in groups:
+            for varname, variable in grp.variables.items():
+                if 'source_variable' in variable.ncattrs():
+                    references[(name, varname)] = variable.source_variable
+    return references
+
+
+def replay_sidecar(content, sidecar, references=None):
+    """ Writes the content returned by read_sidecar() through the Sidecar write API"""
+    if references is None:
+        references = {}
+    for group, (dimensions, variables) in content.items():
+        for dim_name, size in dimensions.items():
+            if dim_name != 'l':
+                # write_cover() creates the 'l' dimension
+                sidecar.write_dimension(dim_name, size, group=group)
+        for varname, (data, fill_value) in variables.items():
+            if varname.startswith('Longitude'):
+                sidecar.write_lons(data, nom_res=split_varname(varname, 'Longitude'), group=group,
+                                   fill_value=fill_value, reference=references.get((group, varname)))
+            elif varname.startswith('Latitude'):
+                sidecar.write_lats(data, nom_res=split_varname(varname, 'Latitude'), group=group,
+                                   fill_value=fill_value, reference=references.get((group, varname)))
+            elif varname.startswith('STARE_index'):
+                sidecar.write_sids(data, nom_res=split_varname(varname, 'STARE_index'), group=group,
+                                   fill_value=fill_value)
+            elif varname.startswith('STARE_cover'):
+                sidecar.write_cover(data, group=group, fill_value=fill_value)
+
+
+def granule_content(file_path, product, out_path):
+    """ Creates the sidecar of a granule once and returns its content (see read_sidecar())"""
+    granule = staremaster.create_sidecar_files.get_granule(file_path, product)
+    granule.load()
+    sidecar = granule.create_sidecar(n_workers=1, out_path=out_path)
+    content = read_sidecar(sidecar.file_path)
+    os.remove(sidecar.file_path)
+    return content
+
+
+def granule_references(file_path, product, out_path):
+    """ Creates the sidecar of a granule with geolocation='reference' once and returns its references
+    (see read_references())"""
+    granule = staremaster.create_sidecar_files.get_granule(file_path, product)
+    granule.load()
+    sidecar = granule.create_sidecar(n_workers=1, out_path=out_path, geolocation='reference')
+    references = read_references(sidecar.file_path)
+    os.remove(sidecar.file_path)
+    return references
+
+
+def content_nbytes(content):
+    return sum(data.nbytes for _, variables in content.values() for data, _ in variables.values())
+
+
+def time_write(content, sidecar, session, references=None):
+    start = time.perf_counter()
+    if session:
+        with sidecar:
+            replay_sidecar(content, sidecar, references)
+    else:
+        replay_sidecar(content, sidecar, references)
+        sidecar.close()
+    return time.perf_counter() - start
+
+
+def time_read(file_path):
+    start = time.perf_counter()
+    read_sidecar(file_path)
+    return time.perf_counter() - start
+
+
+def parse_codec(codec):
+    """ Parses a codec specification of the form compression[:complevel]
+
+    >>> parse_codec('zstd:3')
+    ('zstd', 3)
+    >>> parse_codec('none')
+    (None, 0)
+    """
+    compression, _, complevel = codec.partition(':')
+    if compression.lower() == 'none':
+        return None, 0
+    return compression, int(complevel or 4)
+
+
+def benchmark_write(file_paths, product=None, repeat=3):
+    """ Compares the per-granule write time of per-call open/close cycles against a single write session.
+
+    The SIDs are computed once per granule; only the writing of the sidecar is timed.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        out_path = tmp_dir + '/'
+        for file_path in file_paths:
+            content = granule_content(file_path, product, out_path)
+
+            times = {False: [], True: []}
+            for _ in range(repeat):
+                for session in times:
+                    sidecar = Sidecar(file_path, out_path)
+                    times[session].append(time_write(content, sidecar, session=session))
+                    os.remove(sidecar.file_path)
+            per_call = min(times[False])
+            session = min(times[True])
+            results.append((file_path, per_call, session))
+            print('{name}: per-call {per_call:.3f} s, session {session:.3f} s ({speedup:.2f}x)'.format(
+                name=os.path.basename(file_path), per_call=per_call, session=session, speedup=per_call / session))
+    return results
+
+
+def benchmark_codecs(file_paths, codecs=None, product=None, repeat=3):
+    """ Writes the sidecar of each granule with each codec and reports write throughput, read throughput and size.
+
+    Throughputs are in MB/s of uncompressed sidecar content. Codecs not supported by the installed netCDF4
+    library are skipped.
+    """
+    if codecs is None:
+        codecs = DEFAULT_CODECS
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        out_path = tmp_dir + '/'
+        for file_path in file_paths:
+            content = granule_content(file_path, product, out_path)
+            nbytes = content_nbytes(content)
+            print('{name} ({mb:.1f} MB uncompressed)'.format(name=os.path.basename(file_path), mb=nbytes / 1e6))
+            print('{:>16} {:>12} {:>12} {:>10} {:>7}'.format('codec', 'write MB/s', 'read MB/s', 'size MB', 'ratio'))
+            for codec in codecs:
+                compression, complevel = parse_codec(codec)
+                if compression not in available_compressions():
+                    print('{:>16} not supported by the installed netCDF4 library'.format(codec))
+                    continue
+                write_times = []
+                read_times = []
+                for _ in range(repeat):
+                    sidecar = Sidecar(file_path, out_path, compression=compression, complevel=complevel)
+                    write_times.append(time_write(content, sidecar, session=True))
+                    read_times.append(time_read(sidecar.file_path))
+                    size = os.path.getsize(sidecar.file_path)
+                    os.remove(sidecar.file_path)
+                write_time = min(write_times)
+                read_time = min(read_times)
+                results.append((file_path, codec, nbytes / write_time, nbytes / read_time, size))
+                print('{:>16} {:>12.1f} {:>12.1f} {:>10.2f} {:>7.2f}'.format(
+                    codec, nbytes / write_time / 1e6, nbytes / read_time / 1e6, size / 1e6, nbytes / size))
+    return results
+
+
+def benchmark_geolocation(file_paths, product=None, precision=1e-5, repeat=3):
+    """ Writes the sidecar of each granule with each geolocation storage mode and reports write time and size.
+
+    'reference' falls back to full storage for geolocation that is not stored as-is in the granule (e.g. the
+    interpolated MOD09 500m geolocation).
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        out_path = tmp_dir + '/'
+        for file_path in file_paths:
+            content = granule_content(file_path, product, out_path)
+            references = granule_references(file_path, product, out_path)
+            print(os.path.basename(file_path))
+            print('{:>10} {:>12} {:>10} {:>7}'.format('mode', 'write s', 'size MB', 'ratio'))
+            full_size = None
+            for geolocation in GEOLOCATIONS:
+                write_times = []
+                for _ in range(repeat):
+                    sidecar = Sidecar(file_path, out_path, geolocation=geolocation, geolocation_precision=precision)
+                    write_times.append(time_write(content, sidecar, session=True, references=references))
+                    size = os.path.getsize(sidecar.file_path)
+                    os.remove(sidecar.file_path)
+                if full_size is None:
+                    full_size = size
+                write_time = min(write_times)
+                results.append((file_path, geolocation, write_time, size))
+                print('{:>10} {:>12.3f} {:>10.2f} {:>7.2f}'.format(geolocation, write_time, size / 1e6,
+                                                                   full_size / size))
+    return results
+
+
+def benchmark_sid_encoding(file_paths, codecs=None, product=None, repeat=3):
+    """ Writes the sidecar of each granule with each SID encoding and codec and reports write time, read time
+    (including decoding) and size. The geolocation is omitted so that the sizes are those of the SIDs and cover.
+    """
+    if codecs is None:
+        codecs = DEFAULT_SID_CODECS
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        out_path = tmp_dir + '/'
+        for file_path in file_paths:
+            content = granule_content(file_path, product, out_path)
+            print(os.path.basename(file_path))
+            print('{:>16} {:>8} {:>10} {:>10} {:>10}'.format('codec', 'encoding', 'write s', 'read s', 'size MB'))
+            for codec in codecs:
+                compression, complevel = parse_codec(codec)
+                if compression not in available_compressions():
+                    print('{:>16} not supported by the installed netCDF4 library'.format(codec))
+                    continue
+                for sid_encoding in SID_ENCODINGS:
+                    write_times = []
+                    read_times = []
+                    for _ in range(repeat):
+                        sidecar = Sidecar(file_path, out_path, compression=compression, complevel=complevel,
+                                          geolocation='none', sid_encoding=sid_encoding)
+                        write_times.append(time_write(content, sidecar, session=True))
+                        read_times.append(time_read(sidecar.file_path))
+                        size = os.path.getsize(sidecar.file_path)
+                        os.remove(sidecar.file_path)
+                    write_time = min(write_times)
+                    read_time = min(read_times)
+                    results.append((file_path, codec, sid_encoding, write_time, read_time, size))
+                    print('{:>16} {:>8} {:>10.3f} {:>10.3f} {:>10.2f}'.format(codec, sid_encoding, write_time,
+                                                                           read_time, size / 1e6))
+    return results
+
+
+def synthetic_latlon(shape):
+    """ A smooth swath-like lat/lon grid of the given shape """
+    rows, cols = shape
+    lats, lons = numpy.meshgrid(numpy.linspace(30, 40, rows), numpy.linspace(-100, -85, cols), indexing='ij')
+    lats = lats + 0.5 * numpy.sin(numpy.radians(lons) * 20)
+    return numpy.ascontiguousarray(lats), numpy.ascontiguousarray(lons)
+
+
+def granule_latlon(file_path, product=None):
+    """ The lat/lon arrays of the first resolution/scan of a granule """
+    granule = staremaster.create_sidecar_files.get_granule(file_path, product)
+    granule.load()
+    lats, lons = granule.lats, granule.lons
+    if isinstance(lats, dict):
+        key = list(lats)[0]
+        lats, lons = lats[key], lons[key]
+    return lats, lons
+
+
+def benchmark_backends(inputs, backends=None, n_workers=2, repeat=3):
+    """ Times latlon2stare with each parallel backend (and serially) on each (name, lats, lons) input.
+
+    The first call of a backend includes starting its cluster/pool and is reported separately.
+    """
+    if backends is None:
+        backends = staremaster.conversions.BACKENDS
+    results = []
+    for name, lats, lons in inputs:
+        print('{name} {shape}'.format(name=name, shape=lats.shape))
+        print('{:>10} {:>10} {:>10}'.format('backend', 'first s', 'warm s'))
+        for backend in ['serial'] + list(backends):
+            workers = 1 if backend == 'serial' else n_workers
+            times = []
+            for _ in range(repeat + 1):
+                start = time.perf_counter()
+                staremaster.conversions.latlon2stare(lats, lons, n_workers=workers, backend=backend)
+                times.append(time.perf_counter() - start)
+            results.append((name, backend, times[0], min(times[1:])))
+            print('{:>10} {:>10.3f} {:>10.3f}'.format(backend, times[0], min(times[1:])))
+    staremaster.conversions.shutdown_client()
+    staremaster.conversions.shutdown_pool()
+    return results
+
+
+def synthetic_sids(n_sids, level=14, pixels_per_trixel=100, holes=0.02, seed=0):
+    """ n_sids unsorted SIDs of the given level like the coerced iFOV SIDs of a swath: about pixels_per_trixel SIDs
+    per trixel of a contiguous region with a fraction of holes (e.g. masked pixels) """
+    rng = numpy.random.default_rng(seed)
+    first = int(pystare.from_latlon(numpy.array([35.0]), numpy.array([-95.0]), level)[0]) >> (5 + 2 * (27 - level))
+    region = numpy.arange(max(n_sids // pixels_per_trixel, 1), dtype=numpy.int64) + first
+    region = region[rng.random(region.size) >= holes]
+    trixels = rng.choice(region, size=n_sids)
+    return ((trixels << (2 * (27 - level))) << 5) | level
+
+
+def pystare_merge(sids):
+    """ The former serial merge_stare: unique, then pystare's compressed range expansion """
+    sids = numpy.unique(pystare.spatial_clear_to_resolution(sids))
+    return pystare.expand_intervals(pystare.to_compressed_range(sids), -1, multi_resolution=True)
+
+
+MERGE_METHODS = ['pystare', 'tree', 'parallel']
+
+
+def benchmark_merge(sizes=None, methods=None, n_workers=2, repeat=3):
+    """ Times merge_stare (the tree reduction, serially and on n_workers) and the former pystare merge on synthetic
+    SIDs. The pool is started before timing """
+    if sizes is None:
+        sizes = DEFAULT_MERGE_SIZES
+    if methods is None:
+        methods = MERGE_METHODS
+    merges = {'pystare': pystare_merge,
+              'tree': staremaster.conversions.merge_stare,
+              'parallel': lambda sids: staremaster.conversions.merge_stare(sids, n_workers=n_workers)}
+    if 'parallel' in methods:
+        staremaster.conversions.get_pool(n_workers)
+    results = []
+    print('{:>12} {:>10} {:>10} {:>10}'.format('sids', 'method', 'seconds', 'cover'))
+    for size in sizes:
+        sids = synthetic_sids(size)
+        for method in methods:
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                cover = merges[method](sids)
+                times.append(time.perf_counter() - start)
+            results.append((size, method, min(times), cover.size))
+            print('{:>12} {:>10} {:>10.3f} {:>10}'.format(size, method, min(times), cover.size))
+    staremaster.conversions.shutdown_pool()
+    return results
+
+
+def startup_time(modules, mode):
+    output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, mode] + modules, check=True,
+                            stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return float(output.split()[-1])
+
+
+def benchmark_startup(products=None, repeat=3):
+    """ Times the cold start of create_sidecar_files.py in fresh interpreters: --help, and importing what a run (or
+    a spawned --parallel_files worker) of each product needs, compared with importing every product module, dask and
+    distributed, as staremaster did before the product registry """
+    if products is None:
+        products = DEFAULT_STARTUP_PRODUCTS
+    eager = ['dask.array', 'distributed'] + \
+            sorted(set('staremaster.products.' + module for module in staremaster.products.CLASSES.values())) + \
+            ['staremaster.create_sidecar_files']
+    cases = [('eager', eager)]
+    for product in products:
+        module = staremaster.products.PRODUCTS[product.upper()].split(':')[0]
+        cases.append((product, ['staremaster.create_sidecar_files', module]))
+
+    results = []
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-m', 'staremaster.create_sidecar_files', '--help'], check=True,
+                       stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    results.append(('--help', 'process', min(times)))
+    print('{:>12} {:>8} {:>10}'.format('imports', 'mode', 'seconds'))
+    print('{:>12} {:>8} {:>10.3f}'.format('--help', 'process', min(times)))
+    for name, modules in cases:
+        for mode in ['import', 'spawn']:
+            seconds = min(startup_time(modules, mode) for _ in range(repeat))
+            results.append((name, mode, seconds))
+            print('{:>12} {:>8} {:>10.3f}'.format(name, mode, seconds))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks sidecar creation')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    write_parser = subparsers.add_parser('write', help='per-granule sidecar write time with and without a session')
+    write_parser.add_argument('--files', metavar='files', nargs='+', type=str, required=True,
+                              help='the granules to benchmark (e.g. tests/data/mod09/*.hdf)')
+    write_parser.add_argument('--product', metavar='product', type=str, default=None,
+                              help='product of the granules; default: guessed from the file name')
+    write_parser.add_argument('--repeat', type=int, default=3,
+                              help='number of repetitions; the fastest is reported')
+
+    codecs_parser = subparsers.add_parser('codecs', help='write/read throughput and size of compression codecs')
+    codecs_parser.add_argument('--files', metavar='files', nargs='+', type=str, required=True,
+                               help='the sample granules to benchmark')
+    codecs_parser.add_argument('--product', metavar='product', type=str, default=None,
+                               help='product of the granules; default: guessed from the file name')
+    codecs_parser.add_argument('--codecs', metavar='codecs', nargs='+', type=str, default=DEFAULT_CODECS,
+                               help='codecs as compression[:complevel]. Default: {}'.format(' '.join(DEFAULT_CODECS)))
+    codecs_parser.add_argument('--repeat', type=int, default=3,
+                               help='number of repetitions; the fastest is reported')
+
+    geolocation_parser = subparsers.add_parser('geolocation', help='write time and size of geolocation storage modes')
+    geolocation_parser.add_argument('--files', metavar='files', nargs='+', type=str, required=True,
+                                    help='the sample granules to benchmark')
+    geolocation_parser.add_argument('--product', metavar='product', type=str, default=None,
+                                    help='product of the granules; default: guessed from the file name')
+    geolocation_parser.add_argument('--precision', type=float, default=1e-5,
+                                    help='precision of the quantized geolocation in degrees')
+    geolocation_parser.add_argument('--repeat', type=int, default=3,
+                                    help='number of repetitions; the fastest is reported')
+
+    sids_parser = subparsers.add_parser('sid_encoding', help='write/read time and size of the SID encodings')
+    sids_parser.add_argument('--files', metavar='files', nargs='+', type=str, required=True,
+                             help='the sample granules to benchmark')
+    sids_parser.add_argument('--product', metavar='product', type=str, default=None,
+                             help='product of the granules; default: guessed from the file name')
+    sids_parser.add_argument('--codecs', metavar='codecs', nargs='+', type=str, default=DEFAULT_SID_CODECS,
+                             help='codecs as compression[:complevel]. Default: {}'.format(' '.join(DEFAULT_SID_CODECS)))
+    sids_parser.add_argument('--repeat', type=int, default=3,
+                             help='number of repetitions; the fastest is reported')
+
+    backends_parser = subparsers.add_parser('backends', help='latlon2stare time of the parallel backends')
+    backends_parser.add_argument('--files', metavar='files', nargs='+', type=str, default=[],
+                                 help='granules to take the lat/lon of (first resolution/scan)')
+    backends_parser.add_argument('--product', metavar='product', type=str, default=None,
+                                 help='product of the granules; default: guessed from the file name')
+    backends_parser.add_argument('--shape', metavar='ROWSxCOLS', type=str, default=None,
+                                 help='convert a synthetic lat/lon grid of this shape (e.g. 6464x6400, the size of '
+                                      'a VNP03IMG granule)')
+    backends_parser.add_argument('--workers', type=int, default=2,
+                                 help='number of workers of the parallel backends')
+    backends_parser.add_argument('--repeat', type=int, default=3,
+                                 help='number of repetitions after the first call; the fastest is reported')
+
+    merge_parser = subparsers.add_parser('merge', help='merge_stare time on synthetic SIDs')
+    merge_parser.add_argument('--sizes', metavar='sizes', nargs='+', type=lambda n: int(float(n)),
+                              default=DEFAULT_MERGE_SIZES,
+                              help='numbers of SIDs. Default: 1e6 1e7 1e8')
+    merge_parser.add_argument('--methods', metavar='methods', nargs='+', choices=MERGE_METHODS,
+                              default=MERGE_METHODS,
+                              help='pystare (the former serial merge; slow), tree (serial tree reduction) and/or '
+                                   'parallel (tree reduction on --workers processes). Default: all')
+    merge_parser.add_argument('--workers', type=int, default=2,
+                              help='number of workers of the parallel merge')
+    merge_parser.add_argument('--repeat', type=int, default=3,
+                              help='number of repetitions; the fastest is reported')
+
+    startup_parser = subparsers.add_parser('startup', help='cold start time of create_sidecar_files.py and of '
+                                                           'spawned workers')
+    startup_parser.add_argument('--products', metavar='products', nargs='+', type=str,
+                                default=DEFAULT_STARTUP_PRODUCTS,
+                                help='products to time the imports of. Default: {}'.format(
+                                    ' '.join(DEFAULT_STARTUP_PRODUCTS)))
+    startup_parser.add_argument('--repeat', type=int, default=3,
+                                help='number of repetitions; the fastest is reported')
+
+    args = parser.parse_args()
+
+    if args.benchmark == 'write':
+        benchmark_write(args.files, product=args.product, repeat=args.repeat)
+    elif args.benchmark == 'codecs':
+        benchmark_codecs(args.files, codecs=args.codecs, product=args.product, repeat=args.repeat)
+    elif args.benchmark == 'geolocation':
+        benchmark_geolocation(args.files, product=args.product, precision=args.precision, repeat=args.repeat)
+    elif args.benchmark == 'sid_encoding':
+        benchmark_sid_encoding(args.files, codecs=args.codecs, product=args.product, repeat=args.repeat)
+    elif args.benchmark == 'backends':
+        inputs = [(os.path.basename(file_path),) + granule_latlon(file_path, args.product) for file_path in args.files]
+        if args.shape:
+            shape = tuple(int(n) for n in args.shape.lower().split('x'))
+            inputs.append(('synthetic',) + synthetic_latlon(shape))
+        benchmark_backends(inputs, n_workers=args.workers, repeat=args.repeat)
+    elif args.benchmark == 'merge':
+        benchmark_merge(args.sizes, methods=args.methods, n_workers=args.workers, repeat=args.repeat)
+    elif args.benchmark == 'startup':
+        benchmark_startup(args.products, repeat=args.repeat)
+
+
+if __name__ == '__main__':
+    main()
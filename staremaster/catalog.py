@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+""" SQLite catalog of the processed granules.
+
+The catalog records the sidecar, product, status, timings and cover resolution of each granule. It replaces the
+text archive of create_sidecar_files.py (--archive), which is re-read and split on every run: lookups go through the
+granule primary key, records are inserted in batches and the database runs in WAL mode, so readers (e.g.
+find_missing_sidecars.py) do not block the writer.
+"""
+
+import argparse
+import itertools
+import sqlite3
+import time
+
+STATUSES = ['done', 'failed']
+COLUMNS = ['granule', 'sidecar', 'product', 'status', 'cover_res', 'started', 'read_seconds', 'convert_seconds',
+           'error']
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS granules (
+    granule TEXT PRIMARY KEY,
+    sidecar TEXT,
+    product TEXT,
+    status TEXT NOT NULL,
+    cover_res INTEGER,
+    started REAL,
+    read_seconds REAL,
+    convert_seconds REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS granules_status ON granules (status, product);
+"""
+# Records held back before they are written in one transaction
+BATCH_SIZE = 1000
+# Seconds after which held back records are written even if the batch is not full
+FLUSH_INTERVAL = 10
+# Granules looked up at a time when a stream of granules is filtered
+LOOKUP_BATCH_SIZE = 256
+# Seconds to wait for the write lock of another process
+BUSY_TIMEOUT = 60
+
+
+class Catalog:
+    """ A catalog database at path; records are written in batches of batch_size (or after flush_interval seconds)
+    and when the catalog is closed.
+
+    >>> with Catalog(':memory:') as catalog:
+    ...     catalog.record('MOD05_L2.A2005349.2125.hdf', 'MOD05_L2.A2005349.2125_stare.nc', product='MOD05')
+    ...     catalog.record('MOD05_L2.A2005349.2130.hdf', product='MOD05', status='failed', error='OSError')
+    ...     catalog.processed(['MOD05_L2.A2005349.2125.hdf', 'MOD05_L2.A2005349.2130.hdf'])
+    ['MOD05_L2.A2005349.2125.hdf']
+    """
+
+    def __init__(self, path, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.last_flush = time.monotonic()
+        self.connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        # WAL mode is consistent after a crash with synchronous=NORMAL; only the last transactions may be lost
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.connection is not None:
+            self.flush()
+            self.connection.close()
+            self.connection = None
+
+    def record(self, granule, sidecar=None, product=None, status='done', cover_res=None, started=None,
+               read_seconds=None, convert_seconds=None, error=None):
+        """ Records (or updates) a granule """
+        if status not in STATUSES:
+            raise ValueError('status {} is not supported; available: {}'.format(status, STATUSES))
+        self.pending.append((granule, sidecar, product, status, cover_res, started, read_seconds, convert_seconds,
+                             error))
+        if len(self.pending) >= self.batch_size or time.monotonic() - self.last_flush > self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            with self.connection:
+                self.connection.executemany('INSERT OR REPLACE INTO granules VALUES ({})'.format(
+                    ', '.join('?' * len(COLUMNS))), self.pending)
+            self.pending = []
+        self.last_flush = time.monotonic()
+
+    def processed(self, file_paths, status='done'):
+        """ The granules of file_paths recorded with status """
+        processed = self.lookup(file_paths, status)
+        return [file_path for file_path in file_paths if file_path in processed]
+
+    def lookup(self, file_paths, status='done'):
+        """ The sidecars of the granules of file_paths recorded with status as a {granule: sidecar} dict """
+        self.flush()
+        with self.connection:
+            self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS lookup (granule TEXT PRIMARY KEY)')
+            self.connection.execute('DELETE FROM lookup')
+            self.connection.executemany('INSERT OR IGNORE INTO lookup VALUES (?)',
+                                        ((file_path,) for file_path in file_paths))
+            rows = self.connection.execute('SELECT granule, granules.sidecar FROM lookup JOIN granules '
+                                           'USING (granule) WHERE granules.status = ?', (status,)).fetchall()
+            self.connection.execute('DELETE FROM lookup')
+        return dict(rows)
+
+    def skip_processed(self, file_paths, batch_size=LOOKUP_BATCH_SIZE):
+        """ Yields the granules of file_paths (e.g. a generator of a folder scan) that have no sidecar in the
+        catalog yet, looking them up batch_size at a time """
+        file_paths = iter(file_paths)
+        n_skipped = 0
+        while True:
+            batch = list(itertools.islice(file_paths, batch_size))
+            if not batch:
+                break
+            processed = self.lookup(batch)
+            n_skipped += len(processed)
+            for file_path in batch:
+                if file_path not in processed:
+                    yield file_path
+        if n_skipped:
+            print(f'{n_skipped} granules are recorded in the catalog and were not processed')
+
+    def remove_processed(self, file_paths):
+        """ The granules of file_paths that have no sidecar in the catalog yet """
+        processed = set(self.processed(file_paths))
+        print(f'{len(processed)} out of {len(file_paths)} been recorded in the catalog and will not be processed')
+        return [file_path for file_path in file_paths if file_path not in processed]
+
+    def query(self, status=None, product=None):
+        """ The records (as dicts) with status and product (all if None) """
+        self.flush()
+        conditions = []
+        parameters = []
+        if status is not None:
+            conditions.append('status = ?')
+            parameters.append(status)
+        if product is not None:
+            conditions.append('product = ?')
+            parameters.append(product)
+        sql = 'SELECT {} FROM granules'.format(', '.join(COLUMNS))
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        return [dict(zip(COLUMNS, row)) for row in self.connection.execute(sql + ' ORDER BY granule', parameters)]
+
+    def summary(self):
+        """ Number of granules and total seconds spent on them per product and status """
+        self.flush()
+        rows = self.connection.execute('SELECT product, status, COUNT(*), '
+                                       'TOTAL(COALESCE(read_seconds, 0) + COALESCE(convert_seconds, 0)) '
+                                       'FROM granules GROUP BY product, status ORDER BY product, status')
+        return [dict(zip(['product', 'status', 'granules', 'seconds'], row)) for row in rows]
+
+    def import_archive(self, archive):
+        """ Records the 'granule, sidecar' lines of a text archive (--archive) as done; returns the number of
+        granules """
+        n_granules = 0
+        with open(archive, 'r') as cat:
+            for row in cat:
+                fields = [field.strip() for field in row.split(',')]
+                if not fields[0]:
+                    continue
+                sidecar = fields[1] if len(fields) > 1 and fields[1] else None
+                self.record(fields[0], sidecar)
+                n_granules += 1
+        self.flush()
+        return n_granules
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Queries and imports into the catalog of processed granules')
+    parser.add_argument('catalog', type=str, help='the catalog database (e.g. as written by create_sidecar_files.py '
+                                                  '--catalog)')
+    parser.add_argument('--import_archive', metavar='archive', type=str, nargs='+',
+                        help='record the granules of text archives (create_sidecar_files.py --archive) as done')
+    parser.add_argument('--status', type=str, choices=STATUSES, help='list the granules with status')
+    parser.add_argument('--product', type=str, help='list only granules of product')
+    args = parser.parse_args()
+
+    with Catalog(args.catalog) as catalog:
+        for archive in args.import_archive or []:
+            print('imported {} granules from {}'.format(catalog.import_archive(archive), archive))
+        if args.status or args.product:
+            for record in catalog.query(status=args.status, product=args.product):
+                print('{}, {}, {}'.format(record['granule'], record['sidecar'] or '', record['error'] or ''))
+        else:
+            for row in catalog.summary():
+                print('{product}: {granules} {status} ({seconds:.0f} s)'.format(**row))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,44 +1,513 @@
-import xarray
+import atexit
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import math
+import os
+import tempfile
+import threading
+import time
+import warnings
 import pystare
 import numpy
-import distributed
 import multiprocessing
+import multiprocessing.shared_memory
 
 
 # This is a workaround for https://github.com/dask/distributed/issues/4168
 # import multiprocessing.popen_spawn_posix
 
+# The dask client shared by all conversions of this process (see get_client())
+dask_client = None
+# Workers of the shared client's local cluster; None if the client is connected to an external scheduler
+dask_client_workers = None
+# The process pool of the 'shm' backend and its number of processes (see get_pool())
+process_pool = None
+process_pool_size = None
+
+BACKENDS = ['dask', 'shm', 'threads']
+# Backend of latlon2stare() calls that do not choose one (see set_backend())
+default_backend = 'dask'
+# Pixels of overlap between neighbouring blocks of a parallel conversion. from_latlon_2d adapts the level of a pixel
+# to its distance to the neighbouring pixels, so a block needs the border pixels of its neighbours to get the same
+# levels as the serial conversion.
+HALO = 1
+# Chunk planning of parallel conversions (see plan_chunks() and set_chunks()): bytes of lat, lon and SID per pixel,
+# target bytes per task, tasks per worker for load balancing and the fewest rows of a row chunk (halo overhead)
+PIXEL_BYTES = 24
+CHUNK_BYTES = 2**24
+TASKS_PER_WORKER = 4
+MIN_CHUNK_ROWS = 16
+# Fixed (rows, cols) chunk shape and target bytes per task that override the planner (see set_chunks())
+conversion_chunks = None
+conversion_chunk_bytes = CHUNK_BYTES
+# SIDs per block of resolution_stats()
+STATS_BLOCK_SIZE = 2**20
+# Bytes of covers kept in memory and of cover files kept on disk by the cover cache, the share of the latter left
+# after an eviction, and the precision in degrees of the GRing vertices that key it (see CoverCache)
+COVER_CACHE_MEMORY_BYTES = 2**28
+COVER_CACHE_BYTES = 2**30
+COVER_CACHE_EVICT_TO = 0.9
+GRING_PRECISION = 1e-6
+RESOLUTION_ESTIMATES = ['pystare', 'spacing']
+# How latlon2stare() calls that adapt the resolution estimate it (see set_resolution_estimate())
+default_resolution_estimate = 'pystare'
+EARTH_RADIUS_KM = 6371.0
+# Pixels SPACING_SCALE_KM / 2**r km apart are adapted to resolution r by pystare (pi / sqrt(2) radians, calibrated
+# against pystare.from_latlon_2d(adapt_level=True))
+SPACING_SCALE_KM = numpy.pi / numpy.sqrt(2) * EARTH_RADIUS_KM
+# Fill values of masked conversions that do not set their own (see latlon2stare())
+MASK_FILL_IN = -999.0
+MASK_FILL_OUT = -1
+
+
+def connect(scheduler_address=None, scheduler_file=None, n_workers=None):
+    """ Creates the dask client used by all subsequent conversions with n_workers > 1: connected to an external
+    scheduler (by address or scheduler file) or, without either, to a new local cluster of n_workers workers.
+    Replaces (and shuts down) the current client. """
+    global dask_client, dask_client_workers
+    # Imported on first use, like dask.array in latlon2stare_dask(): they take a second to import, which short jobs
+    # that never start a cluster (or --help) would pay
+    import distributed
+    shutdown_client()
+    if scheduler_address or scheduler_file:
+        dask_client = distributed.Client(address=scheduler_address, scheduler_file=scheduler_file)
+    else:
+        dask_client = distributed.Client(n_workers=n_workers)
+        dask_client_workers = n_workers
+    return dask_client
+
+
+def get_client(n_workers=1):
+    """ The shared dask client. A local cluster of n_workers is started on first use and reused until
+    shutdown_client() (called at exit), rather than starting a cluster per conversion. Like the pool of get_pool(),
+    the local cluster is restarted if n_workers changes; a client connected to an external scheduler is used as is. """
+    if dask_client is None or dask_client_workers not in (None, n_workers):
+        connect(n_workers=n_workers)
+    return dask_client
+
+
+def shutdown_client():
+    """ Closes the shared dask client (and the local cluster it started, if any) """
+    global dask_client, dask_client_workers
+    if dask_client is not None:
+        dask_client.close()
+        dask_client = None
+        dask_client_workers = None
+
+
+atexit.register(shutdown_client)
+
+
+def get_pool(n_workers):
+    """ The process pool of the 'shm' backend; started on first use and reused while n_workers stays the same """
+    global process_pool, process_pool_size
+    if process_pool is not None and process_pool_size != n_workers:
+        shutdown_pool()
+    if process_pool is None:
+        process_pool = multiprocessing.Pool(processes=n_workers)
+        process_pool_size = n_workers
+    return process_pool
+
+
+def shutdown_pool():
+    global process_pool, process_pool_size
+    if process_pool is not None:
+        process_pool.close()
+        process_pool.join()
+        process_pool = None
+        process_pool_size = None
+
+
+atexit.register(shutdown_pool)
+
+
+def set_backend(backend):
+    """ Sets the backend of all latlon2stare() calls with n_workers > 1 that do not choose one:
+
+    - 'dask': chunks are converted on the shared dask client (see get_client())
+    - 'shm': blocks are converted in place in shared memory by a persistent process pool (see get_pool())
+    - 'threads': blocks are converted by a thread pool in this process, if pystare releases the GIL
+      (see pystare_releases_gil()); serially otherwise
+    """
+    global default_backend
+    if backend not in BACKENDS:
+        raise ValueError('backend {} is not supported; available: {}'.format(backend, BACKENDS))
+    default_backend = backend
+
+
+def set_resolution_estimate(estimate):
+    """ Sets how latlon2stare() estimates the resolution of each pixel when it adapts the resolution:
+
+    - 'pystare': pystare.from_latlon_2d looks up the location and estimates the resolution in one pass
+    - 'spacing': two phases; the level 27 locations are looked up, then leveled by the pixel spacing (see
+      locations2stare()). The same SIDs can be leveled again later without a lookup.
+    """
+    global default_resolution_estimate
+    if estimate not in RESOLUTION_ESTIMATES:
+        raise ValueError('resolution estimate {} is not supported; available: {}'.format(estimate,
+                                                                                        RESOLUTION_ESTIMATES))
+    default_resolution_estimate = estimate
+
+
+def set_chunks(chunks=None, chunk_bytes=None):
+    """ Sets a fixed (rows, cols) chunk shape for all parallel conversions (-1 for a whole dimension) and/or the
+    target bytes per task of plan_chunks(); None keeps (chunk_bytes) or removes (chunks) the current setting """
+    global conversion_chunks, conversion_chunk_bytes
+    conversion_chunks = tuple(chunks) if chunks is not None else None
+    if chunk_bytes is not None:
+        conversion_chunk_bytes = chunk_bytes
+
+
+def plan_chunks(shape, n_workers, pixel_bytes=PIXEL_BYTES, chunk_bytes=None, tiles=False):
+    """ (rows, cols) chunk shape for converting lat/lon arrays of shape on n_workers.
+
+    There are at least TASKS_PER_WORKER tasks per worker so that all workers stay busy, and more if a task would
+    exceed chunk_bytes (lat, lon and SID bytes). Chunks span whole rows, which keeps them contiguous, unless that
+    leaves fewer than MIN_CHUNK_ROWS rows per chunk or tiles is set (so that masked tiles can be skipped); then
+    columns are split as well into squarish tiles, which need the fewest halo pixels.
+
+    >>> plan_chunks((406, 270), 4)
+    (26, 270)
+    >>> plan_chunks((10, 6400), 8)
+    (10, 200)
+    >>> plan_chunks((21696, 21696), 8, chunk_bytes=2**24)
+    (33, 21696)
+    >>> plan_chunks((21696, 21696), 8, chunk_bytes=2**24, tiles=True)
+    (835, 837)
+    """
+    if conversion_chunks is not None:
+        return tuple(n if n > 0 else size for n, size in zip(conversion_chunks, shape))
+    if chunk_bytes is None:
+        chunk_bytes = conversion_chunk_bytes
+    rows, cols = shape
+    n_pixels = max(rows * cols, 1)
+    n_tasks = max(n_workers * TASKS_PER_WORKER, math.ceil(n_pixels * pixel_bytes / chunk_bytes))
+    n_tasks = min(n_tasks, n_pixels)
+    chunk_rows = math.ceil(rows / n_tasks)
+    if not tiles and (chunk_rows >= MIN_CHUNK_ROWS or chunk_rows == rows):
+        return max(chunk_rows, 1), cols
+    chunk_pixels = math.ceil(n_pixels / n_tasks)
+    chunk_rows = min(rows, max(math.isqrt(chunk_pixels), 1))
+    chunk_cols = min(cols, math.ceil(chunk_pixels / chunk_rows))
+    return chunk_rows, chunk_cols
+
+
+def chunk_blocks(shape, chunks):
+    """ (rows, cols) slices of the chunks of an array of shape
+
+    >>> chunk_blocks((10, 4), (5, 3))
+    [(slice(0, 5, None), slice(0, 3, None)), (slice(0, 5, None), slice(3, 4, None)), \
+(slice(5, 10, None), slice(0, 3, None)), (slice(5, 10, None), slice(3, 4, None))]
+    """
+    return [(slice(row, min(row + chunks[0], shape[0])), slice(col, min(col + chunks[1], shape[1])))
+            for row in range(0, shape[0], chunks[0]) for col in range(0, shape[1], chunks[1])]
+
+
+def unmasked_blocks(blocks, mask):
+    """ The blocks that have unmasked pixels """
+    if mask is None:
+        return blocks
+    return [block for block in blocks if not mask[block].all()]
+
+
+def fill_masked(lats, lons, mask, fill_value_in):
+    """ Copies of lats/lons with fill_value_in at the masked pixels: pystare neither converts fill values nor adapts
+    the levels of their neighbours to them, so the masked pixels cannot affect the valid ones """
+    lats = numpy.array(numpy.ma.getdata(lats), dtype=numpy.double)
+    lons = numpy.array(numpy.ma.getdata(lons), dtype=numpy.double)
+    lats[mask] = fill_value_in
+    lons[mask] = fill_value_in
+    return lats, lons
+
+
+def from_latlon_block(lats, lons, mask=None, **kwargs):
+    if mask is not None and mask.all():
+        return numpy.full(lats.shape, kwargs['fill_value_out'], dtype=numpy.int64)
+    # Blocks that split columns are not contiguous
+    return pystare.from_latlon_2d(numpy.ascontiguousarray(lats), numpy.ascontiguousarray(lons), **kwargs)
+
+
+def convert_block(lats, lons, block, halo=HALO, **kwargs):
+    """ Converts the (rows, cols) block of lats/lons together with a halo of neighbouring pixels, which is trimmed
+    from the result """
+    rows, cols = block
+    row_start = max(rows.start - halo, 0)
+    col_start = max(cols.start - halo, 0)
+    halo_block = (slice(row_start, min(rows.stop + halo, lats.shape[0])),
+                  slice(col_start, min(cols.stop + halo, lats.shape[1])))
+    sids = from_latlon_block(lats[halo_block], lons[halo_block], **kwargs)
+    return sids[rows.start - row_start:rows.stop - row_start, cols.start - col_start:cols.stop - col_start]
+
 
 def latlon2stare_dask(lats, lons, resolution=None, n_workers=1, adapt_resolution=True,
-                      fill_value_in=None, fill_value_out=None
+                      fill_value_in=None, fill_value_out=None, client=None, mask=None
                       ):
-    # should probably make chunk size dependent on the number of workers and lat/lon dimensions
+    import dask.array
+    if resolution:
+        adapt_resolution = False
+    if client is None:
+        client = get_client(n_workers)
+    chunks = plan_chunks(lats.shape, n_workers, tiles=mask is not None)
+    arrays = [dask.array.from_array(numpy.ma.getdata(lats), chunks=chunks),
+              dask.array.from_array(numpy.ma.getdata(lons), chunks=chunks)]
+    if mask is not None:
+        # Chunks that are masked entirely (halo included) are not converted
+        arrays.append(dask.array.from_array(mask, chunks=chunks))
+    # Each chunk is converted with a halo of its neighbours' border pixels, which is trimmed afterwards
+    sids = dask.array.map_overlap(from_latlon_block, *arrays,
+                                  depth=HALO, boundary='none', trim=True, dtype=numpy.int64,
+                                  adapt_level=adapt_resolution, level=resolution,
+                                  fill_value_in=fill_value_in, fill_value_out=fill_value_out)
+    return numpy.array(client.compute(sids).result())
+
+
+def shared_array(shm_name, shape, dtype):
+    shm = multiprocessing.shared_memory.SharedMemory(name=shm_name)
+    return shm, numpy.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def latlon2stare_block(task):
+    """ Converts a (rows, cols) block of the shared lat/lon arrays into the shared SID array (in a pool worker)"""
+    lat_name, lon_name, sid_name, shape, block, kwargs = task
+    handles = []
+    try:
+        lat_shm, lats = shared_array(lat_name, shape, numpy.double)
+        handles.append(lat_shm)
+        lon_shm, lons = shared_array(lon_name, shape, numpy.double)
+        handles.append(lon_shm)
+        sid_shm, sids = shared_array(sid_name, shape, numpy.int64)
+        handles.append(sid_shm)
+        sids[block] = convert_block(lats, lons, block, **kwargs)
+        del lats, lons, sids
+    finally:
+        for shm in handles:
+            shm.close()
+
+
+def latlon2stare_shm(lats, lons, resolution=None, n_workers=1, adapt_resolution=True,
+                     fill_value_in=None, fill_value_out=None, mask=None):
+    """ Converts blocks of lats/lons in place in shared memory on the process pool; only the lat/lon inputs
+    and the SID result are copied (once each) rather than pickled to and from the workers. Blocks that are masked
+    entirely are not converted """
     if resolution:
         adapt_resolution = False
-    chunk_size = 500
-    lat_x = xarray.DataArray(lats, dims=['x', 'y']).chunk({'x': chunk_size})
-    lon_x = xarray.DataArray(lons, dims=['x', 'y']).chunk({'x': chunk_size})
-    with distributed.Client(n_workers=n_workers) as client:
-        sids = xarray.apply_ufunc(pystare.from_latlon_2d,
-                                  lat_x,
-                                  lon_x,
-                                  dask='parallelized',
-                                  kwargs={'adapt_level': adapt_resolution,
-                                          'level': resolution,
-                                          'fill_value_in': fill_value_in,
-                                          'fill_value_out': fill_value_out
-                                          },
-                                  output_dtypes=[numpy.int64])
-        return numpy.array(sids)
+    lats = numpy.ma.getdata(lats)
+    lons = numpy.ma.getdata(lons)
+    shape = lats.shape
+    kwargs = {'level': resolution, 'adapt_level': adapt_resolution,
+              'fill_value_in': fill_value_in, 'fill_value_out': fill_value_out}
+    n_bytes = max(1, lats.size * 8)
+    segments = []
+    try:
+        for _ in range(3):
+            segments.append(multiprocessing.shared_memory.SharedMemory(create=True, size=n_bytes))
+        lat_shm, lon_shm, sid_shm = segments
+        numpy.ndarray(shape, dtype=numpy.double, buffer=lat_shm.buf)[:] = lats
+        numpy.ndarray(shape, dtype=numpy.double, buffer=lon_shm.buf)[:] = lons
+        if mask is not None:
+            numpy.ndarray(shape, dtype=numpy.int64, buffer=sid_shm.buf)[:] = fill_value_out
+        blocks = chunk_blocks(shape, plan_chunks(shape, n_workers, tiles=mask is not None))
+        tasks = [(lat_shm.name, lon_shm.name, sid_shm.name, shape, block, kwargs)
+                 for block in unmasked_blocks(blocks, mask)]
+        get_pool(n_workers).map(latlon2stare_block, tasks)
+        sids = numpy.ndarray(shape, dtype=numpy.int64, buffer=sid_shm.buf).copy()
+    finally:
+        for shm in segments:
+            shm.close()
+            shm.unlink()
+    return sids
+
+
+@functools.lru_cache(maxsize=None)
+def pystare_releases_gil():
+    """ Whether pystare.from_latlon_2d releases the GIL (checked once per process).
+
+    A Python thread counts while from_latlon_2d runs; if the GIL is held, it barely gets to count compared to while
+    the main thread sleeps. This works on a single core as well, where the threads take turns.
+    """
+    lats, lons = numpy.meshgrid(numpy.linspace(30, 40, 100), numpy.linspace(-100, -85, 100), indexing='ij')
+    lats = numpy.ascontiguousarray(lats)
+    lons = numpy.ascontiguousarray(lons)
+    counter = [0]
+    stop = threading.Event()
+
+    def count():
+        while not stop.is_set():
+            counter[0] += 1
+
+    def rate(function):
+        before = counter[0]
+        start = time.perf_counter()
+        function()
+        return (counter[0] - before) / (time.perf_counter() - start)
+
+    thread = threading.Thread(target=count, daemon=True)
+    thread.start()
+    try:
+        idle_rate = rate(lambda: time.sleep(0.1))
+        busy_rate = rate(lambda: pystare.from_latlon_2d(lats, lons, adapt_level=True))
+    finally:
+        stop.set()
+        thread.join()
+    # Released: the counter gets about half (single core) or all of its idle rate; held: a switch interval at most
+    return busy_rate > 0.25 * idle_rate
+
+
+def latlon2stare_threads(lats, lons, resolution=None, n_workers=1, adapt_resolution=True,
+                         fill_value_in=None, fill_value_out=None, mask=None):
+    """ Converts blocks of lats/lons on a thread pool; the blocks are views of the inputs. Falls back to a serial
+    conversion if pystare holds the GIL, since threads would then only add overhead """
+    if resolution:
+        adapt_resolution = False
+    lats = numpy.ascontiguousarray(numpy.ma.getdata(lats), dtype=numpy.double)
+    lons = numpy.ascontiguousarray(numpy.ma.getdata(lons), dtype=numpy.double)
+    kwargs = {'level': resolution, 'adapt_level': adapt_resolution,
+              'fill_value_in': fill_value_in, 'fill_value_out': fill_value_out}
+    if not pystare_releases_gil():
+        warnings.warn('the installed pystare does not release the GIL; converting serially', stacklevel=3)
+        return latlon2stare_serial(lats, lons, mask=mask, **kwargs)
+
+    sids = numpy.full(lats.shape, fill_value_out if mask is not None else -1, dtype=numpy.int64)
+
+    def convert(block):
+        sids[block] = convert_block(lats, lons, block, **kwargs)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as executor:
+        blocks = chunk_blocks(lats.shape, plan_chunks(lats.shape, n_workers, tiles=mask is not None))
+        futures = [executor.submit(convert, block) for block in unmasked_blocks(blocks, mask)]
+        for future in futures:
+            future.result()
+    return sids
+
+
+def latlon2stare_serial(lats, lons, mask=None, **kwargs):
+    """ Converts lats/lons in this thread; with a mask, tile by tile, skipping the tiles that are masked entirely
+    (see latlon2stare() for the one pixel whose level can differ from converting the filled lats/lons at once) """
+    if mask is None:
+        return pystare.from_latlon_2d(lats, lons, **kwargs)
+    sids = numpy.full(lats.shape, kwargs['fill_value_out'], dtype=numpy.int64)
+    for block in unmasked_blocks(chunk_blocks(lats.shape, plan_chunks(lats.shape, 1, tiles=True)), mask):
+        sids[block] = convert_block(lats, lons, block, **kwargs)
+    return sids
+
+
+def pixel_spacing(lats, lons, valid=None):
+    """ Great circle distance in km from each pixel to its row neighbour: the previous pixel in the row, or the next
+    one if the previous pixel is not valid (or the pixel starts the row); inf for pixels with neither. This is the
+    neighbour pystare adapts the level to. Pixels where valid is False are ignored """
+    lats = numpy.radians(numpy.ma.getdata(lats))
+    lons = numpy.radians(numpy.ma.getdata(lons))
+    # Haversine
+    h = numpy.sin((lats[:, 1:] - lats[:, :-1]) / 2) ** 2 + \
+        numpy.cos(lats[:, 1:]) * numpy.cos(lats[:, :-1]) * numpy.sin((lons[:, 1:] - lons[:, :-1]) / 2) ** 2
+    distance = 2 * EARTH_RADIUS_KM * numpy.arcsin(numpy.sqrt(numpy.clip(h, 0, 1)))
+    if valid is not None:
+        distance[~(valid[:, 1:] & valid[:, :-1])] = numpy.inf
+    spacing = numpy.full(lats.shape, numpy.inf)
+    spacing[:, :-1] = distance
+    # Distance to the previous pixel where there is one
+    previous = numpy.isfinite(distance)
+    spacing[:, 1:][previous] = distance[previous]
+    return spacing
+
+
+def spacing2resolution(spacing):
+    """ The resolution pystare adapts to for pixels spacing km apart: resolution r for spacings from
+    SPACING_SCALE_KM / 2**(r + 1) up to SPACING_SCALE_KM / 2**r (e.g. 13 for 0.86 to 1.73 km), clipped to 0 to 27.
+    Isolated pixels (inf spacing) get 27
+
+    >>> spacing2resolution(numpy.array([10, 1, 0.5, 1e-9, 1e5, numpy.inf])).tolist()
+    [10, 13, 14, 27, 0, 27]
+    """
+    with numpy.errstate(divide='ignore'):
+        resolution = numpy.floor(numpy.log2(SPACING_SCALE_KM / numpy.asarray(spacing, dtype=numpy.double)))
+    resolution[numpy.isinf(spacing)] = 27
+    return numpy.clip(resolution, 0, 27).astype(numpy.int64)
+
+
+def estimate_resolution(lats, lons, valid=None):
+    """ Resolution of each pixel from its spacing to its row neighbour (see pixel_spacing()); equals pystare's
+    adapted levels, except at exact level thresholds (floating point) and for the last pixel of a row whose previous
+    pixel is a fill value, which pystare levels by a pixel outside the row """
+    return spacing2resolution(pixel_spacing(lats, lons, valid))
+
+
+def coerce_resolution(locations, resolutions):
+    """ SIDs with the locations of locations (SIDs of any level; pystare keeps the full level 27 location bits) and
+    the resolutions of resolutions (an array or a scalar). Negative locations (fill values) are kept """
+    locations = numpy.asarray(locations, dtype=numpy.int64)
+    sids = (locations & ~numpy.int64(31)) | numpy.asarray(resolutions, dtype=numpy.int64)
+    return numpy.where(locations < 0, locations, sids)
+
+
+def locations2stare(locations, lats, lons, resolutions=None, valid=None):
+    """ The second phase of a two-phase conversion: levels the level 27 locations (or SIDs already stored in a
+    sidecar) with resolutions (e.g. a custom resolution map) or, if not given, with the resolutions estimated from
+    the pixel spacing (see estimate_resolution()). No geolocation lookup is repeated """
+    if resolutions is None:
+        resolutions = estimate_resolution(lats, lons, valid)
+    return coerce_resolution(locations, resolutions)
 
 
 def latlon2stare(lats, lons, resolution=None, n_workers=1, adapt_resolution=True,
-                 fill_value_in=None, fill_value_out=None
+                 fill_value_in=None, fill_value_out=None, client=None, backend=None, mask=None,
+                 resolution_estimate=None
                  ):
-    if n_workers > 1:
+    """ Converts lats/lons to SIDs.
+
+    Pixels where mask is True are not converted and get fill_value_out (MASK_FILL_OUT if not set). They are set to
+    fill_value_in (MASK_FILL_IN if not set) for the conversion, so that they do not affect the adapted levels of
+    their neighbours, and tiles that are masked entirely are skipped. The result is the same as converting the
+    filled lats/lons at once, except for the level of the last pixel of a row whose previous pixel is masked (or a
+    fill value) in a tile that does not start at the first column: pystare levels that pixel by the pixel following
+    it in memory, which is the first pixel of the next row at once but the first pixel of the tile's next row in a
+    tile.
+
+    Adapted resolutions are estimated by pystare or from the pixel spacing (see set_resolution_estimate()).
+    """
+    if resolution_estimate is None:
+        resolution_estimate = default_resolution_estimate
+    if resolution_estimate == 'spacing' and adapt_resolution and not resolution:
+        locations = latlon2stare(lats, lons, 27, n_workers, False, fill_value_in, fill_value_out,
+                                 client=client, backend=backend, mask=mask)
+        valid = numpy.ones(numpy.shape(lats), dtype=bool) if mask is None else ~numpy.asarray(mask, dtype=bool)
+        if fill_value_in is not None:
+            valid &= numpy.ma.getdata(lats) != fill_value_in
+        return numpy.where(valid, locations2stare(locations, lats, lons, valid=valid), locations)
+    if backend is None:
+        backend = default_backend
+    if mask is not None and not numpy.any(mask):
+        mask = None
+    if mask is not None:
+        mask = numpy.broadcast_to(numpy.asarray(mask, dtype=bool), numpy.shape(lats))
+        if fill_value_in is None:
+            fill_value_in = MASK_FILL_IN
+        if fill_value_out is None:
+            fill_value_out = MASK_FILL_OUT
+        lats, lons = fill_masked(lats, lons, mask, fill_value_in)
+    if n_workers > 1 and backend == 'shm':
+        sids = latlon2stare_shm(lats, lons, resolution, n_workers, adapt_resolution,
+                                fill_value_in=fill_value_in,
+                                fill_value_out=fill_value_out,
+                                mask=mask)
+    elif n_workers > 1 and backend == 'threads':
+        sids = latlon2stare_threads(lats, lons, resolution, n_workers, adapt_resolution,
+                                    fill_value_in=fill_value_in,
+                                    fill_value_out=fill_value_out,
+                                    mask=mask)
+    elif n_workers > 1:
         sids = latlon2stare_dask(lats, lons, resolution, n_workers, adapt_resolution,
                                  fill_value_in=fill_value_in,
-                                 fill_value_out=fill_value_out)
+                                 fill_value_out=fill_value_out,
+                                 client=client,
+                                 mask=mask)
+    elif mask is not None:
+        if resolution:
+            adapt_resolution = False
+        sids = latlon2stare_serial(lats, lons, mask, level=resolution, adapt_level=adapt_resolution,
+                                   fill_value_in=fill_value_in, fill_value_out=fill_value_out)
     else:
         sids = pystare.from_latlon_2d(lats, lons, resolution, adapt_resolution,
                                  fill_value_in=fill_value_in,
@@ -46,53 +515,376 @@ def latlon2stare(lats, lons, resolution=None, n_workers=1, adapt_resolution=True
     return sids
 
 
+class CoverCache:
+    """ Cache of gring2cover() results, keyed on the GRing vertices (quantized to precision degrees), the resolution
+    and the pystare version.
+
+    The most recently used covers are kept in memory, up to max_memory_bytes. With a directory, covers are also
+    stored there as .npy files, which outlive the process (e.g. when reprocessing an archive or trying another
+    --cover_res). The size of the directory is tallied as files are written; once it exceeds max_bytes, the directory
+    is listed and the least recently used files are deleted down to COVER_CACHE_EVICT_TO of max_bytes. Files are
+    written atomically, so processes may share the directory (the files of other processes are counted when it is
+    listed).
+    """
+
+    def __init__(self, directory=None, max_memory_bytes=COVER_CACHE_MEMORY_BYTES, max_bytes=COVER_CACHE_BYTES,
+                 precision=GRING_PRECISION):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_bytes = max_bytes
+        self.precision = precision
+        self.memory = collections.OrderedDict()
+        self.memory_bytes = 0
+        self.directory_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self.evict()
+
+    def key(self, lats, lons, resolution):
+        digest = hashlib.sha1(pystare.__version__.encode())
+        for vertices in (lats, lons):
+            digest.update(numpy.round(numpy.asarray(vertices, dtype=numpy.double) / self.precision)
+                          .astype(numpy.int64).tobytes())
+            # Separates the latitudes from the longitudes
+            digest.update(b'|')
+        digest.update(str(int(resolution)).encode())
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def get(self, key):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return self.memory[key]
+        if self.directory is not None:
+            try:
+                sids = numpy.load(self.path(key))
+                # The modification time orders the files for eviction
+                os.utime(self.path(key))
+            except (OSError, ValueError):
+                sids = None
+            if sids is not None:
+                self.remember(key, sids)
+                with self.lock:
+                    self.hits += 1
+                return sids
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def remember(self, key, sids):
+        with self.lock:
+            if key in self.memory:
+                self.memory_bytes -= self.memory.pop(key).nbytes
+            if sids.nbytes > self.max_memory_bytes:
+                return
+            self.memory[key] = sids
+            self.memory_bytes += sids.nbytes
+            while self.memory_bytes > self.max_memory_bytes:
+                self.memory_bytes -= self.memory.popitem(last=False)[1].nbytes
+
+    def put(self, key, sids):
+        self.remember(key, sids)
+        if self.directory is None:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.' + key, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                numpy.save(tmp, sids)
+                size = tmp.tell()
+            os.replace(tmp_path, self.path(key))
+        except OSError:
+            # A cache that cannot be written only costs time
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self.lock:
+            self.directory_bytes += size
+            full = self.directory_bytes > self.max_bytes
+        if full:
+            self.evict()
+
+    def evict(self):
+        """ Lists the directory and deletes the least recently used files while the files add up to more than
+        COVER_CACHE_EVICT_TO of max_bytes """
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.name.endswith('.npy') and entry.is_file():
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes * COVER_CACHE_EVICT_TO:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Evicted by another process
+                pass
+            total -= size
+        with self.lock:
+            self.directory_bytes = total
+
+    def cover(self, lats, lons, resolution, compute):
+        key = self.key(lats, lons, resolution)
+        sids = self.get(key)
+        if sids is None:
+            sids = compute()
+            self.put(key, sids)
+        return sids.copy()
+
+
+def set_cover_cache(directory=None, max_memory_bytes=COVER_CACHE_MEMORY_BYTES, max_bytes=COVER_CACHE_BYTES):
+    """ Replaces the cache of gring2cover(): in memory only, or also in directory (see CoverCache).
+    max_memory_bytes=0 without a directory disables it """
+    global cover_cache
+    cover_cache = CoverCache(directory, max_memory_bytes, max_bytes) if max_memory_bytes or directory else None
+    return cover_cache
+
+
+# The cache of gring2cover(): in memory only unless set_cover_cache() replaces it
+cover_cache = CoverCache()
+
+
 def gring2cover(lats, lons, resolution):
     lats = numpy.array(lats)
     lons = numpy.array(lons)
-    sids = pystare.cover_from_hull(lats, lons, int(resolution))
-    return sids
+    if cover_cache is None:
+        return pystare.cover_from_hull(lats, lons, int(resolution))
+    return cover_cache.cover(lats, lons, resolution, lambda: pystare.cover_from_hull(lats, lons, int(resolution)))
 
 
-def sids2cover(sids):
-    return dissolve()
+def sids2cover(sids, resolution=None):
+    """ The dissolved cover of sids (coerced to resolution, if given); masked SIDs are ignored """
+    accumulator = CoverAccumulator(resolution)
+    accumulator.add(sids)
+    return accumulator.cover()
 
 
-def min_resolution(sids):
-    return int(pystare.spatial_resolution(sids).min())
+def resolution_stats(sids, fill_value=None, block_size=STATS_BLOCK_SIZE):
+    """ The min and max STARE resolution and the histogram of resolutions (index = resolution) of the valid SIDs in
+    one pass over sids, block by block, without copying the valid SIDs out. Masked SIDs, negative SIDs (fill values
+    of latlon2stare) and SIDs equal to fill_value are not valid.
 
+    >>> stats = resolution_stats(numpy.ma.masked_array([[9, 42, -1], [11, 0, 12]], mask=[[0, 0, 0], [0, 0, 1]]))
+    >>> stats['min_resolution'], stats['max_resolution'], stats['histogram'][9:12].tolist()
+    (0, 11, [1, 1, 1])
+    """
+    data = numpy.ravel(numpy.ma.getdata(sids))
+    mask = numpy.ma.getmask(sids)
+    mask = None if mask is numpy.ma.nomask else numpy.ravel(mask)
+    # Invalid SIDs are counted in an extra bin
+    histogram = numpy.zeros(33, dtype=numpy.int64)
+    for start in range(0, data.size, block_size):
+        block = data[start:start + block_size]
+        levels = (block & 31).astype(numpy.intp)
+        invalid = block < 0
+        if fill_value is not None:
+            invalid |= block == fill_value
+        if mask is not None:
+            invalid |= mask[start:start + block_size]
+        levels[invalid] = 32
+        histogram += numpy.bincount(levels, minlength=33)
+    histogram = histogram[:32]
+    present = numpy.flatnonzero(histogram)
+    return {'min_resolution': int(present.min()) if present.size else None,
+            'max_resolution': int(present.max()) if present.size else None,
+            'histogram': histogram}
 
-def max_resolution(sids):
-    return int(pystare.spatial_resolution(sids).max())
+
+def min_resolution(sids, fill_value=None):
+    resolution = resolution_stats(sids, fill_value)['min_resolution']
+    if resolution is None:
+        raise ValueError('there are no valid SIDs')
+    return resolution
+
+
+def max_resolution(sids, fill_value=None):
+    resolution = resolution_stats(sids, fill_value)['max_resolution']
+    if resolution is None:
+        raise ValueError('there are no valid SIDs')
+    return resolution
+
+
+def sids2intervals(sids):
+    """ The half-open ranges [start, stop) of level 27 trixel numbers (sid >> 5) covered by each SID
+
+    >>> sids2intervals(numpy.array([(5 << 5) | 27, (4 << 5) | 26]))
+    (array([5, 4]), array([6, 8]))
+    """
+    sids = numpy.asarray(sids, dtype=numpy.int64)
+    size = numpy.left_shift(numpy.int64(1), 2 * (27 - (sids & 31)))
+    start = (sids >> 5) & ~(size - 1)
+    return start, start + size
+
+
+def merge_intervals(start, stop, presorted=False):
+    """ Sorts intervals by start and joins those that overlap or touch; linear if already sorted (presorted) """
+    if not presorted:
+        order = numpy.argsort(start, kind='stable')
+        start, stop = start[order], stop[order]
+    if start.size == 0:
+        return start, stop
+    stop = numpy.maximum.accumulate(stop)
+    first = numpy.flatnonzero(numpy.concatenate([[True], start[1:] > stop[:-1]]))
+    last = numpy.append(first[1:] - 1, start.size - 1)
+    return start[first], stop[last]
+
+
+def merge_sorted_intervals(a, b):
+    """ Merges two sorted, joined interval sets. The stable sort (timsort) of the concatenation merges the two
+    sorted runs in linear time """
+    start = numpy.concatenate([a[0], b[0]])
+    stop = numpy.concatenate([a[1], b[1]])
+    order = numpy.argsort(start, kind='stable')
+    return merge_intervals(start[order], stop[order], presorted=True)
+
+
+def intervals2sids(start, stop):
+    """ The fewest SIDs that cover the intervals exactly: each interval is split into the largest aligned trixels
+    that fit, from its start
+
+    >>> intervals2sids(numpy.array([4]), numpy.array([9]))
+    array([154, 283])
+    >>> intervals2sids(numpy.array([0]), numpy.array([5]))
+    array([ 26, 155])
+    """
+    starts = []
+    levels = []
+    while start.size:
+        length = stop - start
+        # Largest trixel (4**k level 27 trixels) that fits; log2 of floats may round a length up to a power of 2
+        k = numpy.floor(numpy.log2(length.astype(numpy.double))).astype(numpy.int64) // 2
+        k = numpy.where(numpy.left_shift(numpy.int64(1), 2 * k) > length, k - 1, k)
+        # ... and that is aligned at start (start & -start is the largest power of 2 dividing start; 0 is aligned to
+        # the level 0 trixels, which are 4**27 level 27 trixels)
+        alignment = numpy.where(start == 0, numpy.left_shift(numpy.int64(1), 54), start & -start)
+        k = numpy.minimum(k, numpy.floor(numpy.log2(alignment.astype(numpy.double))).astype(numpy.int64) // 2)
+        k = numpy.minimum(k, 27)
+        starts.append(start)
+        levels.append(27 - k)
+        start = start + numpy.left_shift(numpy.int64(1), 2 * k)
+        remaining = start < stop
+        start, stop = start[remaining], stop[remaining]
+    if not starts:
+        return numpy.array([], dtype=numpy.int64)
+    return numpy.sort((numpy.concatenate(starts) << 5) | numpy.concatenate(levels))
+
+
+def chunk_intervals(sids):
+    return merge_intervals(*sids2intervals(sids))
+
+
+def merge_interval_pair(pair):
+    return merge_sorted_intervals(*pair)
+
+
+def reduce_intervals(interval_sets, map_tasks=map):
+    """ Merges interval sets pairwise, level by level; each level is one map_tasks() call """
+    interval_sets = list(interval_sets)
+    if not interval_sets:
+        return numpy.array([], dtype=numpy.int64), numpy.array([], dtype=numpy.int64)
+    while len(interval_sets) > 1:
+        pairs = list(zip(interval_sets[0::2], interval_sets[1::2]))
+        interval_sets = list(map_tasks(merge_interval_pair, pairs)) + interval_sets[2 * len(pairs):]
+    return interval_sets[0]
 
 
 def dissolve(sids):
-    s_range = pystare.to_compressed_range(sids)
-    expanded = pystare.expand_intervals(s_range, -1, multi_resolution=True)
-    return expanded
+    """ Replaces SIDs by their parent wherever they cover all of it, recursively. Unlike
+    pystare.expand_intervals(pystare.to_compressed_range(sids)), which drops some of the input trixels, the result
+    covers exactly the same area as sids """
+    return intervals2sids(*chunk_intervals(pystare.spatial_clear_to_resolution(sids)))
+
 
+def merge_stare(sids, dissolve_sids=True, n_workers=1, n_chunks=1, client=None):
+    """ The sorted, unique SIDs of sids; dissolved (see dissolve()) if dissolve_sids.
 
-def merge_stare(sids, dissolve_sids=True, n_workers=1, n_chunks=1):
-    sids = pystare.spatial_clear_to_resolution(sids)
-    dissolved = numpy.unique(sids)
+    The dissolve is a tree reduction: the SIDs are split into max(n_workers, n_chunks) chunks, which are converted to
+    sorted interval sets, and the interval sets are merged pairwise, level by level, until one is left. With
+    n_workers > 1, the chunks and each level of pairs are processed on the persistent process pool (see get_pool()),
+    or on the dask client if one is given.
+    """
+    sids = pystare.spatial_clear_to_resolution(numpy.ravel(sids))
 
     if not dissolve_sids:
-        return dissolved
+        return numpy.unique(sids)
 
-    if n_workers == 1 and n_chunks == 1:
-        tmp = dissolve(dissolved)
-        dissolved = tmp
+    if client is not None:
+        def map_tasks(function, tasks):
+            return client.gather(client.map(function, tasks))
+    elif n_workers > 1:
+        map_tasks = get_pool(n_workers).map
     else:
-        if n_workers > 1:
-            chunks = numpy.array_split(dissolved, n_workers)
-            with multiprocessing.Pool(processes=n_workers) as pool:
-                dissolved = pool.map(dissolve, chunks)
-        elif n_chunks > 1:
-            chunks = numpy.array_split(dissolved, n_chunks)
-            dissolved = []
-            for chunk in chunks:
-                dissolved.append(dissolve(chunk))
-        dissolved = numpy.concatenate(dissolved)
-        dissolved = numpy.unique(dissolved)
-        dissolved = dissolve(dissolved)
-
-    return dissolved
+        map_tasks = map
+
+    intervals = map_tasks(chunk_intervals, numpy.array_split(sids, max(n_workers, n_chunks, 1)))
+    return intervals2sids(*reduce_intervals(intervals, map_tasks))
+
+
+class CoverAccumulator:
+    """ Accumulates the dissolved cover of SIDs that arrive in chunks (e.g. per scan, row block or granule).
+
+    Each chunk is reduced to its sorted, joined intervals (see sids2intervals()) right away, so only intervals are
+    kept: memory depends on the size of the cover rather than on the number of SIDs added. The intervals of the
+    chunks are merged into the cover once they add up to compact_size intervals, or when the cover is requested.
+
+    >>> accumulator = CoverAccumulator()
+    >>> for row in range(4):
+    ...     accumulator.add(numpy.array([((4 * row + col) << 5) | 27 for col in range(4)]))
+    >>> accumulator.cover()
+    array([25])
+    """
+
+    def __init__(self, resolution=None, compact_size=2**20):
+        self.resolution = resolution
+        self.compact_size = compact_size
+        self.intervals = (numpy.array([], dtype=numpy.int64), numpy.array([], dtype=numpy.int64))
+        self.pending = []
+        self.n_pending = 0
+
+    def __len__(self):
+        """ Number of intervals held """
+        return self.intervals[0].size + self.n_pending
+
+    def add(self, sids):
+        """ Adds SIDs (any shape; masked SIDs are ignored), coerced to resolution if set """
+        if numpy.ma.isMaskedArray(sids):
+            sids = sids.compressed()
+        sids = numpy.ravel(sids)
+        if sids.size == 0:
+            return
+        if self.resolution is not None:
+            sids = pystare.spatial_coerce_resolution(sids, self.resolution)
+        intervals = chunk_intervals(pystare.spatial_clear_to_resolution(sids))
+        self.pending.append(intervals)
+        self.n_pending += intervals[0].size
+        if self.n_pending >= self.compact_size:
+            self.compact()
+
+    def add_cover(self, other):
+        """ Adds the intervals of another accumulator (e.g. of another granule) """
+        other.compact()
+        self.pending.append(other.intervals)
+        self.n_pending += other.intervals[0].size
+        if self.n_pending >= self.compact_size:
+            self.compact()
+
+    def compact(self):
+        """ Merges the pending intervals into the cover """
+        if self.pending:
+            self.intervals = reduce_intervals([self.intervals] + self.pending)
+            self.pending = []
+            self.n_pending = 0
+
+    def cover(self):
+        """ The fewest SIDs that cover exactly the SIDs added so far """
+        self.compact()
+        return intervals2sids(*self.intervals)
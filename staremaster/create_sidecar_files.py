@@ -2,16 +2,23 @@
 
 import argparse
 import staremaster.products
-import glob
-import multiprocessing
-import itertools
+import concurrent.futures
 import filelock
-import pkgutil
-import importlib
-import re
+import itertools
+import os
+import queue
+import threading
+import time
+import staremaster.catalog
+import staremaster.discovery
+import staremaster.sidecar
+import staremaster.conversions
 
+# Granules per process that create_sidecars_parallel() takes from a file list/folder scan at a time
+LOOKAHEAD_TASKS = 16
 
-def create_grid_sidecar(grid, out_path, n_workers):
+
+def create_grid_sidecar(grid, out_path, n_workers, sidecar_options=None):
     grid = grid.lower()
     if grid == 'imerg':
         granule = staremaster.products.IMERG()
@@ -20,100 +27,435 @@ def create_grid_sidecar(grid, out_path, n_workers):
     else:
         print('unknown grid')
         exit()
-    granule.create_sidecar(out_path, n_workers=n_workers)
+    granule.create_sidecar(out_path, n_workers=n_workers, **(sidecar_options or {}))
 
 
-def create_sidecar(file_path, n_workers, product, cover_res, out_path, archive):
-    print(f'creating sidecar for {file_path}')
+def get_granule(file_path, product=None):
+    """ The granule of file_path; only the module of its product is imported """
     if product is None:
         product = product_name(file_path)
+    return staremaster.products.product_class(product)(file_path)
+
+
+def load_granule(file_path, product=None):
+    """ Opens a granule and reads its geolocation """
+    with staremaster.sidecar.IO_LOCK:
+        granule = get_granule(file_path, product)
+        granule.load()
+    return granule
+
+
+def close_granule(granule):
+    """ Closes the file of a granule (if its product has a close() method) with the netCDF/HDF calls serialized.
+    Left to the garbage collector, the file would be closed by whichever thread drops the last reference """
+    close = getattr(granule, 'close', None)
+    if close is not None:
+        with staremaster.sidecar.IO_LOCK:
+            close()
 
-    product = product.upper()
-
-    if product == 'MOD05':
-        granule = staremaster.products.MOD05(file_path)
-    elif product == 'MOD09':
-        granule = staremaster.products.MOD09(file_path)
-    elif product in ('VNP03MOD', 'VNP03DNB', 'VJ103MOD', 'VJ103DNB'):
-        granule = staremaster.products.VNP03MOD(file_path)
-    elif product in ('VNP03IMG', 'VJ103IMG'):
-        granule = staremaster.products.VNP03IMG(file_path)
-    elif product in ('CLDMSK_L2_VIIRS_NOAA20', 'CLDMSK_L2_SNPP'):
-        granule = staremaster.products.CLMDKS_L2_VIIRS(file_path)
-    elif product == 'SSMIS':
-        granule = staremaster.products.SSMIS(file_path)
-    elif product == 'ATMS':
-        granule = staremaster.products.ATMS(file_path)
-    elif product == 'GOES_ABI_FIXED_GRID':
-        granule = staremaster.products.GOES_ABI_FIXED_GRID(file_path)
+
+def make_sidecar(file_path, n_workers, product, cover_res, out_path, sidecar_options=None, granule=None,
+                 read_seconds=None):
+    """ Creates the sidecar of a granule (loaded and closed again unless given); returns the sidecar and its catalog
+    record """
+    print(f'creating sidecar for {file_path}')
+    started = time.time()
+    start = time.perf_counter()
+    if granule is None:
+        granule = load_granule(file_path, product)
+        read_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        try:
+            sidecar = granule.create_sidecar(n_workers=n_workers, cover_res=cover_res, out_path=out_path,
+                                             **(sidecar_options or {}))
+        finally:
+            close_granule(granule)
     else:
-        print('product not supported')
-        print('supported products are {}'.format(get_installed_products()))
-        quit()
-    granule.load()
-    sidecar = granule.create_sidecar(n_workers=n_workers, cover_res=cover_res, out_path=out_path)
+        sidecar = granule.create_sidecar(n_workers=n_workers, cover_res=cover_res, out_path=out_path,
+                                         **(sidecar_options or {}))
+    # The registry name, which distinguishes products sharing a reader class (e.g. VNP03DNB and VNP03MOD)
+    record = {'granule': file_path, 'sidecar': sidecar.file_path, 'product': product or product_name(file_path),
+              'status': 'done', 'cover_res': cover_res, 'started': started, 'read_seconds': read_seconds,
+              'convert_seconds': time.perf_counter() - start}
+    return sidecar, record
+
 
+def record_archived(file_path, sidecar_path, archive):
+    with filelock.FileLock(archive + '.lock.'):
+        with open(archive, 'a') as cat:
+            line = '{}, {} \n'.format(file_path, sidecar_path)
+            cat.writelines(line)
+
+
+def create_sidecar(file_path, n_workers, product, cover_res, out_path, archive, sidecar_options=None, granule=None,
+                   catalog=None, read_seconds=None):
+    sidecar, record = make_sidecar(file_path, n_workers, product, cover_res, out_path, sidecar_options, granule,
+                                   read_seconds)
     if archive:
-        with filelock.FileLock(archive + '.lock.'):
-            with open(archive, 'a') as cat:
-                line = '{}, {} \n'.format(file_path, sidecar.file_path)
-                cat.writelines(line)
+        record_archived(file_path, sidecar.file_path, archive)
+    if catalog is not None:
+        catalog.record(**record)
+    return sidecar
 
 
-def list_granules(folder, product):
-    if not product:
-        product = ''
-    files = glob.glob(folder + '/*')
-    pattern = '.*{product}.*[^_stare]\.(nc|hdf|HDF5)'.format(product=product.upper())
-    granules = list(filter(re.compile(pattern).match, files))
-    return granules
+def create_sidecars_pipelined(file_paths, n_workers, product, cover_res, out_path, archive, sidecar_options=None,
+                              prefetch=2, catalog=None):
+    """ Creates the sidecars of file_paths in three overlapping stages:
 
+    - read: a reader thread opens the next granules and reads their geolocation, at most prefetch granules ahead
+    - convert: this thread looks up the SIDs and covers
+    - write: the sidecar's background writer thread compresses and writes the variables
 
-def product_name(file_path):
-    file_name = file_path.split('/')[-1]
-    if 'MOD05_L2' in file_path and '.hdf' in file_name:
-        product = 'MOD05'
-    elif 'MOD09' in file_path and '.hdf' in file_name:
-        product = 'MOD09'
-    elif ('VNP03' in file_path or 'VJ103' in file_path) and '.nc' in file_name:
-        product = 'VNP03'
-    elif ('VNP02DNB' in file_path or 'VJ102DNB' in file_path) and '.nc' in file_name:
-        product = 'VNP02DNB'
-    elif 'CLDMSK_L2_VIIRS' in file_path and '.nc' in file_name:
-        product = 'CLDMSK_L2_VIIRS'
-    elif 'SSMIS' in file_path and '.HDF5' in file_name:
-        product = 'SSMIS'
-    elif 'ATMS' in file_path and '.HDF5' in file_name:
-        product = 'ATMS'
-    elif 'MERRA2' in file_path and '.nc4' in file_name:
-        product = 'MERRA2'
+    The bounded queues between the stages cap the number of granules in memory. netCDF/HDF calls of the stages are
+    serialized (see staremaster.sidecar.IO_LOCK); the conversion overlaps with both. Returns the seconds each stage
+    was busy and the wall time, which are also printed.
+
+    file_paths may be a generator (e.g. of a folder scan or of Catalog.skip_processed(), whose SQLite connection
+    belongs to this thread); it is consumed by this thread, which hands the paths to the reader.
+    """
+    granules = queue.Queue(maxsize=max(prefetch, 1))
+    paths = queue.Queue()
+    file_paths = iter(file_paths)
+    busy = {'read': 0.0, 'convert': 0.0, 'write': 0.0}
+    stop = threading.Event()
+
+    def feed(n_paths):
+        # Hands the next n_paths paths to the reader, and None once file_paths is exhausted
+        for _ in range(n_paths):
+            file_path = next(file_paths, None)
+            paths.put(file_path)
+            if file_path is None:
+                return False
+        return True
+
+    def read():
+        while not stop.is_set():
+            file_path = paths.get()
+            if file_path is None:
+                break
+            start = time.perf_counter()
+            try:
+                granule, error = load_granule(file_path, product), None
+            except BaseException as e:
+                # Raised in the convert stage, where the granule would have been loaded without the pipeline
+                granule, error = None, e
+            read_seconds = time.perf_counter() - start
+            busy['read'] += read_seconds
+            granules.put((file_path, granule, read_seconds, error))
+        granules.put(None)
+
+    reader = threading.Thread(target=read, name='granule-reader', daemon=True)
+    options = dict(sidecar_options or {}, background_writer=True)
+    wall_start = time.perf_counter()
+    n_granules = 0
+    reader.start()
+    try:
+        # The reader holds at most prefetch granules in the queue and loads one more
+        feeding = feed(max(prefetch, 1) + 1)
+        while True:
+            item = granules.get()
+            if item is None:
+                break
+            file_path, granule, read_seconds, error = item
+            if error is not None:
+                raise error
+            if feeding:
+                feeding = feed(1)
+            n_granules += 1
+            start = time.perf_counter()
+            try:
+                sidecar = create_sidecar(file_path, n_workers, product, cover_res, out_path, archive,
+                                         sidecar_options=options, granule=granule, catalog=catalog,
+                                         read_seconds=read_seconds)
+            finally:
+                # Closed here rather than by the garbage collector, which may run while the reader holds IO_LOCK
+                close_granule(granule)
+                del granule, item
+            busy['convert'] += time.perf_counter() - start
+            busy['write'] += sidecar.write_time
+    finally:
+        stop.set()
+        # Unblocks the reader if it waits for a path or for room in the queue
+        paths.put(None)
+        while reader.is_alive() or not granules.empty():
+            try:
+                item = granules.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is not None and item[1] is not None:
+                close_granule(item[1])
+    wall_time = time.perf_counter() - wall_start
+    print('pipeline: {n} granules in {wall:.1f} s; stage utilisation: {stages}'.format(
+        n=n_granules, wall=wall_time,
+        stages=', '.join('{} {:.0%} ({:.1f} s)'.format(stage, seconds / wall_time if wall_time else 0, seconds)
+                         for stage, seconds in busy.items())))
+    return busy, wall_time
+
+
+def create_sidecar_task(file_path, product, cover_res, out_path, archive, sidecar_options=None):
+    """ Worker side of create_sidecars_parallel(): the catalog record of the granule, with the error as a string
+    if it failed (exceptions of the granule readers need not be picklable). SystemExit (the product readers call
+    exit() on some errors) is a failure of the granule as well """
+    try:
+        sidecar, record = make_sidecar(file_path, 1, product, cover_res, out_path, sidecar_options)
+        if archive:
+            record_archived(file_path, sidecar.file_path, archive)
+    except BaseException as e:
+        return failure_record(file_path, cover_res, '{}: {}'.format(type(e).__name__, e))
+    return record
+
+
+def failure_record(file_path, cover_res, error):
+    return {'granule': file_path, 'status': 'failed', 'cover_res': cover_res, 'error': error}
+
+
+def largest_first(file_paths):
+    """ Orders the granules by decreasing file size so that the long tasks do not end up last """
+    def size(file_path):
+        try:
+            return os.path.getsize(file_path)
+        except OSError:
+            return 0
+    return sorted(file_paths, key=size, reverse=True)
+
+
+def stop_executor(executor):
+    """ Kills the worker processes of a ProcessPoolExecutor (which has no terminate()) and shuts it down """
+    if hasattr(executor, 'kill_workers'):
+        # Python 3.14
+        executor.kill_workers()
     else:
-        product = None
-        print('could not determine product for {}'.format(file_path))
-        quit()
-    return product
+        for process in list((executor._processes or {}).values()):
+            process.kill()
+    executor.shutdown(wait=True)
+
+
+def create_sidecars_parallel(file_paths, n_processes, product, cover_res, out_path, archive, sidecar_options=None,
+                             timeout=None, retries=1, quarantine=None, catalog=None, lookahead=None,
+                             poll_interval=0.1):
+    """ Creates the sidecars of file_paths in a pool of n_processes, one granule per task.
+
+    file_paths may be a generator (e.g. of a folder scan), which is consumed while the first granules are processed:
+    the next lookahead granules (default: LOOKAHEAD_TASKS per process) are taken from it at a time and submitted
+    largest first.
+
+    A granule that fails, kills its worker (e.g. a segfault of the HDF library) or takes longer than timeout
+    seconds is retried up to retries times; after that it is given up and, if quarantine is given, recorded in the
+    quarantine file. Granules listed there are skipped.
+    A timed out granule can only be stopped by killing the workers, and a dead worker breaks the pool; the pool is
+    restarted and the granules that were running alongside are resubmitted without counting as an attempt. If it is
+    unknown which of them killed the worker, they are resubmitted one at a time, so that the next crash is
+    attributed to its granule.
+    The created and given up granules are recorded in catalog (if any) by this process, not by the workers.
+    Returns the created granules and a {file_path: error} dict of the failed ones.
+    """
+    if quarantine:
+        file_paths = remove_quarantined(file_paths, quarantine)
+    file_paths = iter(file_paths)
+    if lookahead is None:
+        lookahead = LOOKAHEAD_TASKS * n_processes
+    exhausted = False
+    # Granules taken from file_paths, largest first
+    window = []
+    # Retried and resubmitted granules, which go before the window
+    pending = []
+    # Granules that were running when a worker died; resubmitted one at a time
+    suspects = []
+    isolated = None
+    attempts = {}
+    succeeded = []
+    failed = {}
+    running = {}
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=n_processes)
+    try:
+        while suspects or pending or window or running or not exhausted:
+            if not exhausted and len(window) < n_processes:
+                taken = list(itertools.islice(file_paths, lookahead))
+                exhausted = len(taken) < lookahead
+                taken = [file_path for file_path in taken if file_path not in attempts]
+                attempts.update((file_path, 0) for file_path in taken)
+                window = largest_first(window + taken)
+            while len(running) < n_processes and isolated not in running:
+                if suspects:
+                    if running:
+                        break
+                    file_path = isolated = suspects.pop(0)
+                elif pending or window:
+                    file_path = pending.pop(0) if pending else window.pop(0)
+                else:
+                    break
+                attempts[file_path] += 1
+                future = executor.submit(create_sidecar_task,
+                                         file_path, product, cover_res, out_path, archive, sidecar_options)
+                running[file_path] = (future, time.monotonic())
+
+            finished = {}
+            timed_out = []
+            broken = None
+            for file_path, (future, start) in running.items():
+                if future.done():
+                    try:
+                        finished[file_path] = future.result()
+                    except concurrent.futures.BrokenExecutor as e:
+                        broken = e
+                    except Exception as e:
+                        finished[file_path] = failure_record(file_path, cover_res,
+                                                             '{}: {}'.format(type(e).__name__, e))
+                elif timeout is not None and time.monotonic() - start > timeout:
+                    timed_out.append(file_path)
+            for file_path in finished:
+                del running[file_path]
+
+            if timed_out or broken is not None:
+                stop_executor(executor)
+                for file_path in timed_out:
+                    del running[file_path]
+                    finished[file_path] = failure_record(file_path, cover_res,
+                                                         'timed out after {} s'.format(timeout))
+                if broken is not None and len(running) == 1 and not timed_out:
+                    # The only running granule killed its worker
+                    file_path, = running
+                    finished[file_path] = failure_record(file_path, cover_res, '{}: {}'.format(
+                        type(broken).__name__, broken))
+                    running = {}
+                # The other running granules were killed with the pool
+                for file_path in running:
+                    attempts[file_path] -= 1
+                if broken is not None and running:
+                    print('a worker died while {} were running; retrying them one at a time'.format(
+                        ', '.join(running)))
+                    suspects.extend(running)
+                else:
+                    pending = list(running) + pending
+                running = {}
+                executor = concurrent.futures.ProcessPoolExecutor(max_workers=n_processes)
+
+            for file_path, record in finished.items():
+                error = record.get('error')
+                if error is None:
+                    succeeded.append(file_path)
+                elif attempts[file_path] <= retries:
+                    print('retrying {} ({})'.format(file_path, error))
+                    pending.append(file_path)
+                    continue
+                else:
+                    print('giving up on {} ({})'.format(file_path, error))
+                    failed[file_path] = error
+                    if quarantine:
+                        record_quarantined(file_path, error, quarantine)
+                if catalog is not None:
+                    catalog.record(**record)
+            if not finished:
+                time.sleep(poll_interval)
+    finally:
+        stop_executor(executor)
+
+    print('{} of {} sidecars created; {} granules failed'.format(len(succeeded), len(attempts), len(failed)))
+    for file_path, error in failed.items():
+        print('    {}: {}'.format(file_path, error))
+    return succeeded, failed
+
+
+def record_quarantined(file_path, error, quarantine):
+    with filelock.FileLock(quarantine + '.lock.'):
+        with open(quarantine, 'a') as cat:
+            cat.write('{}, {}\n'.format(file_path, error.replace('\n', ' ')))
+
+
+def remove_quarantined(file_paths, quarantine):
+    if not os.path.exists(quarantine):
+        return iter(file_paths)
+    return remove_listed(file_paths, read_listed(quarantine), 'are quarantined')
+
+
+def list_granules(folder, product, recursive=False, start=None, end=None):
+    return list(staremaster.discovery.find_granules(folder, product=product, recursive=recursive, start=start,
+                                                    end=end))
+
+
+def product_name(file_path):
+    return staremaster.products.product_from_filename(file_path)
 
 
 def remove_archived(file_paths, archive):
-    if glob.glob(archive):
-        with open(archive, 'r') as cat:
-            csv = cat.readlines()
-        archived = []
-        for row in csv:
-            archived.append(row.split(',')[0])
-        n_archived = len(archived)
-        n_filepaths = len(file_paths)
-        print(f'{n_archived} out of {n_filepaths} been recorded in the archive and will not be processed')
-        unprocessed = list(set(file_paths) - set(archived))
-    else:
-        unprocessed = file_paths
-    return unprocessed
+    """ Skips the granules recorded in the archive file; file_paths may be a generator """
+    if not os.path.exists(archive):
+        return iter(file_paths)
+    return remove_listed(file_paths, read_listed(archive), 'are recorded in the archive')
+
+
+def read_listed(file_name):
+    # The granules in the first column of an archive or quarantine file
+    with open(file_name, 'r') as cat:
+        return set(row.split(',')[0].strip() for row in cat)
+
+
+def remove_listed(file_paths, listed, reason):
+    n_skipped = 0
+    for file_path in file_paths:
+        if file_path in listed:
+            n_skipped += 1
+            continue
+        yield file_path
+    if n_skipped:
+        print(f'{n_skipped} granules {reason} and were not processed')
+
+
+def parse_chunks(chunks):
+    """ Parses the --chunks argument: 'none', 'auto', 'scan' or a ROWSxCOLS tile shape
+
+    >>> parse_chunks('100x200')
+    (100, 200)
+    >>> parse_chunks('none') is None
+    True
+    """
+    chunks = chunks.lower()
+    if chunks == 'none':
+        return None
+    elif chunks in ('auto', 'scan'):
+        return chunks
+    try:
+        rows, cols = chunks.split('x')
+        return int(rows), int(cols)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid chunks {chunks}; expected none, auto, scan or ROWSxCOLS')
+
+
+def parse_conversion_chunks(chunks):
+    """ Parses the --conversion_chunks argument: 'auto' or a ROWSxCOLS chunk shape (-1 for a whole dimension)
+
+    >>> parse_conversion_chunks('500x-1')
+    (500, -1)
+    >>> parse_conversion_chunks('auto') is None
+    True
+    """
+    if chunks.lower() == 'auto':
+        return None
+    try:
+        rows, cols = chunks.lower().split('x')
+        return int(rows), int(cols)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid conversion chunks {chunks}; expected auto or ROWSxCOLS')
+
+
+def parse_compression(compression):
+    if compression.lower() == 'none':
+        return None
+    if compression not in staremaster.sidecar.available_compressions():
+        raise argparse.ArgumentTypeError('compression {} not supported; available: {}'.format(
+            compression, staremaster.sidecar.available_compressions()))
+    return compression
+
+
+def parse_date(date):
+    try:
+        return staremaster.discovery.parse_date(date)
+    except ValueError:
+        raise argparse.ArgumentTypeError('{} is not a YYYY-MM-DD date'.format(date))
 
 
 def get_installed_products():
-    starmeaster_path = importlib.util.find_spec('staremaster.products').submodule_search_locations[0]
-    products = [name for _, name, _ in pkgutil.iter_modules([starmeaster_path])]
-    return products
+    return staremaster.products.product_names()
 
 
 def main():
@@ -124,61 +466,189 @@ def main():
                         help='the folder to create sidecars for')
     parser.add_argument('--files', metavar='files', nargs='+', type=str,
                         help='the files to create a sidecar for')
+    parser.add_argument('--files_from', '--files-from', metavar='file_list', type=str,
+                        help='file listing the files to create a sidecar for, one per line (- for stdin); '
+                             'processing starts while the list is read')
+    parser.add_argument('--recursive', dest='recursive', action='store_true',
+                        help='with --folder: also create sidecars for the granules in subfolders')
+    parser.add_argument('--start_date', metavar='YYYY-MM-DD', type=parse_date, default=None,
+                        help='with --folder: skip granules acquired (and date partitions such as 2020/219 or '
+                             '2020/08/06 ending) before this date')
+    parser.add_argument('--end_date', metavar='YYYY-MM-DD', type=parse_date, default=None,
+                        help='with --folder: skip granules acquired (and date partitions starting) after this date')
     parser.add_argument('--grid', metavar='files', type=str,
                         help='the grid to create a sidecar for (e.g. IMERG, h08v05)')
     parser.add_argument('--out_path', type=str,
                         help='the folder to create sidecars in; default: next to granule')
-    parser.add_argument('--product', metavar='product', type=str,
-                        help='product (e.g. cldmsk_l2_viirs, hdfeos, l2_viirs, mod05, mod09, vj102dnb, '
-                             'vj103dnb, vnp02dnb, vnp03mod, ssmi)',
+    parser.add_argument('--product', metavar='product', type=str.upper,
+                        help='product (e.g. mod05, mod09, vnp03dnb, vj103img, cldmsk_l2_viirs_snpp, ssmis, atms; '
+                             'plugins add products through the staremaster.products entry points). Default: '
+                             'determined from the file names',
                         choices=installed_products, default=None)
     parser.add_argument('--cover_res', metavar='cover_res', type=int,
                         help='max STARE resolution of the cover. Default: min resolution of iFOVs')
+    parser.add_argument('--cover_cache', metavar='directory', type=str, default=None,
+                        help='directory to keep GRing covers in across runs (e.g. when reprocessing an archive or '
+                             'trying another --cover_res). Covers are always cached in memory during a run')
+    parser.add_argument('--cover_cache_bytes', metavar='bytes', type=int,
+                        default=staremaster.conversions.COVER_CACHE_BYTES,
+                        help='size limit of --cover_cache; the least recently used covers are deleted beyond it. '
+                             'Default: 1 GiB')
     parser.add_argument('--workers', metavar='n_workers', type=int,
                         help='use n_workers (local) dask workers', default=1)
     parser.add_argument('--archive', metavar='archive', type=str,
                         help='''Create sidecars only for granules not listed in the archive file. 
                             Record all create sidecars and their corresponding granules in it.''')
+    parser.add_argument('--catalog', metavar='catalog', type=str, default=None,
+                        help='SQLite catalog to record the granules in (sidecar, product, status, timings, cover '
+                             'resolution); granules it lists as done are not processed again. Query it or import '
+                             '--archive files into it with sidecar_catalog.py')
     parser.add_argument('--parallel_files', dest='parallel_files', action='store_true',
                         help='Process files in parallel rather than looking up SIDs in parallel')
+    parser.add_argument('--timeout', metavar='seconds', type=float, default=None,
+                        help='with --parallel_files: give a granule up (and restart its worker) after seconds. '
+                             'Default: no timeout')
+    parser.add_argument('--retries', metavar='retries', type=int, default=1,
+                        help='with --parallel_files: number of times a failed (including a crashed worker) or timed '
+                             'out granule is retried. Default: 1')
+    parser.add_argument('--quarantine', metavar='quarantine', type=str, default=None,
+                        help='with --parallel_files: file to record granules that failed all retries in (with the '
+                             'error); granules listed in it are skipped')
+    parser.add_argument('--prefetch', metavar='n_granules', type=int, default=0,
+                        help='pipeline the granules: read the geolocation of up to n_granules granules ahead on a '
+                             'reader thread and write sidecars on a background writer while SIDs are looked up, '
+                             'and report the utilisation of each stage. Ignored with --parallel_files. Default: 0 '
+                             '(one granule after the other)')
+    parser.add_argument('--backend', metavar='backend', type=str, choices=staremaster.conversions.BACKENDS,
+                        default='dask',
+                        help='how SIDs are looked up in parallel with --workers > 1: dask (local or external dask '
+                             'cluster), shm (process pool working in shared memory) or threads (threads of this '
+                             'process; falls back to serial if pystare holds the GIL). Default: dask')
+    parser.add_argument('--scheduler_address', metavar='address', type=str, default=None,
+                        help='address of a running dask scheduler (e.g. tcp://10.0.0.1:8786) to look up SIDs on '
+                             'instead of a local cluster; --workers sets the number of chunks')
+    parser.add_argument('--scheduler_file', metavar='scheduler_file', type=str, default=None,
+                        help='scheduler file of a running dask scheduler (e.g. as written by dask-scheduler '
+                             '--scheduler-file)')
+    parser.add_argument('--resolution_estimate', metavar='estimate', type=str,
+                        choices=staremaster.conversions.RESOLUTION_ESTIMATES, default='pystare',
+                        help='how the resolution of the iFOV SIDs is adapted: pystare (estimated by pystare during '
+                             'the lookup) or spacing (level 27 lookup, then leveled by the spacing of '
+                             'neighbouring pixels with pystare\'s level thresholds). Default: pystare')
+    parser.add_argument('--conversion_chunks', metavar='conversion_chunks', type=parse_conversion_chunks,
+                        default=None,
+                        help='chunk shape of the parallel SID lookup with --workers > 1: auto (planned from the '
+                             'array shape, the number of workers and --conversion_chunk_bytes) or ROWSxCOLS (-1 for '
+                             'all rows/columns). Default: auto')
+    parser.add_argument('--conversion_chunk_bytes', metavar='bytes', type=int,
+                        default=staremaster.conversions.CHUNK_BYTES,
+                        help='largest lat, lon and SID bytes per task of --conversion_chunks auto. Default: 16 MiB')
+    parser.add_argument('--chunks', metavar='chunks', type=parse_chunks, default=None,
+                        help='chunking of the 2D sidecar variables: none (one chunk per variable), auto (tiles of '
+                             'about chunk_bytes), scan (whole scans of swath products) or a ROWSxCOLS tile shape. '
+                             'Default: none')
+    parser.add_argument('--chunk_bytes', metavar='chunk_bytes', type=int, default=2**20,
+                        help='target uncompressed chunk size in bytes for --chunks auto/scan. Default: 1 MiB')
+    parser.add_argument('--compression', metavar='compression', type=parse_compression, default='zlib',
+                        help='compression codec of the sidecar variables (e.g. none, zlib, zstd, bzip2, blosc_lz4, '
+                             'blosc_zstd; depending on the netCDF4 library). Default: zlib')
+    parser.add_argument('--complevel', metavar='complevel', type=int, default=4,
+                        help='compression level. Default: 4')
+    parser.add_argument('--format', metavar='format', type=str, choices=['netcdf', 'zarr'], default='netcdf',
+                        help='storage format of the sidecars: netcdf (_stare.nc) or zarr (_stare.zarr directory '
+                             'store; requires zarr). Default: netcdf')
+    parser.add_argument('--geolocation', metavar='geolocation', type=str, choices=staremaster.sidecar.GEOLOCATIONS,
+                        default='full',
+                        help='storage of the latitudes/longitudes: full (float32), quantized (scale/offset packed '
+                             'integers), reference (name of the geolocation variable in the granule) or none. '
+                             'Default: full')
+    parser.add_argument('--geolocation_precision', metavar='precision', type=float, default=1e-5,
+                        help='precision in degrees of --geolocation quantized. Default: 1e-5')
+    parser.add_argument('--sid_encoding', metavar='sid_encoding', type=str, choices=staremaster.sidecar.SID_ENCODINGS,
+                        default='raw',
+                        help='encoding of the STARE_index variables: raw or delta (row-wise, zigzag mapped '
+                             'differences; decode with staremaster.sidecar.read_sids()). Default: raw')
+    parser.add_argument('--background_writer', dest='background_writer', action='store_true',
+                        help='compress and write sidecar variables on a background thread while the next '
+                             'resolution/scan is converted')
+    parser.add_argument('--writer_queue', metavar='writer_queue', type=int, default=2,
+                        help='number of variables the background writer may hold back. Default: 2')
 
     parser.set_defaults(archive=False)
     parser.set_defaults(parallel_files=False)
+    parser.set_defaults(recursive=False)
+    parser.set_defaults(background_writer=False)
 
     args = parser.parse_args()
 
+    sidecar_options = {'chunks': args.chunks, 'chunk_bytes': args.chunk_bytes,
+                       'compression': args.compression, 'complevel': args.complevel,
+                       'format': args.format, 'geolocation': args.geolocation,
+                       'geolocation_precision': args.geolocation_precision, 'sid_encoding': args.sid_encoding,
+                       'background_writer': args.background_writer, 'writer_queue_size': args.writer_queue}
+
+    staremaster.conversions.set_backend(args.backend)
+    staremaster.conversions.set_chunks(args.conversion_chunks, args.conversion_chunk_bytes)
+    staremaster.conversions.set_resolution_estimate(args.resolution_estimate)
+    if args.cover_cache:
+        staremaster.conversions.set_cover_cache(args.cover_cache, max_bytes=args.cover_cache_bytes)
+    if args.scheduler_address or args.scheduler_file:
+        staremaster.conversions.connect(scheduler_address=args.scheduler_address,
+                                        scheduler_file=args.scheduler_file)
+
+    # Folder scans and file lists are generators, so processing starts before they are complete
     if args.files:
         file_paths = args.files
+    elif args.files_from:
+        file_paths = staremaster.discovery.read_file_list(args.files_from)
     elif args.folder:
-        file_paths = list_granules(args.folder, product=args.product)
+        file_paths = staremaster.discovery.find_granules(args.folder, product=args.product, recursive=args.recursive,
+                                                         start=args.start_date, end=args.end_date)
     elif args.grid:
-        create_grid_sidecar(args.grid, args.out_path, n_workers=args.workers)
+        create_grid_sidecar(args.grid, args.out_path, n_workers=args.workers, sidecar_options=sidecar_options)
+        staremaster.conversions.shutdown_client()
+        staremaster.conversions.shutdown_pool()
         quit()
     else:
-        print('Wrong usage; need to specify a folder, file, or grid\n')
+        print('Wrong usage; need to specify a folder, files, a file list or a grid\n')
         print(parser.print_help())
         quit()
 
     if args.archive:
         file_paths = remove_archived(file_paths, args.archive)
 
-    if args.parallel_files:
-        map_args = zip(file_paths,
-                       itertools.repeat(1),
-                       itertools.repeat(args.product),
-                       itertools.repeat(args.cover_res),
-                       itertools.repeat(args.out_path),
-                       itertools.repeat(args.archive))
-        with multiprocessing.Pool(processes=args.workers) as pool:
-            pool.starmap(create_sidecar, map_args)
-    else:
-        for file_path in file_paths:
-            create_sidecar(file_path=file_path,
-                           n_workers=args.workers,
-                           product=args.product,
-                           out_path=args.out_path,
-                           cover_res=args.cover_res,
-                           archive=args.archive)
+    catalog = None
+    if args.catalog:
+        catalog = staremaster.catalog.Catalog(args.catalog)
+        file_paths = catalog.skip_processed(file_paths)
+
+    try:
+        if args.parallel_files:
+            create_sidecars_parallel(file_paths, n_processes=args.workers, product=args.product,
+                                     cover_res=args.cover_res, out_path=args.out_path, archive=args.archive,
+                                     sidecar_options=sidecar_options, timeout=args.timeout, retries=args.retries,
+                                     quarantine=args.quarantine, catalog=catalog)
+        elif args.prefetch > 0:
+            create_sidecars_pipelined(file_paths, n_workers=args.workers, product=args.product,
+                                      cover_res=args.cover_res, out_path=args.out_path, archive=args.archive,
+                                      sidecar_options=sidecar_options, prefetch=args.prefetch, catalog=catalog)
+        else:
+            for file_path in file_paths:
+                create_sidecar(file_path=file_path,
+                               n_workers=args.workers,
+                               product=args.product,
+                               out_path=args.out_path,
+                               cover_res=args.cover_res,
+                               archive=args.archive,
+                               sidecar_options=sidecar_options,
+                               catalog=catalog)
+    finally:
+        # Writes the records held back
+        if catalog is not None:
+            catalog.close()
+    # The local cluster / process pool (if any) is reused for all granules and only shut down here
+    staremaster.conversions.shutdown_client()
+    staremaster.conversions.shutdown_pool()
 
 
 if __name__ == '__main__':
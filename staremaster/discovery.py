@@ -0,0 +1,173 @@
+""" Discovery of granules and sidecars in (possibly huge, date partitioned) folders.
+
+The functions are generators that walk the folders with os.scandir, so that the first granules can be processed
+before a folder with millions of entries is listed completely. Files are yielded in directory order; subfolders in
+name order. Folders of date partitioned archives (e.g. 2020/219, 2020/08/06 or 2020-08-06) and granules with an
+acquisition date in their name (e.g. MOD05_L2.A2020219...) outside a start/end date are skipped without being
+listed.
+"""
+
+import datetime
+import os
+import re
+import sys
+import staremaster.products
+
+GRANULE_EXTENSIONS = ('.nc', '.nc4', '.hdf', '.HDF5')
+SIDECAR_PATTERN = re.compile(r'_stare\.(nc|nc4|hdf|HDF5|zarr)$')
+YEAR_PATTERN = re.compile(r'^(19|20)\d\d$')
+DATE_PATTERN = re.compile(r'^(\d{4})[.-](\d{2})[.-](\d{2})$')
+# Acquisition date of the MODIS/VIIRS naming convention (.AYYYYDDD.)
+GRANULE_DATE_PATTERN = re.compile(r'\.A(\d{4})(\d{3})\.')
+
+
+def parse_date(date):
+    """ Parses a YYYY-MM-DD date
+
+    >>> parse_date('2020-08-06')
+    datetime.date(2020, 8, 6)
+    """
+    return datetime.datetime.strptime(date, '%Y-%m-%d').date()
+
+
+def partition_range(components):
+    """ The first and last date covered by a date partition folder, given the names of the folders leading to it;
+    None if the folder is no date partition
+
+    >>> partition_range(['MOD05_L2', '2020', '219'])
+    (datetime.date(2020, 8, 6), datetime.date(2020, 8, 6))
+    >>> partition_range(['2020', '02'])
+    (datetime.date(2020, 2, 1), datetime.date(2020, 2, 29))
+    >>> partition_range(['MOD05_L2']) is None
+    True
+    """
+    if components:
+        match = DATE_PATTERN.match(components[-1])
+        if match:
+            date = datetime.date(*map(int, match.groups()))
+            return date, date
+    for i in reversed(range(len(components))):
+        if YEAR_PATTERN.match(components[i]):
+            year = int(components[i])
+            rest = components[i + 1:]
+            break
+    else:
+        return None
+    try:
+        if rest and len(rest[0]) == 3 and rest[0].isdigit():
+            date = datetime.date(year, 1, 1) + datetime.timedelta(days=int(rest[0]) - 1)
+            if date.year == year:
+                return date, date
+        elif rest and len(rest[0]) == 2 and rest[0].isdigit():
+            month = int(rest[0])
+            if len(rest) > 1 and len(rest[1]) == 2 and rest[1].isdigit():
+                date = datetime.date(year, month, int(rest[1]))
+                return date, date
+            first = datetime.date(year, month, 1)
+            following = datetime.date(year + month // 12, month % 12 + 1, 1)
+            return first, following - datetime.timedelta(days=1)
+    except ValueError:
+        # Numbered folders that are not dates
+        pass
+    return datetime.date(year, 1, 1), datetime.date(year, 12, 31)
+
+
+def granule_date(file_name):
+    """ The acquisition date in a granule's name, if any
+
+    >>> granule_date('MOD05_L2.A2005349.2125.061.2017294065400.hdf')
+    datetime.date(2005, 12, 15)
+    """
+    match = GRANULE_DATE_PATTERN.search(file_name)
+    if match is None:
+        return None
+    return datetime.date(int(match.group(1)), 1, 1) + datetime.timedelta(days=int(match.group(2)) - 1)
+
+
+def in_range(first, last, start, end):
+    return (start is None or last >= start) and (end is None or first <= end)
+
+
+def scan_files(folder, recursive=False, start=None, end=None, hidden=False):
+    """ Yields the paths of the files in folder (and, if recursive, its subfolders). Hidden entries (e.g. partial
+    sidecars) are skipped unless hidden; they are never descended into. Partitions and granules outside the dates
+    start and end are skipped. Zarr stores are yielded like files """
+    folder = os.path.expanduser(folder)
+    stack = [(folder, [])]
+    while stack:
+        path, components = stack.pop()
+        subfolders = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    if not hidden:
+                        continue
+                elif entry.is_dir() and not entry.name.endswith('.zarr'):
+                    if recursive:
+                        subfolders.append(entry.name)
+                    continue
+                if start is not None or end is not None:
+                    date = granule_date(entry.name)
+                    if date is not None and not in_range(date, date, start, end):
+                        continue
+                yield entry.path
+        for name in sorted(subfolders, reverse=True):
+            dates = partition_range(components + [name])
+            if dates is not None and not in_range(dates[0], dates[1], start, end):
+                continue
+            stack.append((os.path.join(path, name), components + [name]))
+
+
+def is_sidecar(file_path):
+    """
+    >>> is_sidecar('MOD05_L2.A2005349.2125.061.2017294065400_stare.nc'), is_sidecar('VNP03_stare_test.nc')
+    (True, False)
+    """
+    return SIDECAR_PATTERN.search(file_path) is not None
+
+
+def is_granule(file_path):
+    """
+    >>> is_granule('MOD05_L2.A2005349.2125.061.2017294065400.hdf'), is_granule('MOD05_L2.A2005349_stare.nc')
+    (True, False)
+    >>> is_granule('MOD05_L2.A2005349.2125.061.2017294065400.hdf.xml')
+    False
+    """
+    return file_path.endswith(GRANULE_EXTENSIONS) and not is_sidecar(file_path)
+
+
+def find_granules(folder, product=None, prefix='', recursive=False, start=None, end=None):
+    """ Yields the granules in folder, optionally only those of product (by the file patterns of the product
+    registry) or whose name starts with prefix """
+    for file_path in scan_files(folder, recursive=recursive, start=start, end=end):
+        file_name = os.path.basename(file_path)
+        if not is_granule(file_name) or not file_name.startswith(prefix):
+            continue
+        if product and not staremaster.products.is_product(file_name, product):
+            continue
+        yield file_path
+
+
+def find_sidecars(folder, prefix='', recursive=False, start=None, end=None):
+    """ Yields the sidecars (netCDF files and Zarr stores) in folder whose name starts with prefix """
+    for file_path in scan_files(folder, recursive=recursive, start=start, end=end):
+        file_name = os.path.basename(file_path)
+        if is_sidecar(file_name) and file_name.startswith(prefix):
+            yield file_path
+
+
+def read_file_list(source):
+    """ Yields the paths listed in the file source (or stdin for '-'), one per line; blank lines and lines starting
+    with # are skipped """
+    if source == '-':
+        lines = sys.stdin
+    else:
+        lines = open(source, 'r')
+    try:
+        for line in lines:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
@@ -1,59 +1,91 @@
 #!/usr/bin/python3
 
-import glob
 import os
 import argparse
 import netCDF4
 import re
 import pandas
+from staremaster.sidecar import PARTIAL_SUFFIX
+import staremaster.catalog
+import staremaster.discovery
 
 
-def get_granule_paths(folder, granule_pattern):
-    granule_paths = sorted(glob.glob(os.path.expanduser(folder) + '/' + '*' ))
-    pattern = '.*/{}.*[^_stare]\.(nc|hdf|HDF5)'.format(granule_pattern)
-    granule_paths = list(filter(re.compile(pattern).match, granule_paths))        
-    return granule_paths
+def get_granule_paths(folder, granule_pattern, recursive=False):
+    granule_paths = staremaster.discovery.find_granules(folder, recursive=recursive)
+    return sorted(path for path in granule_paths if re.match(granule_pattern, os.path.basename(path)))
 
 
-def get_sidecar_paths(folder, granule_pattern):
-    sidecar_paths = sorted(glob.glob(os.path.expanduser(folder) + '/' + '*' ))
-    pattern = '.*/{}.*_stare\.(nc|hdf|HDF5)'.format(granule_pattern)
-    sidecar_paths = list(filter(re.compile(pattern).match, sidecar_paths))       
-    return sidecar_paths
+def get_sidecar_paths(folder, granule_pattern, recursive=False):
+    sidecar_paths = staremaster.discovery.find_sidecars(folder, recursive=recursive)
+    return sorted(path for path in sidecar_paths if re.match(granule_pattern, os.path.basename(path)))
 
 
-def get_lonely_granules(granules, sidecars):    
-    sidecars = [name.replace('_stare', '') for name in sidecars]
-    missing = list(set(granules) - set(sidecars))
+def get_partial_paths(folder, recursive=False):
+    # Sidecars of aborted runs; Sidecar only renames the temporary file into place once it is complete
+    partial_paths = staremaster.discovery.scan_files(folder, recursive=recursive, hidden=True)
+    return sorted(path for path in partial_paths
+                  if os.path.basename(path).startswith('.') and path.endswith(PARTIAL_SUFFIX))
+
+
+def get_lonely_granules(granules, sidecars):
+    # Sidecars do not necessarily share the extension (or folder) of their granule, e.g. X.hdf -> X_stare.nc/.zarr
+    sidecar_names = set(re.sub('_stare\\.[^.]+$', '', os.path.basename(name)) for name in sidecars)
+    missing = [granule for granule in granules if os.path.splitext(os.path.basename(granule))[0] not in sidecar_names]
     return missing
     
 
-def missing_variable(keys):
+def get_cataloged(granules, catalog):
+    # Granules the catalog records as done whose sidecar (possibly in another folder) still exists
+    with staremaster.catalog.Catalog(catalog) as cat:
+        sidecars = cat.lookup(granules)
+    return set(granule for granule, sidecar in sidecars.items() if sidecar and os.path.exists(sidecar))
+
+
+def missing_variable(keys, geolocation_storage='full'):
     keys = ';'.join(list(keys))
     variables = ['Longitude', 'Latitude', 'STARE_index', 'STARE_cover']
+    if geolocation_storage == 'none':
+        variables = ['STARE_index', 'STARE_cover']
     for variable in variables:         
         if variable not in keys:            
             return True
     return False
         
 
+def zarr_keys(sidecar):
+    import zarr
+    group = zarr.open_group(sidecar, mode='r')
+    geolocation_storage = group.attrs.get('geolocation_storage', 'full')
+    return [name for name, _ in group.arrays()], geolocation_storage
+
+
 def find_broken(sidecars):
     broken = []
     for sidecar in sidecars:
-        netcdf = netCDF4.Dataset(sidecar, 'r', format = 'NETCDF4')
-        keys = netcdf.variables.keys()
-        if missing_variable(keys):
+        if sidecar.endswith('.zarr'):
+            keys, geolocation_storage = zarr_keys(sidecar)
+        else:
+            netcdf = netCDF4.Dataset(sidecar, 'r', format = 'NETCDF4')
+            keys = netcdf.variables.keys()
+            geolocation_storage = getattr(netcdf, 'geolocation_storage', 'full')
+        if missing_variable(keys, geolocation_storage):
             granule = sidecar.replace('_stare', '')
             broken.append(granule)
     return broken
 
         
-if __name__ == '__main__':
+def main():
     parser = argparse.ArgumentParser(description='Finds and retrieves missing stare sidecar files')
     parser.add_argument('--granule_folder', type=str, help='Granule folder (e.g. location of VNP02DNB, VNP03DNB, or CLDMSK)', required=True)
     parser.add_argument('--sidecar_folder', type=str, help='Companion folder (e.g. location of *_stare.nc). Default: granule_folder', required=False)
     parser.add_argument('--granule_pattern', type=str, help='Pattern of the granule name (e.g. VNP02DNB, VNP03DNB, or CLDMSK)', required=False, default='')
-    parser.add_argument('--find_broken', help='toggle if sidecars should be checked for completion', action='store_true')
+    parser.add_argument('--recursive', action='store_true',
+                        help='also look for granules and sidecars in subfolders (e.g. date partitions)')
+    parser.add_argument('--find_broken', action='store_true',
+                        help='toggle if sidecars should be checked for completion. Sidecars are moved into place '
+                             'only once complete, so this is only needed for sidecars written by older versions')
+    parser.add_argument('--catalog', help='catalog of create_sidecar_files.py --catalog; granules it records as done '
+                                          'with an existing sidecar are not missing')
     parser.add_argument('--archive', help='write an archive file out containing all granule-sidecar pairs')
     parser.add_argument('--out', help='file to write granules without sidecar')
     
@@ -63,13 +95,20 @@ if __name__ == '__main__':
         args.sidecar_folder = args.granule_folder 
         
     
-    granules = get_granule_paths(folder=args.granule_folder, granule_pattern=args.granule_pattern)
-    sidecars = get_sidecar_paths(folder=args.sidecar_folder, granule_pattern=args.granule_pattern)
+    granules = get_granule_paths(folder=args.granule_folder, granule_pattern=args.granule_pattern,
+                                 recursive=args.recursive)
+    sidecars = get_sidecar_paths(folder=args.sidecar_folder, granule_pattern=args.granule_pattern,
+                                 recursive=args.recursive)
     
     print('{} granules'.format(len(granules)))
     print('{} sidecars'.format(len(sidecars)))
+    partial_paths = get_partial_paths(args.sidecar_folder, recursive=args.recursive)
+    print('{} partial sidecars of aborted runs'.format(len(partial_paths)))
     
     missing = get_lonely_granules(granules, sidecars)
+    if args.catalog:
+        cataloged = get_cataloged(missing, args.catalog)
+        missing = [granule for granule in missing if granule not in cataloged]
     print('{} missing'.format(len(missing)))
     
     if args.find_broken:    
@@ -88,5 +127,7 @@ if __name__ == '__main__':
             good_sidecars.append(sidecar)
         df = pandas.DataFrame({'granule': good_granules, 'sidecar': good_sidecars})
         df.to_csv(args.archive, header=False, index=False)
-        
-        
+
+
+if __name__ == '__main__':
+    main()
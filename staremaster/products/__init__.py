@@ -1,11 +1,166 @@
-from staremaster.products.mod05 import MOD05
-from staremaster.products.mod09 import MOD09
-from staremaster.products.viirsL2 import VNP03MOD, CLMDKS_L2_VIIRS, VNP03IMG
-from staremaster.products.ssmis import SSMIS
-from staremaster.products.atms import ATMS
-from staremaster.products.amsr import AMSR
-from staremaster.products.imerg import IMERG
-from staremaster.products.satcorps import satCORPS
-from staremaster.products.modis_tilegrid import ModisTile
-from staremaster.products.goes_abi_fixed_grid import GOES_ABI_FIXED_GRID
-from staremaster.products.merra2 import MERRA2
\ No newline at end of file
+""" Registry of the granule products.
+
+Product modules import heavy readers (pyhdf, netCDF4, scipy, pystare), so they are only imported when a product is
+used: product_class() imports the module of a single product, and the classes below (e.g.
+staremaster.products.MOD05) are resolved on first access. Other packages add products through the
+'staremaster.products' entry point group; the entry point name is the product name, e.g.
+
+    [options.entry_points]
+    staremaster.products =
+        MYPRODUCT = mypackage.myproduct:MyProduct
+"""
+
+import importlib
+import re
+
+ENTRY_POINT_GROUP = 'staremaster.products'
+
+# Classes of this package and the module they are defined in
+CLASSES = {'MOD05': 'mod05', 'MOD09': 'mod09', 'VNP03MOD': 'viirsL2', 'VNP03IMG': 'viirsL2',
+           'CLMDKS_L2_VIIRS': 'viirsL2', 'SSMIS': 'ssmis', 'ATMS': 'atms', 'AMSR': 'amsr', 'IMERG': 'imerg',
+           'satCORPS': 'satcorps', 'ModisTile': 'modis_tilegrid', 'GOES_ABI_FIXED_GRID': 'goes_abi_fixed_grid',
+           'MERRA2': 'merra2'}
+
+# Product name: 'module:class' of the granule class
+PRODUCTS = {
+    'MOD05': 'staremaster.products.mod05:MOD05',
+    'MOD09': 'staremaster.products.mod09:MOD09',
+    'VNP03MOD': 'staremaster.products.viirsL2:VNP03MOD',
+    'VNP03DNB': 'staremaster.products.viirsL2:VNP03MOD',
+    'VJ103MOD': 'staremaster.products.viirsL2:VNP03MOD',
+    'VJ103DNB': 'staremaster.products.viirsL2:VNP03MOD',
+    'VNP03IMG': 'staremaster.products.viirsL2:VNP03IMG',
+    'VJ103IMG': 'staremaster.products.viirsL2:VNP03IMG',
+    'CLDMSK_L2_VIIRS_SNPP': 'staremaster.products.viirsL2:CLMDKS_L2_VIIRS',
+    'CLDMSK_L2_VIIRS_NOAA20': 'staremaster.products.viirsL2:CLMDKS_L2_VIIRS',
+    'CLDMSK_L2_SNPP': 'staremaster.products.viirsL2:CLMDKS_L2_VIIRS',
+    'SSMIS': 'staremaster.products.ssmis:SSMIS',
+    'ATMS': 'staremaster.products.atms:ATMS',
+    'AMSR': 'staremaster.products.amsr:AMSR',
+    'GOES_ABI_FIXED_GRID': 'staremaster.products.goes_abi_fixed_grid:GOES_ABI_FIXED_GRID',
+}
+
+# Granule file name patterns and their product; the first pattern that matches the file name wins
+FILE_PATTERNS = [
+    (r'MOD05_L2\..*\.hdf$', 'MOD05'),
+    (r'MOD09\..*\.hdf$', 'MOD09'),
+    (r'(VNP03|VJ103)(MOD|DNB|IMG)\..*\.nc$', None),
+    (r'CLDMSK_L2_VIIRS_(SNPP|NOAA20)\..*\.nc$', None),
+    (r'.*SSMIS.*\.HDF5$', 'SSMIS'),
+    (r'.*ATMS.*\.HDF5$', 'ATMS'),
+    (r'.*AMSR.*\.HDF5$', 'AMSR'),
+    (r'OR_ABI-L\d.*\.nc$', 'GOES_ABI_FIXED_GRID'),
+]
+
+# Product names that are not given by the file patterns and the name of the same granules
+ALIASES = {'CLDMSK_L2_SNPP': 'CLDMSK_L2_VIIRS_SNPP'}
+
+entry_points_loaded = False
+
+
+def load_entry_points():
+    """ Registers the products of the 'staremaster.products' entry points (once); their modules are not imported """
+    global entry_points_loaded
+    if entry_points_loaded:
+        return
+    entry_points_loaded = True
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        # Python < 3.8
+        return
+    try:
+        group = entry_points(group=ENTRY_POINT_GROUP)
+    except TypeError:
+        # Python < 3.10
+        group = entry_points().get(ENTRY_POINT_GROUP, [])
+    for entry_point in group:
+        name = entry_point.name.upper()
+        PRODUCTS[name] = entry_point.value
+        # Granules of plugin products are recognized by the product name
+        FILE_PATTERNS.append(('.*' + re.escape(name), name))
+
+
+def register_product(name, target, pattern=None):
+    """ Registers a product: target is a granule class or its 'module:class' name. Granule files matching the
+    pattern (a regular expression matched against the file name) are of this product """
+    PRODUCTS[name] = target
+    if pattern is not None:
+        FILE_PATTERNS.insert(0, (pattern, name))
+
+
+def product_names():
+    """ The names of the registered products """
+    load_entry_points()
+    return sorted(PRODUCTS)
+
+
+def product_class(name):
+    """ The granule class of the product name, importing its module
+
+    >>> product_class('vnp03dnb').__name__
+    'VNP03MOD'
+    """
+    load_entry_points()
+    name = name.upper()
+    if name not in PRODUCTS:
+        raise ValueError('product {} not supported; supported products are {}'.format(name, product_names()))
+    target = PRODUCTS[name]
+    if isinstance(target, str):
+        module_name, class_name = target.split(':')
+        target = getattr(importlib.import_module(module_name), class_name)
+    return target
+
+
+def product_from_filename(file_path):
+    """ The product of a granule file by its name
+
+    >>> product_from_filename('tests/data/viirs/VNP03DNB.A2020219.0742.001.2020219124651.nc')
+    'VNP03DNB'
+    >>> product_from_filename('1C.NOAA19.MHS.XCAL2016-V.20210201-S004212-E022411.061766.V05A.HDF5')
+    Traceback (most recent call last):
+    ...
+    ValueError: could not determine product for 1C.NOAA19.MHS.XCAL2016-V.20210201-S004212-E022411.061766.V05A.HDF5
+    """
+    load_entry_points()
+    file_name = file_path.split('/')[-1]
+    for pattern, name in FILE_PATTERNS:
+        match = re.match(pattern, file_name)
+        if match:
+            # Patterns without a product name match the product name itself
+            return name or match.group(0).split('.')[0]
+    raise ValueError('could not determine product for {}'.format(file_path))
+
+
+def is_product(file_path, name):
+    """ Whether a granule file is of the product name, by its file name. Granules that match no file pattern (e.g. of
+    plugin products registered without one) are of the products whose name they contain
+
+    >>> is_product('OR_ABI-L1b-RadF-M6C01_G16_s20202190000000.nc', 'GOES_ABI_FIXED_GRID')
+    True
+    >>> is_product('CLDMSK_L2_VIIRS_SNPP.A2020219.0742.001.2020219190616.nc', 'CLDMSK_L2_SNPP')
+    True
+    >>> is_product('VNP03DNB.A2020219.0742.001.2020219124651.nc', 'VNP03MOD')
+    False
+    """
+    name = name.upper()
+    name = ALIASES.get(name, name)
+    try:
+        return product_from_filename(file_path) == name
+    except ValueError:
+        return name in file_path.split('/')[-1]
+
+
+def __getattr__(name):
+    # Lazily imported classes and product modules, e.g. staremaster.products.MOD05, staremaster.products.viirsL2
+    if name.startswith('__'):
+        raise AttributeError('module {} has no attribute {}'.format(__name__, name))
+    if name in CLASSES:
+        return getattr(importlib.import_module('staremaster.products.' + CLASSES[name]), name)
+    try:
+        return importlib.import_module('staremaster.products.' + name)
+    except ModuleNotFoundError as e:
+        if e.name != 'staremaster.products.' + name:
+            # A dependency of the module is missing
+            raise
+        raise AttributeError('module {} has no attribute {}'.format(__name__, name))
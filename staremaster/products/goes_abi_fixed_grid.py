@@ -61,9 +61,15 @@ class GOES_ABI_FIXED_GRID:
         self.lats = {}
         self.lons = {}
         self.mask = {}
+        self.resolution_stats = {}
         self.fill_value_in  = -9999
         self.fill_value_out = -998
 
+    def close(self):
+        """ Closes the netCDF file """
+        if self.netcdf.isopen():
+            self.netcdf.close()
+
     def load(self):
         self.get_latlon()
 
@@ -109,68 +115,70 @@ class GOES_ABI_FIXED_GRID:
 
         return
 
-    def create_sidecar(self, n_workers=1, cover_res=None, out_path=None):
+    def create_sidecar(self, n_workers=1, cover_res=None, out_path=None, **sidecar_options):
 
-        sidecar = Sidecar(self.file_path, out_path)
+        with Sidecar(self.file_path, out_path, **sidecar_options) as sidecar:
 
-        cover_all = []
-        for resolution_name in self.lons.keys():
-            lons = self.lons[resolution_name]
-            lats = self.lats[resolution_name]
+            cover_all = staremaster.conversions.CoverAccumulator()
+            for resolution_name in self.lons.keys():
+                lons = self.lons[resolution_name]
+                lats = self.lats[resolution_name]
 
-            # The following does not handle masked data or with weird fill values.
-            # sids = staremaster.conversions.latlon2stare(lats, lons, n_workers=n_workers)
+                # The following does not handle masked data or with weird fill values.
+                # sids = staremaster.conversions.latlon2stare(lats, lons, n_workers=n_workers)
             
-            sids = staremaster.conversions.latlon2stare(lats, lons, n_workers=n_workers,
-                                                        fill_value_in  = self.fill_value_in,
-                                                        fill_value_out = int(self.fill_value_out)
-                                                        )
-
-            not_mask = ~self.mask[resolution_name]
-
-            # sids = numpy.full(lats.shape,self.fill_value,dtype=numpy.int64)
-            # # Nope: sids[not_mask] = pystare.from_latlon(lats[not_mask],lons[not_mask],level=27)
-            # 
-            # # Too slow by a lot
-            # for ix in range(sids.shape[1]):
-            #     sids[not_mask[:,ix]] = staremaster.conversions.latlon2stare(
-            #         lats[not_mask[:,ix]],
-            #         lons[not_mask[:,ix]],
-            #         n_workers=n_workers
-            #         )
-
-            if not cover_res:
-                # Need to drop the resolution to make the cover less sparse
-                cover_res = staremaster.conversions.min_resolution(sids[not_mask])
-                cover_res = cover_res - 2
-                if cover_res < 0:
-                    cover_res = 0
-
-            sids_adapted = pystare.spatial_coerce_resolution(sids[not_mask], cover_res)
-            # sids_adapted = pystare.spatial_coerce_resolution(sids, cover_res)
-
-            cover_sids = staremaster.conversions.merge_stare(sids_adapted, n_workers=n_workers)
-
-            cover_all.append(cover_sids)
-
-            i = lats.shape[0]
-            j = lats.shape[1]
-            l = cover_sids.size
-
-            sids[self.mask[resolution_name]]=self.fill_value_out
-
-            nom_res = None
-
-            sidecar.write_dimensions(i, j, l, nom_res=nom_res, group=resolution_name)
-            sidecar.write_lons(lons, nom_res=nom_res, group=resolution_name, fill_value=self.fill_value_in)
-            sidecar.write_lats(lats, nom_res=nom_res, group=resolution_name, fill_value=self.fill_value_in)
-            sidecar.write_sids(sids, nom_res=nom_res, group=resolution_name, fill_value=self.fill_value_out)
-            sidecar.write_cover(cover_sids, nom_res=nom_res, group=resolution_name) # Should have no fill_value elements
-
-        cover_all = numpy.concatenate(cover_all)
-        cover_all = staremaster.conversions.merge_stare(cover_all, n_workers=n_workers)
-        # sidecar.write_dimension('l', cover_all.size) # Already in the next call... since no group.
-        sidecar.write_cover(cover_all, nom_res=nom_res)
+                # Off-earth pixels are not converted and get fill_value_out
+                sids = staremaster.conversions.latlon2stare(lats, lons, n_workers=n_workers,
+                                                            fill_value_in  = self.fill_value_in,
+                                                            fill_value_out = int(self.fill_value_out),
+                                                            mask = self.mask[resolution_name]
+                                                            )
+
+                not_mask = ~self.mask[resolution_name]
+                self.resolution_stats[resolution_name] = staremaster.conversions.resolution_stats(
+                    sids, fill_value=self.fill_value_out)
+
+                # sids = numpy.full(lats.shape,self.fill_value,dtype=numpy.int64)
+                # # Nope: sids[not_mask] = pystare.from_latlon(lats[not_mask],lons[not_mask],level=27)
+                # 
+                # # Too slow by a lot
+                # for ix in range(sids.shape[1]):
+                #     sids[not_mask[:,ix]] = staremaster.conversions.latlon2stare(
+                #         lats[not_mask[:,ix]],
+                #         lons[not_mask[:,ix]],
+                #         n_workers=n_workers
+                #         )
+
+                if not cover_res:
+                    # Need to drop the resolution to make the cover less sparse
+                    cover_res = self.resolution_stats[resolution_name]['min_resolution']
+                    cover_res = cover_res - 2
+                    if cover_res < 0:
+                        cover_res = 0
+
+                sids_adapted = pystare.spatial_coerce_resolution(sids[not_mask], cover_res)
+                # sids_adapted = pystare.spatial_coerce_resolution(sids, cover_res)
+
+                cover_sids = staremaster.conversions.merge_stare(sids_adapted, n_workers=n_workers)
+
+                cover_all.add(cover_sids)
+
+                i = lats.shape[0]
+                j = lats.shape[1]
+                l = cover_sids.size
+
+                nom_res = None
+
+                sidecar.write_dimensions(i, j, l, nom_res=nom_res, group=resolution_name)
+                sidecar.write_lons(lons, nom_res=nom_res, group=resolution_name, fill_value=self.fill_value_in)
+                sidecar.write_lats(lats, nom_res=nom_res, group=resolution_name, fill_value=self.fill_value_in)
+                sidecar.write_sids(sids, nom_res=nom_res, group=resolution_name, fill_value=self.fill_value_out,
+                                   resolution_stats=self.resolution_stats[resolution_name])
+                sidecar.write_cover(cover_sids, nom_res=nom_res, group=resolution_name) # Should have no fill_value elements
+
+            cover_all = cover_all.cover()
+            # sidecar.write_dimension('l', cover_all.size) # Already in the next call... since no group.
+            sidecar.write_cover(cover_all, nom_res=nom_res)
 
         return sidecar
 
@@ -42,9 +42,20 @@ class HDFeos:
         self.hdf = SD(file_path)
         self.file_path = file_path
         self.nom_res = []
+        self.scan_rows = {}
+        # (latitude, longitude) SDS names of the geolocation that is stored in the granule as-is, per nom_res
+        self.geolocation_sds = {}
         self.sids = {}
+        # Resolution statistics of the SIDs per nom_res (see staremaster.conversions.resolution_stats())
+        self.resolution_stats = {}
         self.cover_sids = []
 
+    def close(self):
+        """ Closes the HDF file """
+        if self.hdf is not None:
+            self.hdf.end()
+            self.hdf = None
+
     def get_metadata_group(self, group_name):
         metadata_group = {}
         keys = [s for s in self.hdf.attributes().keys() if group_name in s]
@@ -56,15 +67,22 @@ class HDFeos:
 
     def make_sids(self, n_workers):
         for res in self.nom_res:
-            sids = staremaster.conversions.latlon2stare(self.lats[res], self.lons[res],
-                                                        resolution=None, n_workers=n_workers, adapt_resolution=True)
-            sids = numpy.ma.array(sids, mask=self.lats[res].mask, fill_value=0)
-            self.sids[res] = sids
+            self.make_res_sids(res, n_workers)
+
+    def make_res_sids(self, res, n_workers):
+        # Pixels outside of the valid range are not converted
+        mask = numpy.ma.getmaskarray(self.lats[res]) | numpy.ma.getmaskarray(self.lons[res])
+        sids = staremaster.conversions.latlon2stare(self.lats[res], self.lons[res],
+                                                    resolution=None, n_workers=n_workers, adapt_resolution=True,
+                                                    mask=mask)
+        sids = numpy.ma.array(sids, mask=mask, fill_value=0)
+        self.sids[res] = sids
+        self.resolution_stats[res] = staremaster.conversions.resolution_stats(sids)
             
     def get_cover_res_from_sids(self):
-        sids = self.sids[self.nom_res[0]]
-        sids = sids[sids.mask == False]
-        cover_res = staremaster.conversions.min_resolution(sids)
+        cover_res = self.resolution_stats[self.nom_res[0]]['min_resolution']
+        if cover_res is None:
+            raise ValueError('there are no valid SIDs')
         return cover_res
 
     def make_cover_sids(self, cover_res):
@@ -85,24 +103,25 @@ class HDFeos:
         data = numpy.ma.masked_outside(data, lower_bound, upper_bound, copy=True)
         return data
 
-    def create_sidecar(self, n_workers, cover_res=None, out_path=None):
-        self.make_sids(n_workers)
-        try:
-            self.make_cover_sids(cover_res)
-        except ValueError as e:
-            print('Failed to create sids/covers for {file_name}'.format(file_name=self.file_path))
-            raise e
+    def create_sidecar(self, n_workers, cover_res=None, out_path=None, **sidecar_options):
+        with Sidecar(self.file_path, out_path, **sidecar_options) as sidecar:
+            # Each resolution is written as soon as its SIDs are computed; with a background writer, writing
+            # overlaps with the conversion of the next resolution
+            for res in self.nom_res:
+                self.make_res_sids(res, n_workers)
+                i = self.lats[res].shape[0]
+                j = self.lats[res].shape[1]
+                sidecar.write_dimensions(i, j, None, nom_res=res, scan_rows=self.scan_rows.get(res))
+                lat_sds, lon_sds = self.geolocation_sds.get(res, (None, None))
+                sidecar.write_lons(self.lons[res], nom_res=res, reference=lon_sds)
+                sidecar.write_lats(self.lats[res], nom_res=res, reference=lat_sds)
+                sidecar.write_sids(self.sids[res], nom_res=res, resolution_stats=self.resolution_stats[res])
 
-        sidecar = Sidecar(self.file_path, out_path)
-        sidecar.write_cover(self.cover_sids, nom_res=self.nom_res)
-
-        for res in self.nom_res:
-            i = self.lats[res].shape[0]
-            j = self.lats[res].shape[1]
-            l = self.cover_sids.size
-            sidecar.write_dimensions(i, j, l, nom_res=res)
-            sidecar.write_lons(self.lons[res], nom_res=res)
-            sidecar.write_lats(self.lats[res], nom_res=res)
-            sidecar.write_sids(self.sids[res], nom_res=res)
+            try:
+                self.make_cover_sids(cover_res)
+            except ValueError as e:
+                print('Failed to create sids/covers for {file_name}'.format(file_name=self.file_path))
+                raise e
+            sidecar.write_cover(self.cover_sids, nom_res=self.nom_res)
 
         return sidecar
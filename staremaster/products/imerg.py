@@ -43,7 +43,7 @@ class IMERG:
             self.make_sids()
         return self.sids
 
-    def create_sidecar(self, out_path, n_workers):
+    def create_sidecar(self, out_path, n_workers, **sidecar_options):
         sids = self.get_sids()
         cover_sids = self.get_cover_sids()
         
@@ -51,7 +51,7 @@ class IMERG:
         j = self.lats.shape[1]
         l = cover_sids.size
         
-        sidecar = Sidecar(granule_path='IMERG.HDF5', out_path=out_path)
-        sidecar.write_dimensions(i, j, l, nom_res=self.nom_res)    
-        sidecar.write_sids(sids, nom_res=self.nom_res)
-        sidecar.write_cover(cover_sids, nom_res=self.nom_res)
+        with Sidecar(granule_path='IMERG.HDF5', out_path=out_path, **sidecar_options) as sidecar:
+            sidecar.write_dimensions(i, j, l, nom_res=self.nom_res)
+            sidecar.write_sids(sids, nom_res=self.nom_res)
+            sidecar.write_cover(cover_sids, nom_res=self.nom_res)
@@ -200,6 +200,9 @@ class MERRA2:
         # Array of STARE cover SIDs
         self.cover_sids = []
 
+        # Resolution statistics of the SIDs (see staremaster.conversions.resolution_stats())
+        self.resolution_stats = None
+
         # String identifier for data-grids with different resolutions (N/A to MERRA-2)
         self.nom_res = ''
 
@@ -482,7 +485,8 @@ class MERRA2:
 
         ##
         # Find a Q-Level for cover encoding
-        cover_res = staremaster.conversions.min_resolution(self.sids)
+        self.resolution_stats = staremaster.conversions.resolution_stats(self.sids)
+        cover_res = self.resolution_stats['min_resolution']
         # print(f"\t{cover_res = }")
 
         # Drop the resolution to make the cover less sparse
@@ -610,15 +614,18 @@ class MERRA2:
             sidecar_name = f"{out_path}merra2_mcms_sidecar.hdf"
         else:
             sidecar_name = f"{out_path}merra2_sidecar.hdf"
-        sidecar = Sidecar(granule_path=sidecar_name, out_path=out_path)
 
         ##
         # Save Sidecar to file
-        sidecar.write_dimensions(i, j, l)
-        sidecar.write_sids(self.sids)
-        sidecar.write_lons(self.lons)
-        sidecar.write_lats(self.lats)
-        sidecar.write_cover(self.cover_sids)
+        with Sidecar(granule_path=sidecar_name, out_path=out_path) as sidecar:
+            sidecar.write_dimensions(i, j, l)
+            if self.resolution_stats is None:
+                # The cover was read from its pickle
+                self.resolution_stats = staremaster.conversions.resolution_stats(self.sids)
+            sidecar.write_sids(self.sids, resolution_stats=self.resolution_stats)
+            sidecar.write_lons(self.lons)
+            sidecar.write_lats(self.lats)
+            sidecar.write_cover(self.cover_sids)
 
 # >>>> ::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::: <<<<
 # >>>> END OF FILE | END OF FILE | END OF FILE | END OF FILE | END OF FILE | END OF FILE <<<<
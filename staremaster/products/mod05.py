@@ -7,6 +7,8 @@ class MOD05(HDFeos):
     def __init__(self, file_path):
         super(MOD05, self).__init__(file_path)
         self.nom_res = ['5km']
+        self.scan_rows = {'5km': 2}
+        self.geolocation_sds = {'5km': ('Latitude', 'Longitude')}
 
     def load(self):
         self.read_gring()
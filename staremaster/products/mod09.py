@@ -9,6 +9,9 @@ class MOD09(HDFeos):
     def __init__(self, file_path):
         super(MOD09, self).__init__(file_path)
         self.nom_res = ['1km', '500m']
+        self.scan_rows = {'1km': 10, '500m': 20}
+        # The 500m geolocation is interpolated from the 1km geolocation
+        self.geolocation_sds = {'1km': ('Latitude', 'Longitude')}
         self.read_gring()
 
     def load(self):
@@ -75,7 +75,7 @@ class ModisTile():
         self.sids = staremaster.conversions.latlon2stare(self.cells_lats, self.cells_lons, resolution=None,
                                                          n_workers=n_workers, adapt_resolution=True)
 
-    def create_sidecar(self, out_path, n_workers=1):
+    def create_sidecar(self, out_path, n_workers=1, **sidecar_options):
         self.make_sids(n_workers=n_workers)
         self.make_cover_sids(n_workers=n_workers)
 
@@ -83,12 +83,13 @@ class ModisTile():
         j = self.cells_lats.shape[1]
         l = self.cover_sids.size
 
-        sidecar = staremaster.sidecar.Sidecar(granule_path='{}.hdf'.format(self.tile_name), out_path=out_path)
-        sidecar.write_dimensions(i, j, l, nom_res=self.nom_res)
-        sidecar.write_sids(self.sids, nom_res=self.nom_res)
-        sidecar.write_lons(self.cells_lons, nom_res=self.nom_res)
-        sidecar.write_lats(self.cells_lats, nom_res=self.nom_res)
-        sidecar.write_cover(self.cover_sids, nom_res=self.nom_res)
+        granule_path = '{}.hdf'.format(self.tile_name)
+        with staremaster.sidecar.Sidecar(granule_path=granule_path, out_path=out_path, **sidecar_options) as sidecar:
+            sidecar.write_dimensions(i, j, l, nom_res=self.nom_res)
+            sidecar.write_sids(self.sids, nom_res=self.nom_res)
+            sidecar.write_lons(self.cells_lons, nom_res=self.nom_res)
+            sidecar.write_lats(self.cells_lats, nom_res=self.nom_res)
+            sidecar.write_cover(self.cover_sids, nom_res=self.nom_res)
 
 
 
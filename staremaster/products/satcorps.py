@@ -53,7 +53,7 @@ class satCORPS:
         j = self.lats.shape[1]
         l = cover_sids.size
         
-        sidecar = Sidecar(granule_path='satCORPS_composite.nc', out_path=out_path)
-        sidecar.write_dimensions(i, j, l, nom_res=self.nom_res)    
-        sidecar.write_sids(sids, nom_res=self.nom_res)
-        sidecar.write_cover(cover_sids, nom_res=self.nom_res)
+        with Sidecar(granule_path='satCORPS_composite.nc', out_path=out_path) as sidecar:
+            sidecar.write_dimensions(i, j, l, nom_res=self.nom_res)
+            sidecar.write_sids(sids, nom_res=self.nom_res)
+            sidecar.write_cover(cover_sids, nom_res=self.nom_res)
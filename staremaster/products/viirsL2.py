@@ -14,6 +14,13 @@ class L2VIIRS:
         self.lons = None
         self.gring_lats = None
         self.gring_lons = None
+        self.scan_rows = None
+        self.resolution_stats = None
+
+    def close(self):
+        """ Closes the netCDF file """
+        if self.netcdf.isopen():
+            self.netcdf.close()
 
     def load(self):
         self.read_gring()
@@ -31,27 +38,28 @@ class L2VIIRS:
         cover_sids = staremaster.conversions.gring2cover(self.gring_lats, self.gring_lons, cover_res)
         return cover_sids
 
-    def create_sidecar(self, n_workers=1, cover_res=None, out_path=None):
-        sids = staremaster.conversions.latlon2stare(lats=self.lats,
-                                                    lons=self.lons,
-                                                    resolution=None,
-                                                    n_workers=n_workers,
-                                                    adapt_resolution=True)
-
-        if not cover_res:
-            cover_res = staremaster.conversions.min_resolution(sids)
-        cover_sids = self.get_cover_sids(cover_res)
-
+    def create_sidecar(self, n_workers=1, cover_res=None, out_path=None, **sidecar_options):
         i = self.lats.shape[0]
         j = self.lats.shape[1]
-        l = cover_sids.size
-
-        sidecar = Sidecar(self.file_path, out_path)
-        sidecar.write_dimensions(i, j, l, nom_res=self.nom_res)
-        sidecar.write_lons(self.lons, nom_res=self.nom_res)
-        sidecar.write_lats(self.lats, nom_res=self.nom_res)
-        sidecar.write_sids(sids, nom_res=self.nom_res)
-        sidecar.write_cover(cover_sids, nom_res=self.nom_res)
+
+        with Sidecar(self.file_path, out_path, **sidecar_options) as sidecar:
+            # The geolocation is written first so that a background writer compresses it while the SIDs are computed
+            sidecar.write_dimensions(i, j, None, nom_res=self.nom_res, scan_rows=self.scan_rows)
+            sidecar.write_lons(self.lons, nom_res=self.nom_res, reference='geolocation_data/longitude')
+            sidecar.write_lats(self.lats, nom_res=self.nom_res, reference='geolocation_data/latitude')
+
+            sids = staremaster.conversions.latlon2stare(lats=self.lats,
+                                                        lons=self.lons,
+                                                        resolution=None,
+                                                        n_workers=n_workers,
+                                                        adapt_resolution=True)
+            self.resolution_stats = staremaster.conversions.resolution_stats(sids)
+            if not cover_res:
+                cover_res = self.resolution_stats['min_resolution']
+            cover_sids = self.get_cover_sids(cover_res)
+
+            sidecar.write_sids(sids, nom_res=self.nom_res, resolution_stats=self.resolution_stats)
+            sidecar.write_cover(cover_sids, nom_res=self.nom_res)
         return sidecar
 
 
@@ -65,6 +73,7 @@ class VNP03MOD(L2VIIRS):
     def __init__(self, file_path):
         super(VNP03MOD, self).__init__(file_path)
         self.nom_res = '750m'
+        self.scan_rows = 16
 
 
 class VNP03IMG(L2VIIRS):
@@ -74,6 +83,7 @@ class VNP03IMG(L2VIIRS):
     def __init__(self, file_path):
         super(VNP03IMG, self).__init__(file_path)
         self.nom_res = '375m'
+        self.scan_rows = 32
 
 
 class CLMDKS_L2_VIIRS(L2VIIRS):
@@ -81,4 +91,5 @@ class CLMDKS_L2_VIIRS(L2VIIRS):
     def __init__(self, file_path):
         super(CLMDKS_L2_VIIRS, self).__init__(file_path)
         self.nom_res = '750m'
+        self.scan_rows = 16
 
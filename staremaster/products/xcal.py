@@ -14,6 +14,12 @@ class XCAL:
         self.netcdf = netCDF4.Dataset(file_path, 'r', format='NETCDF4')
         self.lats = {}
         self.lons = {}
+        self.resolution_stats = {}
+
+    def close(self):
+        """ Closes the netCDF file """
+        if self.netcdf.isopen():
+            self.netcdf.close()
 
     def load(self):
         self.get_latlon()
@@ -23,43 +29,42 @@ class XCAL:
             self.lats[scan] = self.netcdf.groups[scan]['Latitude'][:].data.astype(numpy.double)
             self.lons[scan] = self.netcdf.groups[scan]['Longitude'][:].data.astype(numpy.double)
 
-    def create_sidecar(self, n_workers=1, cover_res=None, out_path=None):
+    def create_sidecar(self, n_workers=1, cover_res=None, out_path=None, **sidecar_options):
 
-        sidecar = Sidecar(self.file_path, out_path)
+        with Sidecar(self.file_path, out_path, **sidecar_options) as sidecar:
 
-        cover_all = []
-        for scan in self.scans:
-            lons = self.lons[scan]
-            lats = self.lats[scan]
-            sids = staremaster.conversions.latlon2stare(lats, lons, n_workers=n_workers)
+            cover_all = staremaster.conversions.CoverAccumulator()
+            for scan in self.scans:
+                lons = self.lons[scan]
+                lats = self.lats[scan]
+                sids = staremaster.conversions.latlon2stare(lats, lons, n_workers=n_workers)
+                self.resolution_stats[scan] = staremaster.conversions.resolution_stats(sids)
 
-            if not cover_res:
-                # Need to drop the resolution to make the cover less sparse
-                cover_res = staremaster.conversions.min_resolution(sids)
-                cover_res = cover_res - 2
+                if not cover_res:
+                    # Need to drop the resolution to make the cover less sparse
+                    cover_res = self.resolution_stats[scan]['min_resolution']
+                    cover_res = cover_res - 2
 
-            sids_adapted = pystare.spatial_coerce_resolution(sids, cover_res)
+                sids_adapted = pystare.spatial_coerce_resolution(sids, cover_res)
 
-            cover_sids = staremaster.conversions.merge_stare(sids_adapted, n_workers=n_workers)
+                cover_sids = staremaster.conversions.merge_stare(sids_adapted, n_workers=n_workers)
 
-            cover_all.append(cover_sids)
+                cover_all.add(cover_sids)
 
-            i = lats.shape[0]
-            j = lats.shape[1]
-            l = cover_sids.size
+                i = lats.shape[0]
+                j = lats.shape[1]
+                l = cover_sids.size
 
-            nom_res = None
+                nom_res = None
 
-            sidecar.write_dimensions(i, j, l, nom_res=nom_res, group=scan)
-            sidecar.write_lons(lons, nom_res=nom_res, group=scan)
-            sidecar.write_lats(lats, nom_res=nom_res, group=scan)
-            sidecar.write_sids(sids, nom_res=nom_res, group=scan)
-            sidecar.write_cover(cover_sids, nom_res=nom_res, group=scan)
+                sidecar.write_dimensions(i, j, l, nom_res=nom_res, group=scan)
+                sidecar.write_lons(lons, nom_res=nom_res, group=scan, reference='{}/Longitude'.format(scan))
+                sidecar.write_lats(lats, nom_res=nom_res, group=scan, reference='{}/Latitude'.format(scan))
+                sidecar.write_sids(sids, nom_res=nom_res, group=scan, resolution_stats=self.resolution_stats[scan])
+                sidecar.write_cover(cover_sids, nom_res=nom_res, group=scan)
 
-        cover_all = numpy.concatenate(cover_all)
-        cover_all = staremaster.conversions.merge_stare(cover_all, n_workers=n_workers)
-        sidecar.write_dimension('l', cover_all.size)
-        sidecar.write_cover(cover_all, nom_res=nom_res)
+            cover_all = cover_all.cover()
+            # write_cover() creates the 'l' dimension itself
+            sidecar.write_cover(cover_all, nom_res=nom_res)
 
         return sidecar
-
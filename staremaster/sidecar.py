@@ -1,141 +1,887 @@
+import collections
+import contextlib
+import functools
+import math
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
 import netCDF4
+import numpy
+import staremaster.zarr_store
+
+
+BLOSC_COMPRESSIONS = ['blosc_lz', 'blosc_lz4', 'blosc_lz4hc', 'blosc_zlib', 'blosc_zstd']
+# The netCDF-C blosc filter fails on chunks blosc does not compress, which includes all chunks below 128 bytes
+BLOSC_MIN_CHUNK_BYTES = 128
+PARTIAL_SUFFIX = '.part'
+FORMATS = {'netcdf': '.nc', 'zarr': '.zarr'}
+GEOLOCATIONS = ['full', 'quantized', 'reference', 'none']
+SID_ENCODINGS = ['raw', 'delta']
+# Number of covers/resolution statistics SidecarReader keeps in memory across readers
+METADATA_CACHE_SIZE = 4096
+# Rows per block when SidecarReader computes resolution statistics
+STATS_BLOCK_ROWS = 1024
+# Serializes netCDF/HDF library calls of threads: the sidecar writer thread, the session's own thread and the granule
+# reader of a pipelined batch (see staremaster.create_sidecar_files). The HDF5 library is not thread-safe. Zarr
+# sidecars are written without it (see Sidecar.io_lock())
+IO_LOCK = threading.RLock()
+
+
+def available_compressions():
+    """ The compression codecs supported by the installed netCDF4/HDF5 library (None means uncompressed)"""
+    compressions = [None, 'zlib']
+    if getattr(netCDF4, '__has_zstandard_support__', False):
+        compressions.append('zstd')
+    if getattr(netCDF4, '__has_bzip2_support__', False):
+        compressions.append('bzip2')
+    if getattr(netCDF4, '__has_blosc_support__', False):
+        compressions += BLOSC_COMPRESSIONS
+    return compressions
+
+
+def quantize(data, precision, fill_value=None):
+    """ Packs latitudes/longitudes into the smallest of int16/int32 that represents them to within precision degrees.
+
+    Returns the packed integers, their datatype, fill value and the CF packing attributes (unpacked = packed *
+    scale_factor + add_offset), or None if not even int32 is wide enough.
+
+    >>> packed, datatype, fill, attributes = quantize(numpy.array([[10.0, 10.5], [11.0, -999]]), 1e-4, -999)
+    >>> packed.tolist(), datatype, fill, float(attributes['add_offset'])
+    ([[-5000, 0], [5000, -32767]], 'i2', -32767, 10.5)
+    """
+    valid = ~numpy.ma.getmaskarray(data) & numpy.isfinite(numpy.ma.getdata(data))
+    if fill_value is not None:
+        valid &= numpy.ma.getdata(data) != fill_value
+    values = numpy.ma.getdata(data)[valid]
+    if values.size == 0:
+        values = numpy.zeros(1)
+    add_offset = (float(values.max()) + float(values.min())) / 2
+    half_range = (float(values.max()) - float(values.min())) / 2 / precision
+    for datatype in ('i2', 'i4'):
+        # The most negative integer is reserved for the fill value
+        if half_range < numpy.iinfo(datatype).max - 1:
+            break
+    else:
+        return None
+    packed_fill = numpy.iinfo(datatype).min + 1
+    packed = numpy.full(data.shape, packed_fill, dtype=datatype)
+    packed[valid] = numpy.round((values - add_offset) / precision)
+    attributes = {'scale_factor': numpy.float64(precision), 'add_offset': numpy.float64(add_offset)}
+    return packed, datatype, packed_fill, attributes
+
+
+def encode_sids(sids):
+    """ Row-wise delta encoding of SIDs: the first column holds the SIDs, the other columns the difference to the
+    left neighbour. Differences are zigzag mapped (0, -1, 1, -2, ... -> 0, 1, 2, 3, ...) so that the small negative
+    differences do not turn into large unsigned integers. Arithmetic wraps modulo 2**64, so any uint64 round trips.
+
+    >>> encode_sids(numpy.array([[3, 5, 4]], dtype=numpy.uint64)).tolist()
+    [[6, 4, 1]]
+    """
+    sids = numpy.asarray(sids).astype(numpy.uint64, copy=False)
+    deltas = numpy.diff(sids, axis=1, prepend=numpy.zeros((sids.shape[0], 1), dtype=numpy.uint64))
+    deltas = deltas.view(numpy.int64)
+    return ((deltas << 1) ^ (deltas >> 63)).view(numpy.uint64)
+
+
+def decode_sids(encoded):
+    """ Inverse of encode_sids(). Decoding a row needs the whole row; rows decode independently.
+
+    >>> decode_sids(numpy.array([[6, 4, 1]], dtype=numpy.uint64)).tolist()
+    [[3, 5, 4]]
+    """
+    encoded = numpy.asarray(encoded).astype(numpy.uint64, copy=False)
+    deltas = (encoded >> numpy.uint64(1)) ^ (numpy.uint64(0) - (encoded & numpy.uint64(1)))
+    return numpy.cumsum(deltas, axis=1, dtype=numpy.uint64)
+
+
+def variable_attributes(variable):
+    """ The attributes of a netCDF4 variable or zarr array as a dict """
+    if hasattr(variable, 'ncattrs'):
+        return {name: variable.getncattr(name) for name in variable.ncattrs()}
+    return dict(variable.attrs)
+
+
+def read_sids(variable, rows=slice(None)):
+    """ Reads rows of a STARE_index variable (netCDF4 variable or zarr array), undoing its sid_encoding.
+
+    Returns a masked array with the fill values masked.
+    """
+    attributes = variable_attributes(variable)
+    encoding = attributes.get('sid_encoding')
+    if encoding is None:
+        return variable[rows, :]
+    elif encoding != 'row_delta_zigzag':
+        raise ValueError('unknown sid_encoding {}'.format(encoding))
+    if hasattr(variable, 'set_auto_mask'):
+        variable.set_auto_mask(False)
+    sids = decode_sids(variable[rows, :])
+    if 'sid_fill_value' in attributes:
+        return numpy.ma.masked_equal(sids, numpy.uint64(attributes['sid_fill_value']), copy=False)
+    return numpy.ma.masked_array(sids)
+
+
+def hdf5_memmap(file_path, varpath):
+    """ A read-only memory map of a variable of a netCDF4/HDF5 file if it is stored contiguously or as a single chunk
+    without filters; None otherwise or if h5py is not installed """
+    try:
+        import h5py
+    except ImportError:
+        return None
+    with h5py.File(file_path, 'r') as h5:
+        dataset = h5[varpath]
+        if dataset.id.get_create_plist().get_nfilters() > 0 or dataset.dtype.byteorder == '>' or dataset.ndim == 0:
+            return None
+        if dataset.chunks is None:
+            offset = dataset.id.get_offset()
+        elif tuple(dataset.chunks) == tuple(dataset.shape) and dataset.id.get_num_chunks() == 1:
+            offset = dataset.id.get_chunk_info(0).byte_offset
+        else:
+            return None
+        if offset is None:
+            # Not allocated yet
+            return None
+        return numpy.memmap(file_path, dtype=dataset.dtype, mode='r', offset=offset, shape=dataset.shape)
+
+
+class HDF4Variable:
+    """ The shape and slicing of a pyhdf SDS, so that it can back a SidecarVariable """
+
+    def __init__(self, sds):
+        self.sds = sds
+        self.shape = tuple(sds.info()[2])
+
+    def __getitem__(self, key):
+        return numpy.asarray(self.sds[key])
+
+
+def open_granule(granule_path):
+    """ Opens a granule for reading: HDF4 through pyhdf, anything else through netCDF4 """
+    if granule_path.lower().endswith('.hdf'):
+        import pyhdf.SD
+        return pyhdf.SD.SD(granule_path)
+    return netCDF4.Dataset(granule_path, 'r')
+
+
+def close_granule(granule):
+    if isinstance(granule, netCDF4.Dataset):
+        granule.close()
+    else:
+        granule.end()
+
+
+def granule_variable(granule, varname):
+    """ A variable of a granule opened by open_granule() and its attributes """
+    if isinstance(granule, netCDF4.Dataset):
+        variable = granule[varname]
+        variable.set_auto_maskandscale(False)
+        return variable, variable_attributes(variable)
+    sds = granule.select(varname)
+    return HDF4Variable(sds), sds.attributes()
+
+
+def tile_chunks(shape, itemsize, chunk_bytes):
+    """ Square-ish 2D chunks of roughly chunk_bytes; widened along j if the array has fewer rows than the tile
+
+    >>> tile_chunks((6464, 6400), 8, 2**20)
+    [362, 362]
+    >>> tile_chunks((10, 6400), 8, 2**20)
+    [10, 6400]
+    """
+    n_elements = max(1, chunk_bytes // itemsize)
+    side = max(1, math.isqrt(n_elements))
+    rows = min(shape[0], side)
+    cols = min(shape[1], max(side, n_elements // rows))
+    return [rows, cols]
+
+
+def scan_chunks(shape, itemsize, scan_rows, chunk_bytes):
+    """ 2D chunks spanning whole scans: a multiple of scan_rows rows, split along j only if a single scan
+    exceeds chunk_bytes.
+
+    >>> scan_chunks((2030, 1354), 8, 10, 2**20)
+    [90, 1354]
+    >>> scan_chunks((6464, 6400), 8, 32, 2**20)
+    [32, 4096]
+    """
+    scan_bytes = scan_rows * shape[1] * itemsize
+    if scan_bytes <= chunk_bytes:
+        rows = scan_rows * (chunk_bytes // scan_bytes)
+        cols = shape[1]
+    else:
+        rows = scan_rows
+        cols = max(1, chunk_bytes // (scan_rows * itemsize))
+    return [min(rows, shape[0]), min(cols, shape[1])]
+
+
+class BackgroundWriter:
+    """ Executes write calls in order on a background thread.
+
+    At most queue_size calls wait in the queue; submit() blocks while it is full, so a producer that outpaces the
+    disk does not accumulate arrays in memory. The first exception raised by a call is re-raised in the producer by
+    the next submit() or by join(); the calls queued after it are skipped.
+    """
+
+    def __init__(self, queue_size=2, lock=IO_LOCK):
+        self.queue = queue.Queue(maxsize=queue_size)
+        # Held while a call executes
+        self.lock = lock
+        self.error = None
+        self.cancelled = False
+        # Seconds spent executing calls
+        self.busy_time = 0.0
+        self.thread = threading.Thread(target=self.run, name='sidecar-writer', daemon=True)
+        self.thread.start()
+
+    def in_writer_thread(self):
+        return threading.current_thread() is self.thread
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            function, args, kwargs = item
+            if self.error is None and not self.cancelled:
+                start = time.perf_counter()
+                try:
+                    with self.lock:
+                        function(*args, **kwargs)
+                except BaseException as e:
+                    self.error = e
+                self.busy_time += time.perf_counter() - start
+
+    def raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def submit(self, function, *args, **kwargs):
+        self.raise_error()
+        self.queue.put((function, args, kwargs))
+
+    def join(self):
+        """ Waits for the queued calls to finish, stops the thread and raises the error of a failed call """
+        self.queue.put(None)
+        self.thread.join()
+        self.raise_error()
+
+    def cancel(self):
+        """ Skips the queued calls and stops the thread """
+        self.cancelled = True
+        self.queue.put(None)
+        self.thread.join()
+
+
+def queued(method):
+    """ Runs a Sidecar write method on the background writer if the session has one """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.writer is not None and not self.writer.in_writer_thread():
+            self.writer.submit(method, self, *args, **kwargs)
+        else:
+            with self.io_lock():
+                return method(self, *args, **kwargs)
+    return wrapper
 
 
 class Sidecar:
-    
-    def __init__(self, granule_path, out_path=None):
+    """ Writes a STARE sidecar file.
+
+    Use the sidecar as a context manager (or call open() and close() explicitly) to keep a single handle open for
+    the whole sidecar:
+
+    >>> with Sidecar(granule_path, out_path) as sidecar:  # doctest: +SKIP
+    ...     sidecar.write_dimensions(i, j, l)
+    ...     sidecar.write_sids(sids)
+
+    The sidecar of a session is written to a hidden temporary file next to its final location and only renamed to
+    file_path by close() (or when the session ends without an exception). An existing sidecar therefore is a
+    complete one; an aborted sidecar leaves at most a '.*.part' file behind.
+
+    Outside a session, every write call opens the file in append mode and closes it again, and the sidecar is
+    moved to file_path after the first call (see publish()). Later calls and sessions write to file_path directly,
+    so they are not atomic.
+
+    By default each 2D variable is stored as a single chunk. Use chunks='auto', chunks='scan' or a fixed
+    (rows, cols) tile shape so that subset reads only decompress the chunks they touch (see chunk_shape()).
+
+    Variables are compressed with zlib at complevel 4 by default; any codec in available_compressions()
+    (e.g. 'zstd' or 'blosc_lz4') can be chosen instead. `python -m staremaster.benchmark codecs` compares them.
+    shuffle applies to zlib and blosc; netCDF4 does not shuffle zstd and bzip2 variables (Zarr sidecars do).
+
+    With format='zarr', the sidecar is written as a Zarr directory store (<name>_stare.zarr) with the same groups
+    and variables instead of a netCDF file (see staremaster.zarr_store).
+
+    The geolocation option controls how Latitude/Longitude are stored:
+
+    - 'full': float32 arrays (default)
+    - 'quantized': CF packed (scale_factor/add_offset) int16/int32 arrays, accurate to geolocation_precision degrees
+    - 'reference': scalar variables whose source_file/source_variable attributes point to the geolocation in the
+      granule. Falls back to 'full' where the product does not pass a reference (e.g. for derived geolocation)
+    - 'none': no geolocation at all
+
+    The mode is recorded in the 'geolocation_storage' global attribute.
+
+    With sid_encoding='delta', STARE_index variables are stored row-wise delta encoded (see encode_sids()), which
+    compresses considerably better since neighbouring SIDs share most of their bits. Such variables carry the
+    sid_encoding and sid_fill_value attributes instead of a _FillValue; read them with read_sids().
+
+    With background_writer=True, the write calls of a session are queued and executed by a BackgroundWriter thread,
+    so that compressing and writing a variable overlaps with computing the next one. Arrays passed to the write
+    methods must not be modified afterwards. Errors of the writer are raised by a later write call or when the
+    session ends.
+    """
+
+    def __init__(self, granule_path, out_path=None, chunks=None, chunk_bytes=2**20,
+                 compression='zlib', complevel=4, shuffle=True, format='netcdf',
+                 geolocation='full', geolocation_precision=1e-5, sid_encoding='raw',
+                 background_writer=False, writer_queue_size=2):
+        if format not in FORMATS:
+            raise ValueError('format {} is not supported; available: {}'.format(format, list(FORMATS)))
+        if geolocation not in GEOLOCATIONS:
+            raise ValueError('geolocation {} is not supported; available: {}'.format(geolocation, GEOLOCATIONS))
+        if sid_encoding not in SID_ENCODINGS:
+            raise ValueError('sid_encoding {} is not supported; available: {}'.format(sid_encoding, SID_ENCODINGS))
+        if format == 'netcdf' and compression not in available_compressions():
+            raise ValueError('compression {} is not supported by the installed netCDF4 library; '
+                             'available: {}'.format(compression, available_compressions()))
+        self.format = format
+        self.granule_path = granule_path
         self.file_path = self.name_from_granule(granule_path, out_path)
+        self.tmp_path = self.partial_name(self.file_path)
+        self.rootgrp = None
+        self.chunks = chunks
+        self.chunk_bytes = chunk_bytes
+        self.scan_rows = {}
+        self.compression = compression
+        self.complevel = complevel
+        self.shuffle = shuffle
+        self.geolocation = geolocation
+        self.geolocation_precision = geolocation_precision
+        self.sid_encoding = sid_encoding
+        self.background_writer = background_writer
+        self.writer_queue_size = writer_queue_size
+        self.writer = None
+        # Seconds the background writers of the sessions spent writing
+        self.write_time = 0.0
         self.create()
-        self.zlib = True
-        self.shuffle = True
-        
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def open(self):
+        if self.rootgrp is None:
+            self.rootgrp = self.open_dataset('a')
+        if self.background_writer and self.writer is None:
+            self.writer = BackgroundWriter(self.writer_queue_size, lock=self.io_lock())
+        return self
+
+    def io_lock(self):
+        """ IO_LOCK for netCDF sidecars; Zarr stores are written without the HDF5 library and need no lock """
+        if self.format == 'zarr':
+            return contextlib.nullcontext()
+        return IO_LOCK
+
+    def open_dataset(self, mode):
+        if self.format == 'zarr':
+            return staremaster.zarr_store.open_group(self.tmp_path, mode)
+        else:
+            with IO_LOCK:
+                return netCDF4.Dataset(self.tmp_path, mode, format="NETCDF4")
+
+    def close_dataset(self):
+        if self.rootgrp is not None:
+            with self.io_lock():
+                self.rootgrp.close()
+            self.rootgrp = None
+
+    def close(self):
+        """ Ends the session (if any) and atomically moves the complete sidecar to file_path """
+        if self.writer is not None:
+            writer = self.writer
+            self.writer = None
+            try:
+                writer.join()
+            except BaseException:
+                self.abort()
+                raise
+            finally:
+                self.write_time += writer.busy_time
+        self.close_dataset()
+        if os.path.exists(self.tmp_path):
+            self.publish()
+
+    def publish(self):
+        """ Atomically moves the sidecar written so far to file_path; it is written there directly afterwards """
+        if self.format == 'zarr':
+            staremaster.zarr_store.consolidate(self.tmp_path)
+        if self.tmp_path == self.file_path:
+            return
+        if self.format == 'zarr' and os.path.isdir(self.file_path):
+            # A directory cannot atomically replace a non-empty one
+            shutil.rmtree(self.file_path)
+        os.replace(self.tmp_path, self.file_path)
+        self.tmp_path = self.file_path
+
+    def abort(self):
+        """ Ends the session (if any) and discards the partially written sidecar """
+        if self.writer is not None:
+            self.writer.cancel()
+            self.writer = None
+        with contextlib.suppress(Exception):
+            # The dataset may be in an unusable state after the error that caused the abort
+            self.close_dataset()
+        self.rootgrp = None
+        if self.tmp_path == self.file_path:
+            # Already published; only a partial file is discarded
+            return
+        if os.path.isdir(self.tmp_path):
+            shutil.rmtree(self.tmp_path)
+        elif os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    @contextlib.contextmanager
+    def dataset(self):
+        # Reuse the session handle if there is one; otherwise fall back to a single open/close cycle after which
+        # the sidecar is at file_path
+        if self.rootgrp is not None:
+            yield self.rootgrp
+        else:
+            rootgrp = self.open_dataset('a')
+            try:
+                yield rootgrp
+            finally:
+                rootgrp.close()
+            self.publish()
+
+    @staticmethod
+    def get_group(rootgrp, group):
+        if group:
+            return rootgrp.createGroup(group)
+        else:
+            return rootgrp
+
+    def compression_kwargs(self, chunk_bytes):
+        """ The compression keyword arguments to netCDF4's createVariable() for chunks of chunk_bytes"""
+        kwargs = {'compression': self.compression, 'complevel': self.complevel}
+        if self.compression in BLOSC_COMPRESSIONS and chunk_bytes < BLOSC_MIN_CHUNK_BYTES:
+            kwargs['compression'] = 'zlib'
+        if kwargs['compression'] in BLOSC_COMPRESSIONS:
+            # blosc shuffles internally; 1 is byte-wise shuffle
+            kwargs['blosc_shuffle'] = int(self.shuffle)
+        else:
+            # netCDF4 only applies the shuffle filter together with zlib; zstd and bzip2 variables are not shuffled
+            kwargs['shuffle'] = self.shuffle
+        return kwargs
+
+    def chunk_shape(self, shape, itemsize, scan_rows=None):
+        """ Chunk shape of a 2D variable according to the chunking policy self.chunks:
+
+        - None: the whole variable is a single chunk
+        - 'auto': square-ish tiles of about self.chunk_bytes
+        - 'scan': tiles of whole scans (falls back to 'auto' if the scan_rows are unknown)
+        - (rows, cols): fixed tile shape
+        """
+        if self.chunks is None:
+            return list(shape)
+        elif self.chunks == 'scan' and scan_rows:
+            return scan_chunks(shape, itemsize, scan_rows, self.chunk_bytes)
+        elif self.chunks in ('auto', 'scan'):
+            return tile_chunks(shape, itemsize, self.chunk_bytes)
+        else:
+            return [min(self.chunks[0], shape[0]), min(self.chunks[1], shape[1])]
+
     def name_from_granule(self, granule_path, out_path):
+        extension = FORMATS[self.format]
         if out_path:
-            return out_path + '.'.join(granule_path.split('/')[-1].split('.')[0:-1]) + '_stare.nc'
+            return out_path + '.'.join(granule_path.split('/')[-1].split('.')[0:-1]) + '_stare' + extension
         else:
-            return '.'.join(granule_path.split('.')[0:-1]) + '_stare.nc'
+            return '.'.join(granule_path.split('.')[0:-1]) + '_stare' + extension
         
+    @staticmethod
+    def partial_name(file_path):
+        """ A unique, hidden name in the directory of file_path; unique so that concurrent writers do not collide
+
+        >>> Sidecar.partial_name('/data/MOD05_L2.A2005349_stare.nc')  # doctest: +ELLIPSIS
+        '/data/.MOD05_L2.A2005349_stare.nc...part'
+        """
+        folder, name = os.path.split(file_path)
+        return os.path.join(folder, '.{name}.{uid}{suffix}'.format(name=name, uid=uuid.uuid4().hex[:8],
+                                                                     suffix=PARTIAL_SUFFIX))
+
     def create(self):
-        with netCDF4.Dataset(self.file_path, "w", format="NETCDF4") as rootgrp:
-            pass
+        with self.io_lock():
+            rootgrp = self.open_dataset('w')
+            rootgrp.setncatts({'geolocation_storage': self.geolocation})
+            rootgrp.close()
         
+    @queued
     def write_dimension(self, name, length, group=None):
-        with netCDF4.Dataset(self.file_path , 'a', format="NETCDF4") as rootgrp:
-            if group:
-                grp = rootgrp.createGroup(group)
-            else:
-                grp = rootgrp
+        with self.dataset() as rootgrp:
+            grp = self.get_group(rootgrp, group)
             grp.createDimension(name, length)
         
-    def write_dimensions(self, i, j, l, nom_res=None, group=None):
+    @queued
+    def write_dimensions(self, i, j, l, nom_res=None, group=None, scan_rows=None):
         i_name = 'i'
         j_name = 'j'
         if nom_res:
             i_name += '_{nom_res}'.format(nom_res=nom_res)
             j_name += '_{nom_res}'.format(nom_res=nom_res)
-        with netCDF4.Dataset(self.file_path, 'a', format="NETCDF4") as rootgrp:
-            if group:
-                grp = rootgrp.createGroup(group)
-            else:
-                grp = rootgrp
+        # Remembered for the 'scan' chunking policy of the variables along these dimensions
+        self.scan_rows[(group, i_name)] = scan_rows
+        with self.dataset() as rootgrp:
+            grp = self.get_group(rootgrp, group)
             grp.createDimension(i_name, i)
             grp.createDimension(j_name, j)
 
-    def write_lons(self, lons, nom_res=None, group=None, fill_value=None):
-        i = lons.shape[0]
-        j = lons.shape[1]
-        varname = 'Longitude'
-        i_name = 'i'
-        j_name = 'j'
+    @queued
+    def write_lons(self, lons, nom_res=None, group=None, fill_value=None, reference=None):
+        attributes = {'long_name': 'Longitude', 'units': 'degrees_east'}
+        self.write_geolocation(lons, 'Longitude', attributes, nom_res=nom_res, group=group, fill_value=fill_value,
+                               reference=reference)
+
+    @queued
+    def write_lats(self, lats, nom_res=None, group=None, fill_value=None, reference=None):
+        attributes = {'long_name': 'Latitude', 'units': 'degrees_north'}
+        self.write_geolocation(lats, 'Latitude', attributes, nom_res=nom_res, group=group, fill_value=fill_value,
+                               reference=reference)
+
+    def write_geolocation(self, data, varname, attributes, nom_res=None, group=None, fill_value=None,
+                          reference=None):
+        """ Writes latitudes or longitudes according to self.geolocation.
+
+        reference is the path of the variable in the granule that holds the same geolocation (e.g.
+        'geolocation_data/latitude'); None if the geolocation is not stored in the granule as-is.
+        """
+        if self.geolocation == 'none':
+            return
+        elif self.geolocation == 'reference' and reference is not None:
+            attributes = {**attributes, 'source_file': os.path.basename(self.granule_path),
+                          'source_variable': reference}
+            self.write_reference(varname, attributes, nom_res=nom_res, group=group)
+            return
+        elif self.geolocation == 'quantized':
+            quantized = quantize(data, self.geolocation_precision, fill_value)
+            if quantized is not None:
+                packed, datatype, packed_fill, packing = quantized
+                self.write_2d(packed, varname, datatype, {**attributes, **packing}, nom_res=nom_res, group=group,
+                              fill_value=packed_fill)
+                return
+        self.write_2d(data, varname, 'f4', attributes, nom_res=nom_res, group=group, fill_value=fill_value)
+
+    def write_reference(self, varname, attributes, nom_res=None, group=None):
         if nom_res:
             varname += '_{nom_res}'.format(nom_res=nom_res)
-            i_name += '_{nom_res}'.format(nom_res=nom_res)
-            j_name += '_{nom_res}'.format(nom_res=nom_res)
-        with netCDF4.Dataset(self.file_path, 'a', format="NETCDF4") as rootgrp:
-            if group:
-                grp = rootgrp.createGroup(group)
-            else:
-                grp = rootgrp            
-            lons_netcdf = grp.createVariable(varname=varname, 
-                                             datatype='f4', 
-                                             dimensions=(i_name, j_name),
-                                             chunksizes=[i, j],
-                                             shuffle=self.shuffle,
-                                             zlib=self.zlib,
-                                             fill_value=fill_value)
-            lons_netcdf.long_name = 'Longitude'
-            lons_netcdf.units = 'degrees_east'
-            lons_netcdf[:, :] = lons
-    
-    def write_lats(self, lats, nom_res=None, group=None, fill_value=None):
-        i = lats.shape[0]
-        j = lats.shape[1]
-        varname = 'Latitude'
+        with self.dataset() as rootgrp:
+            grp = self.get_group(rootgrp, group)
+            # A scalar container variable; the data lives in the granule
+            variable = grp.createVariable(varname=varname, datatype='i1', dimensions=(), compression=None)
+            variable.setncatts(attributes)
+
+    @queued
+    def write_sids(self, sids, nom_res=None, group=None, fill_value=0, resolution_stats=None):
+        """ resolution_stats (see staremaster.conversions.resolution_stats()) are stored as attributes so that
+        readers do not need to compute them (see SidecarReader.resolution_stats()) """
+        attributes = {'long_name': 'SpatioTemporal Adaptive Resolution Encoding (STARE) index'}
+        if resolution_stats is not None:
+            for name in ['min_resolution', 'max_resolution']:
+                if resolution_stats[name] is not None:
+                    attributes[name] = numpy.int32(resolution_stats[name])
+            attributes['resolution_histogram'] = numpy.asarray(resolution_stats['histogram'], dtype=numpy.int64)
+        if self.sid_encoding == 'delta':
+            sids = encode_sids(numpy.ma.filled(sids, fill_value))
+            attributes['sid_encoding'] = 'row_delta_zigzag'
+            if fill_value is not None:
+                attributes['sid_fill_value'] = numpy.array(fill_value).astype(numpy.uint64)[()]
+            # Encoded values of fill pixels are arbitrary; a _FillValue would mask valid deltas
+            fill_value = False
+        self.write_2d(sids, 'STARE_index', 'u8', attributes, nom_res=nom_res, group=group, fill_value=fill_value)
+
+    def write_2d(self, data, varname, datatype, attributes, nom_res=None, group=None, fill_value=None):
         i_name = 'i'
         j_name = 'j'
         if nom_res:
             varname += '_{nom_res}'.format(nom_res=nom_res)
             i_name += '_{nom_res}'.format(nom_res=nom_res)
             j_name += '_{nom_res}'.format(nom_res=nom_res)
-        with netCDF4.Dataset(self.file_path, 'a', format="NETCDF4") as rootgrp:
-            if group:
-                grp = rootgrp.createGroup(group)
-            else:
-                grp = rootgrp    
-            lats_netcdf = grp.createVariable(varname=varname, 
-                                             datatype='f4', 
-                                             dimensions=(i_name, j_name),
-                                             chunksizes=[i, j],
-                                             shuffle=self.shuffle,
-                                             zlib=self.zlib,
-                                             fill_value=fill_value)
-            lats_netcdf.long_name = 'Latitude'
-            lats_netcdf.units = 'degrees_north'
-            lats_netcdf[:, :] = lats            
-        
-    def write_sids(self, sids, nom_res=None, group=None, fill_value=0):
-        i = sids.shape[0]
-        j = sids.shape[1]
-        varname = 'STARE_index'.format(nom_res=nom_res)
-        i_name = 'i'
-        j_name = 'j'
-        if nom_res:
-            varname += '_{nom_res}'.format(nom_res=nom_res)
-            i_name += '_{nom_res}'.format(nom_res=nom_res)
-            j_name += '_{nom_res}'.format(nom_res=nom_res)   
-        with netCDF4.Dataset(self.file_path, 'a', format="NETCDF4") as rootgrp:
-            if group:
-                grp = rootgrp.createGroup(group)
-            else:
-                grp = rootgrp    
-            sids_netcdf = grp.createVariable(varname=varname, 
-                                             datatype='u8', 
-                                             dimensions=(i_name, j_name),
-                                             chunksizes=[i, j],
-                                             shuffle=self.shuffle,
-                                             zlib=self.zlib,
-                                             fill_value=fill_value)
-            sids_netcdf.long_name = 'SpatioTemporal Adaptive Resolution Encoding (STARE) index'
-            sids_netcdf[:, :] = sids
+        itemsize = numpy.dtype(datatype).itemsize
+        chunksizes = self.chunk_shape(data.shape, itemsize, scan_rows=self.scan_rows.get((group, i_name)))
+        with self.dataset() as rootgrp:
+            grp = self.get_group(rootgrp, group)
+            variable = grp.createVariable(varname=varname,
+                                          datatype=datatype,
+                                          dimensions=(i_name, j_name),
+                                          chunksizes=chunksizes,
+                                          fill_value=fill_value,
+                                          **self.compression_kwargs(math.prod(chunksizes) * itemsize))
+            variable[:, :] = data
+            # After writing, so that packed data is not packed again by netCDF4's auto scaling
+            variable.setncatts(attributes)
 
+    @queued
     def write_cover(self, cover, nom_res=None, group=None, fill_value=None):
         l = cover.size
         varname = 'STARE_cover'
         l_name = 'l'
 
-        with netCDF4.Dataset(self.file_path, 'a', format="NETCDF4") as rootgrp:
-            if group:
-                grp = rootgrp.createGroup(group)
-            else:
-                grp = rootgrp
+        with self.dataset() as rootgrp:
+            grp = self.get_group(rootgrp, group)
             grp.createDimension(l_name, l)
             cover_netcdf = grp.createVariable(varname=varname, 
                                               datatype='u8', 
                                               dimensions=(l_name),
                                               chunksizes=[l],
-                                              shuffle=self.shuffle,
-                                              zlib=self.zlib,
-                                              fill_value=fill_value)
+                                              fill_value=fill_value,
+                                              **self.compression_kwargs(l * 8))
             cover_netcdf.long_name = 'SpatioTemporal Adaptive Resolution Encoding (STARE) cover'
             cover_netcdf[:] = cover
  
+
+
+class SidecarVariable:
+    """ Lazy, sliceable access to a sidecar variable. Only the sliced part is read, and decoded (sid_encoding),
+    unpacked (scale_factor/add_offset) and masked (fill values) as needed.
+
+    If the variable is memory-mapped (see SidecarReader), slices without decoding/unpacking are views of the mapped
+    file rather than copies.
+    """
+
+    def __init__(self, storage, attributes, memmap=None, mask=True):
+        self.storage = storage
+        self.attributes = attributes
+        self.memmap = memmap
+        self.mask = mask
+        self.shape = tuple(storage.shape)
+        self.ndim = len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def fill_value(self):
+        if 'sid_encoding' in self.attributes:
+            return self.attributes.get('sid_fill_value')
+        return self.attributes.get('_FillValue')
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if 'sid_encoding' in self.attributes:
+            data = self.read_decoded(key)
+        else:
+            data = self.read(key)
+        fill_value = self.fill_value
+        if self.mask and fill_value is not None:
+            data = numpy.ma.masked_equal(data, numpy.array(fill_value).astype(data.dtype), copy=False)
+        if 'scale_factor' in self.attributes or 'add_offset' in self.attributes:
+            data = data * self.attributes.get('scale_factor', 1) + self.attributes.get('add_offset', 0)
+        return data
+
+    def read(self, key):
+        if self.memmap is not None:
+            return self.memmap[key]
+        return self.storage[key]
+
+    def read_decoded(self, key):
+        if self.attributes['sid_encoding'] != 'row_delta_zigzag':
+            raise ValueError('unknown sid_encoding {}'.format(self.attributes['sid_encoding']))
+        rows = key[0]
+        squeeze = isinstance(rows, (int, numpy.integer))
+        if squeeze:
+            row = rows % self.shape[0]
+            rows = slice(row, row + 1)
+        # Decoding needs whole rows
+        data = decode_sids(self.read((rows, slice(None))))[(slice(None),) + key[1:]]
+        return data[0] if squeeze else data
+
+
+class SidecarReader:
+    """ Reads a sidecar (netCDF or Zarr) lazily.
+
+    >>> with SidecarReader('MOD05_L2.A2005349.2125.061.2017294065400_stare.nc') as sidecar:  # doctest: +SKIP
+    ...     sids = sidecar.sids(nom_res='5km')[100:200, :]
+    ...     cover = sidecar.cover()
+
+    sids(), lats() and lons() return SidecarVariables, which read, decode and mask only what is sliced. Variables
+    stored uncompressed in a single chunk are memory-mapped (requires h5py for netCDF sidecars). Geolocation
+    stored as a reference is read from the granule, which is looked up next to the sidecar unless granule_path is
+    given.
+
+    Covers and resolution statistics are cached across readers (keyed by path and modification time of the netCDF
+    file or of the consolidated metadata of the Zarr store), so that repeated metadata queries on many sidecars do
+    not decode the same arrays again.
+    """
+
+    cache = collections.OrderedDict()
+    # Guards the cache, which is shared by the readers of all threads
+    cache_lock = threading.Lock()
+
+    def __init__(self, file_path, granule_path=None, mmap=True, mask=True):
+        self.file_path = file_path
+        self.format = 'zarr' if file_path.rstrip('/').endswith(FORMATS['zarr']) else 'netcdf'
+        self.granule_path = granule_path
+        self.mmap = mmap
+        self.mask = mask
+        self.rootgrp = None
+        # Granules of the reference variables, open until the reader is closed
+        self.granules = {}
+        self.open()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        if self.format == 'zarr':
+            self.rootgrp = staremaster.zarr_store.open_consolidated(self.file_path)
+        else:
+            self.rootgrp = netCDF4.Dataset(self.file_path, 'r', format='NETCDF4')
+        # Identifies this version of the sidecar in the cache. Chunks rewritten in place do not change the mtime of a
+        # Zarr store's directory, but its metadata is consolidated again
+        if self.format == 'zarr':
+            version_path = os.path.join(self.file_path, staremaster.zarr_store.CONSOLIDATED_METADATA)
+        else:
+            version_path = self.file_path
+        self.cache_key = (os.path.realpath(self.file_path), os.stat(version_path).st_mtime_ns)
+        return self
+
+    def close(self):
+        if self.format == 'netcdf' and self.rootgrp is not None:
+            self.rootgrp.close()
+        self.rootgrp = None
+        for granule in self.granules.values():
+            close_granule(granule)
+        self.granules = {}
+
+    @property
+    def geolocation_storage(self):
+        return self.attributes(self.rootgrp).get('geolocation_storage', 'full')
+
+    def attributes(self, obj):
+        if self.format == 'zarr':
+            return dict(obj.attrs)
+        return variable_attributes(obj)
+
+    def groups(self):
+        if self.format == 'zarr':
+            return sorted(self.rootgrp.group_keys())
+        return list(self.rootgrp.groups)
+
+    def get_group(self, group=None):
+        if group:
+            return self.rootgrp[group] if self.format == 'zarr' else self.rootgrp.groups[group]
+        return self.rootgrp
+
+    def variable_names(self, group=None):
+        grp = self.get_group(group)
+        if self.format == 'zarr':
+            return sorted(grp.array_keys())
+        return list(grp.variables)
+
+    def resolutions(self, group=None):
+        """ The nom_res of the STARE_index variables of a group (None for an unsuffixed 'STARE_index') """
+        prefix = 'STARE_index'
+        return [varname[len(prefix) + 1:] or None for varname in self.variable_names(group)
+                if varname.startswith(prefix)]
+
+    def variable(self, varname, nom_res=None, group=None):
+        if nom_res:
+            varname += '_{nom_res}'.format(nom_res=nom_res)
+        grp = self.get_group(group)
+        if varname not in self.variable_names(group):
+            raise KeyError('{} has no variable {}{}'.format(self.file_path, varname,
+                                                            ' in group {}'.format(group) if group else ''))
+        storage = grp[varname]
+        if self.format == 'zarr':
+            attributes = self.attributes(storage)
+            if storage.fill_value is not None and 'sid_encoding' not in attributes:
+                attributes['_FillValue'] = storage.fill_value
+            memmap = staremaster.zarr_store.memmap_array(self.file_path, storage) if self.mmap else None
+        else:
+            storage.set_auto_maskandscale(False)
+            attributes = self.attributes(storage)
+            fill_value = storage.get_fill_value() if hasattr(storage, 'get_fill_value') else None
+            if '_FillValue' not in attributes and fill_value is not None and 'sid_encoding' not in attributes:
+                # netCDF masks the default fill value of variables without _FillValue
+                attributes['_FillValue'] = fill_value
+            memmap = hdf5_memmap(self.file_path, storage.group().path.rstrip('/') + '/' + varname) \
+                if self.mmap else None
+        if 'source_variable' in attributes:
+            return self.reference_variable(attributes)
+        return SidecarVariable(storage, attributes, memmap=memmap, mask=self.mask)
+
+    def reference_variable(self, attributes):
+        granule_path = self.granule_path
+        if granule_path is None:
+            granule_path = os.path.join(os.path.dirname(os.path.abspath(self.file_path)), attributes['source_file'])
+        if granule_path not in self.granules:
+            self.granules[granule_path] = open_granule(granule_path)
+        storage, granule_attributes = granule_variable(self.granules[granule_path], attributes['source_variable'])
+        return SidecarVariable(storage, granule_attributes, mask=self.mask)
+
+    def sids(self, nom_res=None, group=None):
+        return self.variable('STARE_index', nom_res=nom_res, group=group)
+
+    def lats(self, nom_res=None, group=None):
+        return self.variable('Latitude', nom_res=nom_res, group=group)
+
+    def lons(self, nom_res=None, group=None):
+        return self.variable('Longitude', nom_res=nom_res, group=group)
+
+    def cached(self, key, compute):
+        key = self.cache_key + key
+        with self.cache_lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        # Computed without the lock, so that readers of other sidecars are not held up; two threads may compute the
+        # same value
+        value = compute()
+        with self.cache_lock:
+            self.cache[key] = value
+            if len(self.cache) > METADATA_CACHE_SIZE:
+                self.cache.popitem(last=False)
+        return value
+
+    def cover(self, group=None):
+        """ The STARE cover of a group as an array (cached) """
+        def read_cover():
+            variable = self.variable('STARE_cover', group=group)
+            return numpy.ma.compressed(variable[:]) if self.mask else numpy.array(variable[:])
+        return self.cached(('cover', group, self.mask), read_cover)
+
+    def resolution_stats(self, nom_res=None, group=None):
+        """ The min and max STARE resolution and the histogram of resolutions (index = resolution) of the valid
+        SIDs of a STARE_index variable (cached). Computed in blocks of rows unless the sidecar stores them as
+        attributes. """
+        def compute():
+            variable = self.sids(nom_res=nom_res, group=group)
+            if 'resolution_histogram' in variable.attributes:
+                histogram = numpy.asarray(variable.attributes['resolution_histogram'], dtype=numpy.int64)
+            else:
+                histogram = numpy.zeros(32, dtype=numpy.int64)
+                fill_value = variable.fill_value
+                for start in range(0, variable.shape[0], STATS_BLOCK_ROWS):
+                    block = numpy.ma.compressed(variable[start:start + STATS_BLOCK_ROWS])
+                    if fill_value is not None:
+                        # Not masked if the reader does not mask
+                        block = block[block != numpy.uint64(fill_value)]
+                    levels = block & numpy.uint64(31)
+                    histogram += numpy.bincount(levels.astype(numpy.intp), minlength=32)
+            present = numpy.flatnonzero(histogram)
+            return {'min_resolution': int(present.min()) if present.size else None,
+                    'max_resolution': int(present.max()) if present.size else None,
+                    'histogram': histogram}
+        return self.cached(('resolution_stats', nom_res, group), compute)
@@ -0,0 +1,177 @@
+""" Zarr directory store for sidecars.
+
+ZarrGroup and ZarrVariable mimic the small part of the netCDF4 Dataset/Group/Variable API that
+staremaster.sidecar.Sidecar uses, so that a sidecar can be written to a Zarr store with the same variable and
+group layout as the netCDF sidecar. Dimension names are stored in the '_ARRAY_DIMENSIONS' attribute (the xarray
+convention), dimension sizes in the '_DIMENSIONS' group attribute, and the store uses the Zarr v2 format, which
+zarr-python 2 and 3 and xarray can all read.
+
+zarr is an optional dependency; it is only imported when a Zarr sidecar is written or read.
+"""
+
+import os
+import netCDF4
+import numpy
+
+# The object consolidate() writes the metadata of a store to (Zarr v2 format)
+CONSOLIDATED_METADATA = '.zmetadata'
+BLOSC_CNAMES = {'blosc_lz': 'blosclz', 'blosc_lz4': 'lz4', 'blosc_lz4hc': 'lz4hc',
+                'blosc_zlib': 'zlib', 'blosc_zstd': 'zstd'}
+
+
+def import_zarr():
+    try:
+        import zarr
+    except ImportError:
+        raise ImportError('writing Zarr sidecars requires the zarr package (pip install zarr)')
+    return zarr
+
+
+def zarr_major_version():
+    return int(import_zarr().__version__.split('.')[0])
+
+
+def open_group(path, mode):
+    zarr = import_zarr()
+    if zarr_major_version() >= 3:
+        return ZarrGroup(zarr.open_group(path, mode=mode, zarr_format=2))
+    else:
+        return ZarrGroup(zarr.open_group(path, mode=mode))
+
+
+def consolidate(path):
+    """ Consolidates the metadata of all groups and arrays into a single object so readers open the store with one
+    metadata read """
+    zarr = import_zarr()
+    if zarr_major_version() >= 3:
+        zarr.consolidate_metadata(path, zarr_format=2)
+    else:
+        zarr.consolidate_metadata(path)
+
+
+def open_consolidated(path):
+    """ Opens a sidecar store read-only using its consolidated metadata """
+    zarr = import_zarr()
+    if zarr_major_version() >= 3:
+        return zarr.open_consolidated(path, zarr_format=2)
+    else:
+        return zarr.open_consolidated(path, mode='r')
+
+
+def memmap_array(path, array):
+    """ A read-only memory map of an array of the store at path if the array is stored as a single uncompressed,
+    unfiltered chunk; None otherwise """
+    if zarr_major_version() >= 3:
+        raw = not array.compressors and not array.filters
+    else:
+        raw = array.compressor is None and not array.filters
+    if not raw or array.ndim == 0 or array.order != 'C' or tuple(array.chunks) != tuple(array.shape):
+        return None
+    chunk_path = os.path.join(path, *array.path.split('/'), '.'.join(['0'] * array.ndim))
+    if not os.path.exists(chunk_path):
+        # Never written; zarr returns the fill value
+        return None
+    return numpy.memmap(chunk_path, dtype=array.dtype, mode='r', shape=tuple(array.shape))
+
+
+def make_codecs(compression, complevel, itemsize, shuffle=True, blosc_shuffle=None):
+    """ Translates the netCDF4 compression options to a numcodecs (compressor, filters) pair """
+    import numcodecs
+    filters = []
+    if blosc_shuffle is not None:
+        shuffle = bool(blosc_shuffle)
+    if compression is None:
+        compressor = None
+    elif compression in BLOSC_CNAMES:
+        blosc_mode = numcodecs.Blosc.SHUFFLE if shuffle else numcodecs.Blosc.NOSHUFFLE
+        compressor = numcodecs.Blosc(cname=BLOSC_CNAMES[compression], clevel=complevel, shuffle=blosc_mode)
+    else:
+        if shuffle:
+            filters = [numcodecs.Shuffle(elementsize=itemsize)]
+        if compression == 'zlib':
+            compressor = numcodecs.Zlib(level=complevel)
+        elif compression == 'zstd':
+            compressor = numcodecs.Zstd(level=complevel)
+        elif compression == 'bzip2':
+            compressor = numcodecs.BZ2(level=complevel)
+        else:
+            raise ValueError('compression {} is not supported for Zarr sidecars'.format(compression))
+    return compressor, filters
+
+
+def json_attributes(attributes):
+    """ Zarr stores attributes as JSON, which has no numpy types """
+    return {name: value.tolist() if isinstance(value, (numpy.generic, numpy.ndarray)) else value
+            for name, value in attributes.items()}
+
+
+class ZarrVariable:
+
+    def __init__(self, array):
+        self.array = array
+
+    def setncatts(self, attributes):
+        self.array.attrs.update(json_attributes(attributes))
+
+    def __setitem__(self, key, data):
+        fill_value = self.array.fill_value
+        if numpy.ma.isMaskedArray(data):
+            data = data.filled(fill_value)
+        self.array[key] = numpy.asarray(data).astype(self.array.dtype, copy=False)
+
+
+class ZarrGroup:
+
+    def __init__(self, group, parent=None):
+        self.group = group
+        self.parent = parent
+
+    def close(self):
+        pass
+
+    def setncatts(self, attributes):
+        self.group.attrs.update(json_attributes(attributes))
+
+    def createGroup(self, name):
+        return ZarrGroup(self.group.require_group(name), parent=self)
+
+    def createDimension(self, name, size):
+        dimensions = dict(self.group.attrs.get('_DIMENSIONS', {}))
+        if name in dimensions:
+            raise ValueError('dimension {} already exists'.format(name))
+        dimensions[name] = int(size)
+        self.group.attrs['_DIMENSIONS'] = dimensions
+
+    def dimension_size(self, name):
+        dimensions = self.group.attrs.get('_DIMENSIONS', {})
+        if name in dimensions:
+            return dimensions[name]
+        elif self.parent is not None:
+            return self.parent.dimension_size(name)
+        raise KeyError('dimension {} is not defined'.format(name))
+
+    def createVariable(self, varname, datatype, dimensions, chunksizes=None, fill_value=None,
+                       compression='zlib', complevel=4, shuffle=True, blosc_shuffle=None):
+        if isinstance(dimensions, str):
+            dimensions = (dimensions,)
+        dtype = numpy.dtype(datatype)
+        shape = tuple(self.dimension_size(name) for name in dimensions)
+        if fill_value is False:
+            # netCDF4's 'no fill'
+            fill_value = None
+        elif fill_value is None:
+            # Same default as netCDF so that masked values end up identical in both formats
+            fill_value = netCDF4.default_fillvals[dtype.str[1:]]
+        compressor, filters = make_codecs(compression, complevel, dtype.itemsize, shuffle, blosc_shuffle)
+        if chunksizes is None:
+            chunksizes = shape
+        if zarr_major_version() >= 3:
+            array = self.group.create_array(varname, shape=shape, dtype=dtype, chunks=chunksizes,
+                                            compressors=[compressor] if compressor else None,
+                                            filters=filters or None, fill_value=fill_value)
+        else:
+            array = self.group.create_dataset(varname, shape=shape, dtype=dtype, chunks=chunksizes,
+                                              compressor=compressor, filters=filters or None,
+                                              fill_value=fill_value)
+        array.attrs['_ARRAY_DIMENSIONS'] = list(dimensions)
+        return ZarrVariable(array)
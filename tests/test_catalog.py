@@ -0,0 +1,53 @@
+import staremaster.catalog
+import staremaster.create_sidecar_files
+from tests.test_parallel_files import SyntheticGranule
+
+
+def test_catalog(tmp_path, monkeypatch):
+    catalog_path = str(tmp_path / 'catalog.sqlite')
+    archive = tmp_path / 'archive.csv'
+    archive.write_text('a.hdf, a_stare.nc \nb.hdf, b_stare.nc \n')
+
+    with staremaster.catalog.Catalog(catalog_path, batch_size=2) as catalog:
+        assert catalog.import_archive(str(archive)) == 2
+        catalog.record('c.hdf', product='MOD05', status='failed', error='OSError: unreadable granule')
+        assert catalog.remove_processed(['a.hdf', 'c.hdf', 'd.hdf']) == ['c.hdf', 'd.hdf']
+        assert catalog.lookup(['b.hdf', 'c.hdf']) == {'b.hdf': 'b_stare.nc'}
+
+    monkeypatch.setattr(staremaster.create_sidecar_files, 'get_granule',
+                        lambda file_path, product=None: SyntheticGranule(file_path))
+    file_paths = [str(tmp_path / 'MOD05_L2.A2005349.0000.061.2017294065400.hdf'),
+                  str(tmp_path / 'VNP03DNB.A2020219.0742.001.2020219124651.nc'),
+                  str(tmp_path / 'poison.hdf')]
+    with staremaster.catalog.Catalog(catalog_path) as catalog:
+        staremaster.create_sidecar_files.create_sidecars_parallel(
+            file_paths, n_processes=2, product=None, cover_res=None, out_path=str(tmp_path), archive=None,
+            retries=0, catalog=catalog)
+
+    with staremaster.catalog.Catalog(catalog_path) as catalog:
+        # The products are the registry names, not the reader classes
+        done = {record['granule']: record for record in catalog.query(status='done')
+                if record['product'] is not None}
+        assert {record['product'] for record in done.values()} == {'MOD05', 'VNP03DNB'}
+        assert sorted(done) == sorted(file_paths[:2])
+        assert all(record['sidecar'].endswith('_stare.nc') and record['convert_seconds'] >= 0
+                   for record in done.values())
+        failed = catalog.query(status='failed')
+        assert {record['granule'] for record in failed} == {'c.hdf', file_paths[2]}
+        assert sorted((str(row['product']), row['status'], row['granules']) for row in catalog.summary()) == [
+            ('MOD05', 'done', 1), ('MOD05', 'failed', 1), ('None', 'done', 2), ('None', 'failed', 1),
+            ('VNP03DNB', 'done', 1)]
+
+
+def test_catalog_pipelined(tmp_path, monkeypatch):
+    monkeypatch.setattr(staremaster.create_sidecar_files, 'get_granule',
+                        lambda file_path, product=None: SyntheticGranule(file_path))
+    file_paths = [str(tmp_path / 'MOD05_L2.A2005349.{:04d}.061.2017294065400.hdf'.format(t)) for t in range(4)]
+    with staremaster.catalog.Catalog(str(tmp_path / 'catalog.sqlite')) as catalog:
+        catalog.record(file_paths[0], 'done_stare.nc')
+        # The lookups of the lazily filtered granules must stay on the thread of the connection
+        staremaster.create_sidecar_files.create_sidecars_pipelined(
+            catalog.skip_processed(iter(file_paths), batch_size=2), n_workers=1, product=None, cover_res=None,
+            out_path=str(tmp_path), archive=None, prefetch=1, catalog=catalog)
+        assert sorted(catalog.processed(file_paths)) == sorted(file_paths)
+        assert catalog.lookup(file_paths[:1]) == {file_paths[0]: 'done_stare.nc'}
@@ -0,0 +1,229 @@
+import staremaster.conversions
+import staremaster.create_sidecar_files
+import glob
+import os
+import numpy
+import pystare
+import pytest
+import warnings
+
+granules = [(path, 'MOD05') for path in sorted(glob.glob('tests/data/mod05/*[0-9].hdf'))] + \
+           [(path, 'MOD09') for path in sorted(glob.glob('tests/data/mod09/*[0-9].hdf'))] + \
+           [('tests/data/viirs/VNP03DNB.A2020219.0742.001.2020219124651.nc', 'VNP03DNB'),
+            ('tests/data/viirs/VNP03IMG.A2022308.1930.002.2022309041547.nc', 'VNP03IMG'),
+            ('tests/data/viirs/CLDMSK_L2_VIIRS_SNPP.A2020219.0742.001.2020219190616.nc', 'CLDMSK_L2_SNPP')]
+
+
+def parallel_sids(lats, lons, backend, **kwargs):
+    with warnings.catch_warnings():
+        # The threads backend warns when it falls back to a serial conversion
+        warnings.simplefilter('ignore')
+        return staremaster.conversions.latlon2stare(lats, lons, n_workers=3, backend=backend, **kwargs)
+
+
+@pytest.mark.parametrize('backend', staremaster.conversions.BACKENDS)
+@pytest.mark.parametrize('chunks', [None, (300, 15)])
+def test_parallel_matches_serial(backend, chunks):
+    rng = numpy.random.default_rng(1)
+    lats, lons = numpy.meshgrid(numpy.linspace(30, 40, 1100), numpy.linspace(-100, -85, 40), indexing='ij')
+    lats += rng.normal(scale=0.02, size=lats.shape)
+    lons += rng.normal(scale=0.02, size=lats.shape)
+    # Fill values across the borders of the planned row chunks and of the (300, 15) tiles
+    lats[458:463, 5:9] = -999
+    lats[598:603, 13:17] = -999
+    serial = staremaster.conversions.latlon2stare(lats, lons, n_workers=1, fill_value_in=-999, fill_value_out=-1)
+    staremaster.conversions.set_chunks(chunks)
+    try:
+        sids = parallel_sids(lats, lons, backend, fill_value_in=-999, fill_value_out=-1)
+    finally:
+        staremaster.conversions.set_chunks(None)
+    assert (sids == serial).all()
+
+
+def test_blocks_with_halo():
+    lats, lons = numpy.meshgrid(numpy.linspace(30, 40, 20), numpy.linspace(-100, -85, 30), indexing='ij')
+    lats = lats + numpy.sin(lons)
+    serial = pystare.from_latlon_2d(lats, lons, adapt_level=True)
+    sids = numpy.empty_like(serial)
+    for block in [(slice(0, 7), slice(0, 13)), (slice(0, 7), slice(13, 30)), (slice(7, 20), slice(0, 30))]:
+        sids[block] = staremaster.conversions.convert_block(lats, lons, block, adapt_level=True)
+    assert (sids == serial).all()
+
+
+@pytest.mark.parametrize('backend', staremaster.conversions.BACKENDS)
+@pytest.mark.parametrize('granule_path, product', granules)
+def test_granule_parallel_matches_serial(granule_path, product, backend):
+    granule = staremaster.create_sidecar_files.get_granule(granule_path, product)
+    granule.load()
+    if isinstance(granule.lats, dict):
+        resolutions = [(granule.lats[res], granule.lons[res]) for res in granule.lats]
+    else:
+        resolutions = [(granule.lats, granule.lons)]
+    for lats, lons in resolutions:
+        # Enough rows to cross the borders of the dask chunks and row blocks, few columns to keep it fast
+        lats = lats[:1100, :200]
+        lons = lons[:1100, :200]
+        serial = staremaster.conversions.latlon2stare(lats, lons, n_workers=1)
+        assert (parallel_sids(lats, lons, backend) == serial).all()
+
+
+@pytest.mark.parametrize('n_workers, backend', [(1, None)] + [(3, backend)
+                                                            for backend in staremaster.conversions.BACKENDS])
+def test_masked_conversion(n_workers, backend):
+    lats, lons = numpy.meshgrid(numpy.linspace(30, 40, 300), numpy.linspace(-100, -85, 200), indexing='ij')
+    lats = lats + numpy.sin(lons)
+    mask = numpy.zeros(lats.shape, dtype=bool)
+    # Masked tiles, partially masked tiles and garbage under the mask that must not affect the neighbours' levels
+    mask[:150, :130] = True
+    mask[200:203, 50:150] = True
+    lats[mask] = 0
+    filled_lats, filled_lons = lats.copy(), lons.copy()
+    filled_lats[mask] = filled_lons[mask] = -999
+    serial = pystare.from_latlon_2d(filled_lats, filled_lons, adapt_level=True, fill_value_in=-999, fill_value_out=-1)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        sids = staremaster.conversions.latlon2stare(lats, lons, n_workers=n_workers, backend=backend, mask=mask)
+    assert (sids == serial).all()
+    assert (sids[mask] == staremaster.conversions.MASK_FILL_OUT).all()
+
+
+def test_masked_conversion_row_end(monkeypatch):
+    # Rows far apart, so that the level of a pixel leveled by the next row differs
+    lats, lons = numpy.meshgrid(numpy.linspace(30, 40, 20), numpy.linspace(-100, -98.5, 40), indexing='ij')
+    mask = numpy.zeros(lats.shape, dtype=bool)
+    mask[:2, :3] = True
+    mask[5, 38] = True
+    filled_lats, filled_lons = staremaster.conversions.fill_masked(lats, lons, mask, -999)
+    serial = pystare.from_latlon_2d(filled_lats, filled_lons, adapt_level=True, fill_value_in=-999, fill_value_out=-1)
+    monkeypatch.setattr(staremaster.conversions, 'conversion_chunks', (8, 16))
+    sids = staremaster.conversions.latlon2stare(lats, lons, backend='threads', mask=mask)
+    # Only the level of the last pixel after a masked one in a tile that does not start at the first column differs
+    assert numpy.argwhere(sids != serial).tolist() == [[5, 39]]
+    assert sids[5, 39] >> 5 == serial[5, 39] >> 5
+
+
+def test_merge_stare():
+    rng = numpy.random.default_rng(0)
+    # Level 14 SIDs of a region with holes, some of them repeated or inside a coarser SID
+    trixels = rng.choice(numpy.arange(2000, 6000), size=10000)
+    sids = ((trixels << 26) << 5) | 14
+    sids = numpy.concatenate([sids, [(2000 << 31) | 13]])
+    serial = staremaster.conversions.merge_stare(sids)
+    assert (staremaster.conversions.merge_stare(sids, n_workers=3) == serial).all()
+    assert (staremaster.conversions.merge_stare(sids, n_chunks=5) == serial).all()
+    # The cover covers exactly the same level 27 trixels as the SIDs
+    def coverage(sids):
+        return staremaster.conversions.merge_intervals(*staremaster.conversions.sids2intervals(sids))
+    for merged, expected in zip(coverage(serial), coverage(sids)):
+        assert (merged == expected).all()
+    assert len(serial) < len(numpy.unique(trixels))
+
+
+def test_dask_client_reuse():
+    lats, lons = numpy.meshgrid(numpy.linspace(30, 31, 60), numpy.linspace(-100, -98.5, 40), indexing='ij')
+    staremaster.conversions.shutdown_client()
+    try:
+        sids = parallel_sids(lats, lons, 'dask')
+        client = staremaster.conversions.dask_client
+        cluster = client.cluster
+        # Later conversions and merges with the same number of workers run on the same cluster
+        assert (parallel_sids(lats, lons, 'dask') == sids).all()
+        cover = staremaster.conversions.merge_stare(sids.ravel(), n_workers=3,
+                                                    client=staremaster.conversions.get_client(3))
+        assert (cover == staremaster.conversions.merge_stare(sids.ravel())).all()
+        assert staremaster.conversions.dask_client is client and client.cluster is cluster
+        assert len(client.scheduler_info()['workers']) == 3
+        # Another number of workers restarts the local cluster
+        staremaster.conversions.latlon2stare(lats, lons, n_workers=2, backend='dask')
+        assert staremaster.conversions.dask_client is not client
+        assert len(staremaster.conversions.dask_client.scheduler_info()['workers']) == 2
+    finally:
+        staremaster.conversions.shutdown_client()
+
+
+def test_intervals2sids_start_zero():
+    # Intervals starting at location 0 are aligned to any trixel; no log2(0) warnings
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        sids = staremaster.conversions.intervals2sids(numpy.array([0, 16]), numpy.array([4 ** 26, 21]))
+    assert sids.tolist() == [1, (16 << 5) | 26, (20 << 5) | 27]
+
+
+def test_cover_accumulator():
+    rng = numpy.random.default_rng(0)
+    sids = ((rng.choice(numpy.arange(2000, 6000), size=(40, 250)) << 26) << 5) | 14
+    # Compacts several times along the way
+    accumulator = staremaster.conversions.CoverAccumulator(compact_size=500)
+    for row in sids:
+        accumulator.add(row)
+    assert len(accumulator) < sids.size
+    assert (accumulator.cover() == staremaster.conversions.merge_stare(sids.ravel())).all()
+    masked = numpy.ma.masked_array(sids, mask=numpy.zeros(sids.shape, dtype=bool))
+    masked.mask[20:] = True
+    assert (staremaster.conversions.sids2cover(masked) == staremaster.conversions.merge_stare(sids[:20])).all()
+
+
+def test_cover_cache(tmp_path, monkeypatch):
+    scandir = os.scandir
+    lats, lons = [30, 30, 40, 40], [-100, -90, -90, -100]
+    cache = staremaster.conversions.CoverCache(str(tmp_path), max_memory_bytes=10**4, max_bytes=10**6)
+    cover = cache.cover(lats, lons, 8, lambda: pystare.cover_from_hull(numpy.array(lats, dtype=float),
+                                                                        numpy.array(lons, dtype=float), 8))
+    assert (cache.cover(lats, lons, 8, None) == cover).all()
+    # Another process: served from disk
+    cache = staremaster.conversions.CoverCache(str(tmp_path), max_bytes=10**6)
+    assert (cache.cover(numpy.array(lats) + 1e-9, lons, 8, None) == cover).all()
+    assert (cache.hits, cache.misses) == (1, 0)
+    # The directory is only listed once its tally exceeds max_bytes; then the least recently used files are evicted
+    scans = []
+    monkeypatch.setattr(os, 'scandir', lambda path: scans.append(path) or scandir(path))
+    # The cover of resolution 8 takes 2352 bytes, those below 208 bytes
+    cache.max_bytes = 2900
+    for resolution in [5, 6]:
+        cache.cover(lats, lons, resolution, lambda: numpy.arange(10))
+    assert not scans
+    cache.cover(lats, lons, 7, lambda: numpy.arange(10))
+    assert len(scans) == 1
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(
+        cache.key(lats, lons, resolution) + '.npy' for resolution in [5, 6, 7])
+    assert cache.directory_bytes == sum(path.stat().st_size for path in tmp_path.iterdir())
+
+    # The memory holds the most recently used covers up to max_memory_bytes
+    cache = staremaster.conversions.CoverCache(max_memory_bytes=160)
+    for resolution in [5, 6, 7]:
+        cache.put(resolution, numpy.arange(10))
+    assert list(cache.memory) == [6, 7] and cache.memory_bytes == 160
+    cache.put(8, numpy.arange(30))
+    assert list(cache.memory) == [6, 7]
+
+
+def test_two_phase_conversion():
+    lats, lons = numpy.meshgrid(numpy.linspace(30, 31, 60), numpy.linspace(-100, -98.5, 80), indexing='ij')
+    lats = lats + 0.01 * numpy.sin(lons * 300)
+    lats[10, 5:9] = -999
+    kwargs = {'fill_value_in': -999, 'fill_value_out': -1}
+    serial = staremaster.conversions.latlon2stare(lats, lons, **kwargs)
+    sids = staremaster.conversions.latlon2stare(lats, lons, resolution_estimate='spacing', **kwargs)
+    # Same locations and levels, the neighbours of the fill values included
+    assert (sids == serial).all()
+    # Leveled again with a custom map, without a lookup
+    resolutions = numpy.repeat(numpy.arange(8, 12), 20)
+    releveled = staremaster.conversions.locations2stare(serial, lats, lons, resolutions=resolutions)
+    assert (releveled[lats != -999] & 31 == numpy.broadcast_to(resolutions, lats.shape)[lats != -999]).all()
+    assert (releveled[10, 5:9] == -1).all()
+
+
+@pytest.mark.parametrize('spacing', [0.375, 0.75, 1, 2, 5])
+@pytest.mark.parametrize('latitude', [0, 30, -55, 75])
+def test_spacing_resolution(spacing, latitude):
+    # A swath-like grid: rows spacing km apart along a track heading 30 degrees off the parallel
+    rows, cols = numpy.meshgrid(numpy.arange(20), numpy.arange(40), indexing='ij')
+    heading = numpy.radians(30)
+    north = spacing * (cols * numpy.sin(heading) + rows * numpy.cos(heading))
+    east = spacing * (cols * numpy.cos(heading) - rows * numpy.sin(heading))
+    lats = latitude + numpy.degrees(north / staremaster.conversions.EARTH_RADIUS_KM)
+    lons = 20 + numpy.degrees(east / staremaster.conversions.EARTH_RADIUS_KM / numpy.cos(numpy.radians(lats)))
+    adapted = pystare.from_latlon_2d(lats, lons, adapt_level=True)
+    assert (staremaster.conversions.estimate_resolution(lats, lons) == adapted & 31).all()
+    sids = staremaster.conversions.latlon2stare(lats, lons, resolution_estimate='spacing')
+    assert (sids == adapted).all()
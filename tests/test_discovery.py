@@ -0,0 +1,68 @@
+import datetime
+import os
+import staremaster.create_sidecar_files
+import staremaster.discovery
+import staremaster.find_missing_sidecars
+from tests.test_parallel_files import SyntheticGranule
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'w').close()
+
+
+def test_find_granules(tmp_path):
+    names = ['2020/218/MOD05_L2.A2020218.0000.061.2020219000000.hdf',
+             '2020/219/MOD05_L2.A2020219.0000.061.2020220000000.hdf',
+             '2020/219/MOD05_L2.A2020219.0000.061.2020220000000_stare.nc',
+             '2020/219/.MOD05_L2.A2020219.0005.061.2020220000000_stare.nc.part',
+             '2020/219/MOD05_L2.A2020219.0000.061.2020220000000.hdf.xml',
+             '2020/219/MOD09.A2020219.0000.006.2020220000000.hdf',
+             '2021/001/MOD05_L2.A2021001.0000.061.2021002000000.hdf',
+             'MOD05_L2.A2005349.2125.061.2017294065400.hdf',
+             'goes/OR_ABI-L1b-RadF-M6C01_G16_s20202190000000_e20202190009308_c20202190009357.nc',
+             'viirs/CLDMSK_L2_VIIRS_SNPP.A2020219.0742.001.2020219190616.nc',
+             'viirs/.CLDMSK_L2_VIIRS_SNPP.A2020219.0742.001.2020219190616_stare.nc.0123abcd.part']
+    for name in names:
+        touch(str(tmp_path / name))
+    os.makedirs(str(tmp_path / '2020/219/MOD05_L2.A2020219.0010.061.2020220000000_stare.zarr/STARE_index'))
+
+    def found(**kwargs):
+        granules = staremaster.discovery.find_granules(str(tmp_path), **kwargs)
+        return sorted(os.path.relpath(path, str(tmp_path)) for path in granules)
+
+    assert found() == [names[7]]
+    assert found(recursive=True, product='mod05') == sorted([names[0], names[1], names[6], names[7]])
+    assert found(recursive=True, product='MOD05', start=datetime.date(2020, 8, 6),
+                 end=datetime.date(2020, 12, 31)) == [names[1]]
+    # Products are recognized by the file patterns of the registry, not by their name
+    assert found(recursive=True, product='goes_abi_fixed_grid') == [names[8]]
+    assert found(recursive=True, product='CLDMSK_L2_SNPP') == [names[9]]
+    sidecars = staremaster.discovery.find_sidecars(str(tmp_path), recursive=True)
+    assert sorted(os.path.basename(path) for path in sidecars) == [
+        'MOD05_L2.A2020219.0000.061.2020220000000_stare.nc', 'MOD05_L2.A2020219.0010.061.2020220000000_stare.zarr']
+
+    partials = staremaster.find_missing_sidecars.get_partial_paths(str(tmp_path), recursive=True)
+    assert sorted(os.path.relpath(path, str(tmp_path)) for path in partials) == sorted([names[3], names[10]])
+    assert staremaster.find_missing_sidecars.get_partial_paths(str(tmp_path)) == []
+
+    file_list = tmp_path / 'granules.txt'
+    file_list.write_text('# granules of day 219\n{}\n\n{}\n'.format(names[1], names[5]))
+    assert list(staremaster.discovery.read_file_list(str(file_list))) == [names[1], names[5]]
+
+
+def test_streamed_parallel_sidecars(tmp_path, monkeypatch):
+    monkeypatch.setattr(staremaster.create_sidecar_files, 'get_granule',
+                        lambda file_path, product=None: SyntheticGranule(file_path))
+    for day in range(218, 222):
+        touch(str(tmp_path / '2020' / str(day) / 'MOD05_L2.A2020{}.0000.061.2020220000000.hdf'.format(day)))
+
+    # The scan is consumed one granule at a time while the sidecars are created
+    granules = staremaster.discovery.find_granules(str(tmp_path), recursive=True)
+    succeeded, failed = staremaster.create_sidecar_files.create_sidecars_parallel(
+        granules, n_processes=2, product=None, cover_res=None, out_path=None, archive=None, lookahead=1)
+    assert len(succeeded) == 4 and not failed
+    sidecars = staremaster.discovery.find_sidecars(str(tmp_path), recursive=True)
+    assert len(list(sidecars)) == 4
+    # Sidecars are not taken for granules
+    assert len(list(staremaster.discovery.find_granules(str(tmp_path), recursive=True))) == 4
@@ -1 +1,118 @@
- 
+import staremaster.create_sidecar_files
+import staremaster.sidecar
+import netCDF4
+import numpy
+import os
+import pytest
+import threading
+import time
+
+
+class SyntheticGranule:
+
+    closed = []
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.sids = None
+
+    def close(self):
+        # Records who closed the file and whether the HDF calls were serialized
+        SyntheticGranule.closed.append((self.file_path, threading.current_thread().name,
+                                        staremaster.sidecar.IO_LOCK._is_owned()))
+
+    def load(self):
+        if 'poison' in self.file_path:
+            raise OSError('unreadable granule')
+        if 'slow' in self.file_path:
+            time.sleep(60)
+        if os.path.basename(self.file_path) == 'crash.hdf':
+            # A segfault of the HDF library
+            os._exit(1)
+        if os.path.basename(self.file_path) == 'exit.hdf':
+            exit()
+        self.sids = numpy.arange(12, dtype=numpy.uint64).reshape(3, 4)
+
+    def create_sidecar(self, n_workers=1, cover_res=None, out_path=None, **sidecar_options):
+        sidecar = staremaster.sidecar.Sidecar(self.file_path, out_path, **sidecar_options)
+        with sidecar:
+            sidecar.write_dimensions(3, 4, 0)
+            sidecar.write_sids(self.sids)
+        return sidecar
+
+
+def test_pipelined_sidecars(tmp_path, monkeypatch):
+    monkeypatch.setattr(staremaster.create_sidecar_files, 'get_granule',
+                        lambda file_path, product=None: SyntheticGranule(file_path))
+    file_paths = [str(tmp_path / 'MOD05_L2.A2005349.{:04d}.061.2017294065400.hdf'.format(t)) for t in range(5)]
+    archive = str(tmp_path / 'archive.csv')
+    monkeypatch.setattr(SyntheticGranule, 'closed', [])
+
+    busy, wall_time = staremaster.create_sidecar_files.create_sidecars_pipelined(
+        file_paths, n_workers=1, product=None, cover_res=None, out_path=str(tmp_path), archive=archive, prefetch=2)
+    assert set(busy) == {'read', 'convert', 'write'}
+    assert wall_time > 0
+    # Every granule is closed once it has been converted, on the converting thread and under IO_LOCK
+    assert SyntheticGranule.closed == [(file_path, threading.main_thread().name, True) for file_path in file_paths]
+    with open(archive) as cat:
+        sidecar_paths = [line.split(',')[1].strip() for line in cat]
+    assert len(sidecar_paths) == 5
+    for sidecar_path in sidecar_paths:
+        with netCDF4.Dataset(sidecar_path, 'r', format='NETCDF4') as netcdf:
+            assert (netcdf['STARE_index'][:] == numpy.arange(12).reshape(3, 4)).all()
+
+    # A granule that fails to load stops the pipeline with its error
+    def get_granule(file_path, product=None):
+        if file_path == file_paths[1]:
+            raise OSError('unreadable granule')
+        return SyntheticGranule(file_path)
+    monkeypatch.setattr(staremaster.create_sidecar_files, 'get_granule', get_granule)
+    with pytest.raises(OSError, match='unreadable granule'):
+        staremaster.create_sidecar_files.create_sidecars_pipelined(
+            file_paths, n_workers=1, product=None, cover_res=None, out_path=str(tmp_path), archive=None,
+            prefetch=1)
+
+
+def test_parallel_sidecars(tmp_path, monkeypatch):
+    # Forked workers inherit the patched reader
+    monkeypatch.setattr(staremaster.create_sidecar_files, 'get_granule',
+                        lambda file_path, product=None: SyntheticGranule(file_path))
+    names = ['MOD05_L2.A2005349.{:04d}.061.2017294065400.hdf'.format(t) for t in range(3)] + ['poison.hdf', 'slow.hdf']
+    file_paths = [str(tmp_path / name) for name in names]
+    quarantine = str(tmp_path / 'quarantine.csv')
+
+    succeeded, failed = staremaster.create_sidecar_files.create_sidecars_parallel(
+        file_paths, n_processes=2, product=None, cover_res=None, out_path=str(tmp_path), archive=None,
+        timeout=2, retries=1, quarantine=quarantine)
+    assert sorted(succeeded) == sorted(file_paths[:3])
+    assert set(failed) == set(file_paths[3:])
+    assert 'unreadable granule' in failed[file_paths[3]]
+    assert 'timed out' in failed[file_paths[4]]
+    with open(quarantine) as cat:
+        assert sorted(line.split(',')[0] for line in cat) == sorted(file_paths[3:])
+
+    # Quarantined granules are skipped
+    succeeded, failed = staremaster.create_sidecar_files.create_sidecars_parallel(
+        file_paths, n_processes=2, product=None, cover_res=None, out_path=str(tmp_path), archive=None,
+        timeout=2, retries=1, quarantine=quarantine)
+    assert len(succeeded) == 3 and not failed
+
+
+@pytest.mark.parametrize('n_processes', [1, 3])
+def test_parallel_sidecars_crash(tmp_path, monkeypatch, n_processes):
+    monkeypatch.setattr(staremaster.create_sidecar_files, 'get_granule',
+                        lambda file_path, product=None: SyntheticGranule(file_path))
+    names = ['MOD05_L2.A2005349.{:04d}.061.2017294065400.hdf'.format(t) for t in range(4)] + ['crash.hdf', 'exit.hdf']
+    file_paths = [str(tmp_path / name) for name in names]
+    quarantine = str(tmp_path / 'quarantine.csv')
+
+    # A worker that dies is no timeout: without one, the run still ends and the crash is reported as such
+    succeeded, failed = staremaster.create_sidecar_files.create_sidecars_parallel(
+        file_paths, n_processes=n_processes, product=None, cover_res=None, out_path=str(tmp_path), archive=None,
+        retries=1, quarantine=quarantine)
+    assert sorted(succeeded) == sorted(file_paths[:4])
+    assert set(failed) == set(file_paths[4:])
+    assert 'BrokenProcessPool' in failed[file_paths[4]]
+    assert 'SystemExit' in failed[file_paths[5]]
+    with open(quarantine) as cat:
+        assert sorted(line.split(',')[0] for line in cat) == sorted(file_paths[4:])
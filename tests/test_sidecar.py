@@ -0,0 +1,224 @@
+import staremaster.conversions
+import staremaster.sidecar
+import glob
+import os
+import netCDF4
+import numpy
+import pytest
+
+
+def test_atomic_sidecar(tmp_path):
+    granule_path = str(tmp_path / 'MOD05_L2.A2005349.2125.061.2017294065400.hdf')
+    sids = numpy.arange(12, dtype=numpy.uint64).reshape(3, 4)
+
+    with staremaster.sidecar.Sidecar(granule_path) as sidecar:
+        sidecar.write_dimensions(3, 4, 0, nom_res='5km')
+        sidecar.write_sids(sids, nom_res='5km')
+        # Nothing is visible under the final name until the sidecar is complete
+        assert not os.path.exists(sidecar.file_path)
+
+    assert os.path.exists(sidecar.file_path)
+    assert not glob.glob(str(tmp_path / ('.*' + staremaster.sidecar.PARTIAL_SUFFIX)))
+    with netCDF4.Dataset(sidecar.file_path, 'r', format='NETCDF4') as netcdf:
+        assert (netcdf['STARE_index_5km'][:] == sids).all()
+
+    with pytest.raises(RuntimeError):
+        with staremaster.sidecar.Sidecar(granule_path.replace('A2005349', 'A2005350')) as sidecar:
+            sidecar.write_dimensions(3, 4, 0)
+            raise RuntimeError('worker killed')
+    assert not os.path.exists(sidecar.file_path)
+    assert not glob.glob(str(tmp_path / ('.*' + staremaster.sidecar.PARTIAL_SUFFIX)))
+
+
+@pytest.mark.parametrize('format', ['netcdf', 'zarr'])
+def test_sidecar_without_session(tmp_path, format):
+    if format == 'zarr':
+        pytest.importorskip('zarr')
+    granule_path = str(tmp_path / 'MOD05_L2.A2005349.2125.061.2017294065400.hdf')
+    sids = numpy.arange(12, dtype=numpy.uint64).reshape(3, 4)
+
+    # Every call outside a session leaves a complete sidecar at file_path
+    sidecar = staremaster.sidecar.Sidecar(granule_path, format=format)
+    sidecar.write_dimensions(3, 4, 0)
+    assert os.path.exists(sidecar.file_path)
+    sidecar.write_sids(sids)
+    assert not glob.glob(str(tmp_path / ('.*' + staremaster.sidecar.PARTIAL_SUFFIX)))
+    with staremaster.sidecar.SidecarReader(sidecar.file_path) as reader:
+        assert (reader.sids()[:] == sids).all()
+    # A later session appends to the published sidecar
+    with sidecar:
+        sidecar.write_cover(numpy.arange(5, dtype=numpy.uint64))
+    with staremaster.sidecar.SidecarReader(sidecar.file_path) as reader:
+        assert (reader.sids()[:] == sids).all()
+        assert reader.cover().tolist() == list(range(5))
+
+
+def test_geolocation_storage(tmp_path):
+    granule_path = str(tmp_path / 'MOD05_L2.A2005349.2125.061.2017294065400.hdf')
+    lats, lons = numpy.meshgrid(numpy.linspace(-80, 80, 4), numpy.linspace(-170, 170, 3), indexing='ij')
+
+    with staremaster.sidecar.Sidecar(granule_path, geolocation='quantized', geolocation_precision=1e-5) as sidecar:
+        sidecar.write_dimensions(4, 3, 0)
+        sidecar.write_lats(lats)
+        sidecar.write_lons(lons)
+    with netCDF4.Dataset(sidecar.file_path, 'r', format='NETCDF4') as netcdf:
+        assert netcdf.geolocation_storage == 'quantized'
+        assert netcdf['Latitude'].dtype == numpy.int32
+        assert numpy.abs(netcdf['Latitude'][:] - lats).max() <= 1e-5
+        assert numpy.abs(netcdf['Longitude'][:] - lons).max() <= 1e-5
+
+    with staremaster.sidecar.Sidecar(granule_path, geolocation='none') as sidecar:
+        sidecar.write_dimensions(4, 3, 0)
+        sidecar.write_lats(lats)
+        sidecar.write_lons(lons)
+    with netCDF4.Dataset(sidecar.file_path, 'r', format='NETCDF4') as netcdf:
+        assert netcdf.geolocation_storage == 'none'
+        assert 'Latitude' not in netcdf.variables
+
+
+@pytest.mark.parametrize('chunks, expected', [(None, [100, 50]), ('auto', [22, 23]), ('scan', [10, 50]),
+                                             ((16, 20), [16, 20]), ((200, 20), [100, 20])])
+def test_chunking(tmp_path, chunks, expected):
+    granule_path = str(tmp_path / 'MOD05_L2.A2005349.2125.061.2017294065400.hdf')
+    sids = numpy.arange(5000, dtype=numpy.uint64).reshape(100, 50)
+
+    with staremaster.sidecar.Sidecar(granule_path, chunks=chunks, chunk_bytes=4096) as sidecar:
+        # Scans of 10 rows (4000 bytes of SIDs)
+        sidecar.write_dimensions(100, 50, 0, scan_rows=10)
+        sidecar.write_sids(sids)
+        sidecar.write_lats(numpy.zeros((100, 50)))
+    with netCDF4.Dataset(sidecar.file_path, 'r', format='NETCDF4') as netcdf:
+        assert netcdf['STARE_index'].chunking() == expected
+        assert (netcdf['STARE_index'][:] == sids).all()
+        if chunks == 'scan':
+            # Whole scans of the 4 byte latitudes: 2 scans per chunk
+            assert netcdf['Latitude'].chunking() == [20, 50]
+
+
+@pytest.mark.parametrize('compression', ['zlib', 'zstd', 'bzip2', 'blosc_lz4', 'blosc_zstd'])
+def test_compression(tmp_path, compression):
+    if compression not in staremaster.sidecar.available_compressions():
+        pytest.skip('{} is not supported by the installed netCDF4 library'.format(compression))
+    granule_path = str(tmp_path / 'MOD05_L2.A2005349.2125.061.2017294065400.hdf')
+    sids = numpy.arange(5000, dtype=numpy.uint64).reshape(100, 50)
+
+    with staremaster.sidecar.Sidecar(granule_path, compression=compression, complevel=6) as sidecar:
+        sidecar.write_dimensions(100, 50, 0)
+        sidecar.write_sids(sids)
+        # 96 and 40 byte chunks
+        sidecar.write_dimensions(3, 4, 0, nom_res='5km')
+        sidecar.write_sids(sids[:3, :4], nom_res='5km')
+        sidecar.write_cover(numpy.arange(5, dtype=numpy.uint64))
+    with netCDF4.Dataset(sidecar.file_path, 'r', format='NETCDF4') as netcdf:
+        filters = netcdf['STARE_index'].filters()
+        if compression in staremaster.sidecar.BLOSC_COMPRESSIONS:
+            assert filters['blosc'] == {'compressor': compression, 'shuffle': 1}
+        else:
+            assert filters[compression] and filters['complevel'] == 6
+            # netCDF4 only shuffles zlib variables
+            assert filters['shuffle'] == (compression == 'zlib')
+        assert (netcdf['STARE_index'][:] == sids).all()
+        # blosc falls back to zlib for chunks below 128 bytes
+        for name in ['STARE_index_5km', 'STARE_cover']:
+            small = netcdf[name].filters()
+            if compression in staremaster.sidecar.BLOSC_COMPRESSIONS:
+                assert small['zlib'] and not small['blosc'] and small['shuffle']
+            else:
+                assert small[compression]
+        assert (netcdf['STARE_index_5km'][:] == sids[:3, :4]).all()
+
+
+def test_delta_sids(tmp_path):
+    granule_path = str(tmp_path / 'MOD05_L2.A2005349.2125.061.2017294065400.hdf')
+    sids = numpy.array([[4611686018427387903, 4611686018427387904, 0],
+                        [3458764513820540928, 3458764513820540900, 3458764513820541000]], dtype=numpy.uint64)
+
+    with staremaster.sidecar.Sidecar(granule_path, sid_encoding='delta') as sidecar:
+        sidecar.write_dimensions(2, 3, 0)
+        sidecar.write_sids(sids, fill_value=0)
+    with netCDF4.Dataset(sidecar.file_path, 'r', format='NETCDF4') as netcdf:
+        assert netcdf['STARE_index'].sid_encoding == 'row_delta_zigzag'
+        decoded = staremaster.sidecar.read_sids(netcdf['STARE_index'])
+        assert (decoded.data == sids).all()
+        assert decoded.mask.tolist() == [[False, False, True], [False, False, False]]
+        assert (staremaster.sidecar.read_sids(netcdf['STARE_index'], rows=slice(1, 2)).data == sids[1:]).all()
+
+
+@pytest.mark.parametrize('compression, sid_encoding, write_stats', [(None, 'raw', False), ('zlib', 'delta', True)])
+def test_sidecar_reader(tmp_path, compression, sid_encoding, write_stats):
+    granule_path = str(tmp_path / 'MOD05_L2.A2005349.2125.061.2017294065400.hdf')
+    sids = (numpy.arange(40, dtype=numpy.uint64).reshape(8, 5) << numpy.uint64(10)) | numpy.uint64(9)
+    sids[0, 0] = 0
+    lats = numpy.linspace(-10, 10, 40).reshape(8, 5)
+
+    with staremaster.sidecar.Sidecar(granule_path, compression=compression, sid_encoding=sid_encoding,
+                                     geolocation='quantized') as sidecar:
+        sidecar.write_dimensions(8, 5, 0, nom_res='5km')
+        stats = staremaster.conversions.resolution_stats(sids, fill_value=0) if write_stats else None
+        sidecar.write_sids(sids, nom_res='5km', resolution_stats=stats)
+        sidecar.write_lats(lats, nom_res='5km')
+        sidecar.write_cover(numpy.array([1, 2], dtype=numpy.uint64))
+
+    with staremaster.sidecar.SidecarReader(sidecar.file_path) as reader:
+        assert reader.resolutions() == ['5km']
+        variable = reader.sids(nom_res='5km')
+        assert variable.shape == (8, 5)
+        assert (variable[2:4, 1:3] == sids[2:4, 1:3]).all()
+        assert variable[0].mask.tolist() == [True, False, False, False, False]
+        assert numpy.abs(reader.lats(nom_res='5km')[:] - lats).max() <= 1e-5
+        assert reader.cover().tolist() == [1, 2]
+        stats = reader.resolution_stats(nom_res='5km')
+        assert (stats['min_resolution'], stats['max_resolution'], stats['histogram'][9]) == (9, 9, 39)
+        assert ('resolution_histogram' in variable.attributes) == write_stats
+        with pytest.raises(KeyError):
+            reader.lons(nom_res='5km')
+
+    # Fill values are not counted as SIDs of level 0, also when they are not masked
+    staremaster.sidecar.SidecarReader.cache.clear()
+    with staremaster.sidecar.SidecarReader(sidecar.file_path, mask=False) as reader:
+        assert reader.sids(nom_res='5km')[0, 0] == 0
+        stats = reader.resolution_stats(nom_res='5km')
+        assert (stats['min_resolution'], stats['histogram'][0], stats['histogram'][9]) == (9, 0, 39)
+
+
+def test_reference_geolocation(tmp_path):
+    granule_path = str(tmp_path / 'VNP03MOD.A2020219.0742.001.2020219124651.nc')
+    lats = numpy.linspace(-10, 10, 12, dtype=numpy.float32).reshape(3, 4)
+    with netCDF4.Dataset(granule_path, 'w') as granule:
+        group = granule.createGroup('geolocation_data')
+        group.createDimension('i', 3)
+        group.createDimension('j', 4)
+        group.createVariable('latitude', 'f4', ('i', 'j'))[:] = lats
+
+    with staremaster.sidecar.Sidecar(granule_path, geolocation='reference') as sidecar:
+        sidecar.write_dimensions(3, 4, 0)
+        sidecar.write_lats(lats, reference='geolocation_data/latitude')
+
+    with staremaster.sidecar.SidecarReader(sidecar.file_path) as reader:
+        assert (reader.lats()[:] == lats).all()
+        assert (reader.lats()[1:, 2] == lats[1:, 2]).all()
+        # The granule is opened once per reader and closed with it
+        assert len(reader.granules) == 1
+        granule = next(iter(reader.granules.values()))
+    assert not granule.isopen()
+    assert reader.granules == {}
+
+
+def test_background_writer(tmp_path):
+    granule_path = str(tmp_path / 'MOD05_L2.A2005349.2125.061.2017294065400.hdf')
+    sids = numpy.arange(12, dtype=numpy.uint64).reshape(3, 4)
+
+    with staremaster.sidecar.Sidecar(granule_path, background_writer=True, writer_queue_size=1) as sidecar:
+        for nom_res in ['1km', '500m', '250m']:
+            sidecar.write_dimensions(3, 4, 0, nom_res=nom_res)
+            sidecar.write_sids(sids, nom_res=nom_res)
+    with netCDF4.Dataset(sidecar.file_path, 'r', format='NETCDF4') as netcdf:
+        assert (netcdf['STARE_index_250m'][:] == sids).all()
+
+    # Errors on the writer thread surface in the caller and discard the sidecar
+    with pytest.raises(ValueError):
+        with staremaster.sidecar.Sidecar(granule_path.replace('A2005349', 'A2005350'),
+                                         background_writer=True) as sidecar:
+            sidecar.write_sids(sids, nom_res='1km')
+    assert not os.path.exists(sidecar.file_path)
+    assert not glob.glob(str(tmp_path / ('.*' + staremaster.sidecar.PARTIAL_SUFFIX)))
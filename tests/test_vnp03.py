@@ -1,4 +1,5 @@
 import staremaster
+import staremaster.create_sidecar_files
 
 
 def test_bad_mod09():
@@ -8,3 +9,14 @@ def test_bad_mod09():
     granule.read_latlon()
     granule.read_gring()
     granule.create_sidecar(n_workers=1, cover_res=None, out_path=None)
+
+
+def test_product_dispatch():
+    # product_name() used to return 'VNP03', which get_granule() did not know
+    names = {'VNP03DNB.A2020219.0742.001.2020219124651.nc': 'VNP03MOD',
+             'VJ103MOD.A2020219.0742.021.2020219124651.nc': 'VNP03MOD',
+             'VNP03IMG.A2022308.1930.002.2022309041547.nc': 'VNP03IMG',
+             'CLDMSK_L2_VIIRS_SNPP.A2020219.0742.001.2020219190616.nc': 'CLMDKS_L2_VIIRS'}
+    for file_name, class_name in names.items():
+        product = staremaster.create_sidecar_files.product_name('tests/data/viirs/' + file_name)
+        assert staremaster.products.product_class(product).__name__ == class_name
@@ -0,0 +1,87 @@
+import staremaster
+import staremaster.create_sidecar_files
+import staremaster.sidecar
+import netCDF4
+import numpy
+import os
+import pytest
+import threading
+
+zarr = pytest.importorskip('zarr')
+
+granules = [('tests/data/mod05/MOD05_L2.A2005349.2125.061.2017294065400.hdf', 'MOD05'),
+            ('tests/data/mod09/MOD09.A2002299.0710.006.2015151173939.hdf', 'MOD09'),
+            ('tests/data/viirs/VNP03IMG.A2022308.1930.002.2022309041547.nc', 'VNP03IMG')]
+
+
+def compare_groups(netcdf_group, zarr_group):
+    zarr_arrays = dict(zarr_group.arrays())
+    assert set(netcdf_group.variables) == set(zarr_arrays)
+    for name, variable in netcdf_group.variables.items():
+        variable.set_auto_mask(False)
+        assert numpy.array_equal(variable[:], zarr_arrays[name][:])
+        assert list(variable.dimensions) == zarr_arrays[name].attrs['_ARRAY_DIMENSIONS']
+    for name, group in netcdf_group.groups.items():
+        compare_groups(group, zarr_group[name])
+
+
+@pytest.mark.parametrize('granule_path, product', granules)
+def test_zarr_roundtrip(granule_path, product, tmp_path):
+    out_path = str(tmp_path) + '/'
+    granule = staremaster.create_sidecar_files.get_granule(granule_path, product)
+    granule.load()
+    netcdf_sidecar = granule.create_sidecar(n_workers=1, out_path=out_path)
+    zarr_sidecar = granule.create_sidecar(n_workers=1, out_path=out_path, format='zarr', chunks='auto')
+
+    with netCDF4.Dataset(netcdf_sidecar.file_path, 'r', format='NETCDF4') as netcdf:
+        compare_groups(netcdf, zarr.open_group(zarr_sidecar.file_path, mode='r'))
+
+
+def test_zarr_without_io_lock(tmp_path):
+    granule_path = str(tmp_path / 'MOD05_L2.A2005349.2125.061.2017294065400.hdf')
+    sids = numpy.arange(12, dtype=numpy.uint64).reshape(3, 4)
+    # Another thread (e.g. a granule reader) holds the HDF5 lock for the whole session
+    locked = threading.Event()
+    release = threading.Event()
+    timed_out = []
+
+    def hold_lock():
+        with staremaster.sidecar.IO_LOCK:
+            locked.set()
+            if not release.wait(5):
+                timed_out.append(True)
+
+    thread = threading.Thread(target=hold_lock)
+    thread.start()
+    locked.wait()
+    try:
+        with staremaster.sidecar.Sidecar(granule_path, format='zarr', background_writer=True) as sidecar:
+            sidecar.write_dimensions(3, 4, 0)
+            sidecar.write_sids(sids)
+    finally:
+        release.set()
+        thread.join()
+    # The session did not wait for the lock
+    assert not timed_out
+    assert (zarr.open_group(sidecar.file_path, mode='r')['STARE_index'][:] == sids).all()
+
+
+def test_zarr_reader_cache(tmp_path):
+    granule_path = str(tmp_path / 'MOD05_L2.A2005349.2125.061.2017294065400.hdf')
+
+    def write(level):
+        with staremaster.sidecar.Sidecar(granule_path, format='zarr') as sidecar:
+            sidecar.write_dimensions(3, 4, 0)
+            sidecar.write_sids(numpy.full((3, 4), (1 << 10) | level, dtype=numpy.uint64))
+        return sidecar.file_path
+
+    store = write(9)
+    with staremaster.sidecar.SidecarReader(store) as reader:
+        assert reader.resolution_stats()['max_resolution'] == 9
+    # The chunks are rewritten in place and consolidated again; the directory keeps its mtime
+    store_stat = os.stat(store)
+    zarr.open_group(store, mode='r+')['STARE_index'][:] = numpy.full((3, 4), (1 << 10) | 12, dtype=numpy.uint64)
+    staremaster.zarr_store.consolidate(store)
+    os.utime(store, ns=(store_stat.st_atime_ns, store_stat.st_mtime_ns))
+    with staremaster.sidecar.SidecarReader(store) as reader:
+        assert reader.resolution_stats()['max_resolution'] == 12